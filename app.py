@@ -20,6 +20,15 @@ from pymongo import MongoClient
 
 load_dotenv()
 
+import bulk_writer
+import buy_indicators
+import crosswalk
+import market_movers
+import price_history
+import rulings
+import set_stats
+import tcgplayer_client
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -83,6 +92,19 @@ db = client['mtgdbmongo']
 cards_collection = db['cards']
 products_collection = db['products']
 spotprices_collection = db['spotprices']
+price_history_collection = db[price_history.HISTORY_COLLECTION]
+movers_collection = db[market_movers.MOVERS_COLLECTION]
+set_stats_collection = db[set_stats.SET_STATS_COLLECTION]
+rulings_collection = db[rulings.RULINGS_COLLECTION]
+
+# Price history reads are range scans on one card's snapshots
+try:
+    spotprices_collection.create_index(
+        [("card_id", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)],
+        name="card_id_timestamp_idx"
+    )
+except Exception as e:
+    logger.warning(f"Could not ensure spotprices index: {str(e)}")
 
 
 app.config['TEMPLATES_AUTO_RELOAD'] = True
@@ -119,6 +141,46 @@ def convert_mongo_doc(doc):
 
 
 
+# Known lookup misses are skipped for this long; the CSV importer clears them early
+# for sets that receive new products. The in-process copy is short so that clearing
+# reaches every worker within the hour.
+NEGATIVE_CACHE_TTL = timedelta(days=7)
+NEGATIVE_MEMORY_TTL = 3600
+
+
+def is_known_miss(kind, key, card=None):
+    """
+    Check whether a lookup is a recently recorded miss.
+
+    Args:
+        kind: "tcgplayer_id" or "card_prices"
+        key: Cache key for the in-memory entry (card ID, tcgplayer_id, ...)
+        card: Optional card document carrying the persisted misses
+    """
+    if cache.get(f"miss_{kind}_{key}"):
+        return True
+
+    missed_at = ((card or {}).get(crosswalk.LOOKUP_MISS_FIELD) or {}).get(kind)
+    if missed_at and datetime.now() - missed_at < NEGATIVE_CACHE_TTL:
+        cache.set(f"miss_{kind}_{key}", True, timeout=NEGATIVE_MEMORY_TTL)
+        return True
+
+    return False
+
+
+def record_miss(kind, key, card_id=None):
+    """Remember a lookup miss in memory and, when we know the card, on the card document"""
+    cache.set(f"miss_{kind}_{key}", True, timeout=NEGATIVE_MEMORY_TTL)
+    if card_id:
+        try:
+            cards_collection.update_one(
+                {"id": card_id},
+                {"$set": {f"{crosswalk.LOOKUP_MISS_FIELD}.{kind}": datetime.now()}}
+            )
+        except Exception as e:
+            logger.warning(f"Could not persist {kind} miss for card {card_id}: {str(e)}")
+
+
 def generate_spot_price(card_id, force_update=False):
     """
     Generate spot price data for a card from Scryfall and product collection.
@@ -195,9 +257,9 @@ def generate_spot_price(card_id, force_update=False):
         # Step 2: Try to match with TCGPlayer product data if tcgplayer_id exists
         if card.get("tcgplayer_id"):
             tcgplayer_updated = update_from_tcgplayer(price_data, card.get("tcgplayer_id"))
-        # If no tcgplayer_id, try to match by name and set
-        elif card.get("name") and card.get("set"):
-            tcgplayer_id = find_tcgplayer_id_by_name_and_set(card.get("name"), card.get("set"))
+        # If no tcgplayer_id, try to match by name and set (unless we recently found nothing)
+        elif card.get("name") and card.get("set") and not is_known_miss("tcgplayer_id", card_id, card):
+            tcgplayer_id = find_tcgplayer_id_by_name_and_set(card.get("name"), card.get("set"), card_id)
             if tcgplayer_id:
                 price_data["tcgplayer_id"] = tcgplayer_id
                 tcgplayer_updated = update_from_tcgplayer(price_data, tcgplayer_id)
@@ -349,17 +411,22 @@ def update_from_tcgplayer(price_data, tcgplayer_id):
         return False
 
 
-def find_tcgplayer_id_by_name_and_set(card_name, set_code):
+def find_tcgplayer_id_by_name_and_set(card_name, set_code, card_id=None):
     """
     Find a TCGPlayer ID by matching card name and set
 
     Args:
         card_name: The name of the card
         set_code: The set code
+        card_id: Optional Scryfall ID, used to find a direct crosswalk link
 
     Returns:
         TCGPlayer ID if found, None otherwise
     """
+    miss_key = card_id or f"{card_name}|{set_code}"
+    if is_known_miss("tcgplayer_id", miss_key):
+        return None
+
     try:
         # First try to find the card in our cards collection
         card = cards_collection.find_one({
@@ -372,16 +439,11 @@ def find_tcgplayer_id_by_name_and_set(card_name, set_code):
         if card and card.get("tcgplayer_id"):
             return card.get("tcgplayer_id")
 
-        # If not found, try to match directly in products collection
-        product = products_collection.find_one({
-            "name": {"$regex": f"^{re.escape(card_name)}$", "$options": "i"},
-            "setCode": set_code.upper()  # Assuming setCode in products is uppercase
-        })
-
-        if product and product.get("productId"):
-            return product.get("productId")
-
-        return None
+        # If not found, use the materialized card <-> product crosswalk (indexed name key + set)
+        product_id = crosswalk.product_for_card(db, card_id=card_id, card_name=card_name, set_code=set_code)
+        if product_id is None:
+            record_miss("tcgplayer_id", miss_key, card_id)
+        return product_id
 
     except Exception as e:
         print(f"Error finding TCGPlayer ID: {str(e)}")
@@ -393,7 +455,7 @@ def find_tcgplayer_id_by_name_and_set(card_name, set_code):
 def get_card_rulings(id_value):
     """
     Get rulings for a card by either its Scryfall ID or TCGPlayer ID
-    and store the rulings data array in the rulingsDetails field
+    from the rulings collection (keyed by oracle_id)
     """
     # Initialize MongoDB connection
     client = MongoClient(os.getenv("MONGO_URI"))
@@ -443,153 +505,30 @@ def get_card_rulings(id_value):
 
     logger.info(f"Found card: {card.get('name', 'Unknown')} using {id_type}")
 
-    # Check if we already have rulings data stored
-    if card.get('rulingsDetails'):
-        logger.info(f"Card already has rulings data stored in rulingsDetails")
-        # Convert the MongoDB document to a Python dictionary with ObjectId converted to string
-        card_dict = json.loads(json_util.dumps(card))
-        return jsonify({
-            "message": "Retrieved rulings from database",
-            "card": card_dict
-        })
-
-    # Get the Scryfall ID for constructing the rulings URI
-    scryfall_id = card.get('id')
-    if not scryfall_id:
-        logger.error(f"Card doesn't have a Scryfall ID")
-        return jsonify({
-            "error": "Missing Scryfall ID",
-            "details": "The card was found but doesn't have a Scryfall ID needed for rulings"
-        }), 500
-
-    # Extract or construct the rulings URI
-    rulings_uri = card.get('rulings_uri')
-
-    if not rulings_uri:
-        # Construct the rulings URI from the card ID
-        rulings_uri = f"https://api.scryfall.com/cards/{scryfall_id}/rulings"
-        logger.info(f"Constructed rulings URI: {rulings_uri}")
-
-    # Make request to Scryfall API
-    try:
-        # Add a small delay to respect Scryfall's rate limits
-        time.sleep(0.11)
-
-        logger.info(f"Making request to: {rulings_uri}")
-        response = requests.get(rulings_uri)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-
-        rulings_data = response.json()
-
-        # Extract only the data array from the rulings response
-        rulings_details = rulings_data.get('data', [])
-
-        # Process the rulings to prevent datetime-dictionary operations
-        # Convert any datetime objects to strings to avoid operations between incompatible types
-        processed_rulings = []
-        for ruling in rulings_details:
-            processed_ruling = {}
-            # Safely copy each field
-            for key, value in ruling.items():
-                # Handle the published_at field specifically
-                if key == 'published_at':
-                    # Keep as string to avoid datetime operations
-                    processed_ruling[key] = value
-                # Handle any other datetime fields that might be in the data
-                elif isinstance(value, dict):
-                    # Make a deep copy of dictionaries to avoid reference issues
-                    processed_ruling[key] = dict(value)
-                else:
-                    processed_ruling[key] = value
-            processed_rulings.append(processed_ruling)
-
-        ruling_count = len(processed_rulings)
-        logger.info(f"Got response with {ruling_count} rulings")
-
-        # Update the card document with the processed rulings
-        cards_collection.update_one(
-            {"_id": card["_id"]},
-            {"$set": {"rulingsDetails": processed_rulings}}
-        )
-
-        # Fetch the updated card
-        updated_card = cards_collection.find_one({"_id": card["_id"]})
-
-        # Convert to dictionary with ObjectId converted to string
-        updated_card_dict = json.loads(json_util.dumps(updated_card))
-
-        # Return the updated card with rulings included
-        return jsonify({
-            "message": "Retrieved rulings from Scryfall API and stored in database",
-            "card": updated_card_dict
-        })
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch rulings: {str(e)}")
-        return jsonify({
-            "error": "Failed to fetch rulings",
-            "details": str(e)
-        }), 500
-    except Exception as e:
-        logger.error(f"Error processing rulings for card {card.get('name', 'Unknown')}: {str(e)}")
-        # Log the full exception traceback for debugging
-        import traceback
-        logger.error(traceback.format_exc())
-        return jsonify({
-            "error": "Failed to process rulings",
-            "details": str(e)
-        }), 500
+    # Rulings are shared by every printing and stored once per oracle_id
+    card['rulings'] = rulings.rulings_for(rulings_collection, card)
+    logger.info(f"Card has {len(card['rulings'])} rulings")
 
+    # Convert the MongoDB document to a Python dictionary with ObjectId converted to string
+    card_dict = json.loads(json_util.dumps(card))
+    return jsonify({
+        "message": "Retrieved rulings from database",
+        "card": card_dict
+    })
 
 
 @app.route('/update-all-rulings', methods=['POST'])
 def update_all_rulings():
-    """Update the rulings for all cards in the database"""
-    # This could be a long-running task, consider implementing as a background job
-    client = MongoClient(os.getenv("MONGO_URI"))
-    db = client['mtgdbmongo']
-    cards_collection = db['cards']
-
-    # Find all cards without rulingsData
-    cards_without_rulings = list(cards_collection.find(
-        {"rulingsData": {"$exists": False}},
-        {"id": 1, "name": 1}
-    ))
-
-    logger.info(f"Found {len(cards_without_rulings)} cards without rulings data")
-
-    updated_count = 0
-    for card in cards_without_rulings:
-        card_id = card.get('id')
-        if not card_id:
-            continue
-
-        # Create the rulings URI
-        rulings_uri = f"https://api.scryfall.com/cards/{card_id}/rulings"
-
-        try:
-            # Respect Scryfall's rate limits with a delay between requests
-            time.sleep(0.1)
-
-            response = requests.get(rulings_uri)
-            if response.status_code == 200:
-                rulings_data = response.json()
-
-                # Update the card with the rulings data
-                cards_collection.update_one(
-                    {"id": card_id},
-                    {"$set": {"rulingsData": rulings_data}}
-                )
-
-                updated_count += 1
-                if updated_count % 10 == 0:
-                    logger.info(f"Updated {updated_count} cards so far")
-        except Exception as e:
-            logger.error(f"Error updating rulings for card {card.get('name')}: {str(e)}")
+    """Refresh every card's rulings with one streaming import of the Scryfall rulings bulk file"""
+    try:
+        stats = rulings.refresh_rulings(db)
+    except Exception as e:
+        logger.error(f"Rulings import failed: {str(e)}")
+        return jsonify({"error": "Rulings import failed", "details": str(e)}), 500
 
     return jsonify({
-        "message": f"Updated rulings for {updated_count} cards",
-        "total_cards": len(cards_without_rulings)
+        "message": f"Imported rulings for {stats['oracles']} oracle cards",
+        **stats
     })
 
 
@@ -609,6 +548,7 @@ def fetch_single_card_spot_price(card_input, db=None):
         card_name = "Unknown"
         card_id = None
         tcgplayer_id = None
+        card_doc = None
 
         # Determine what type of input we received
         if isinstance(card_input, dict):
@@ -616,6 +556,7 @@ def fetch_single_card_spot_price(card_input, db=None):
             card_name = card_input.get('name', 'Unknown')
             card_id = card_input.get('id')
             tcgplayer_id = card_input.get('tcgplayer_id')
+            card_doc = card_input
         elif isinstance(card_input, str):
             # It's a card ID string
             card_id = card_input
@@ -660,6 +601,19 @@ def fetch_single_card_spot_price(card_input, db=None):
             logger.debug(f"Cache hit for price of {card_name}")
             return cached_price
 
+        no_price_data = {
+            "card_name": card_name,
+            "card_id": card_id,
+            "normal_price": None,
+            "foil_price": None,
+            "price_last_updated": None,
+            "error": "No price available"
+        }
+
+        # Cards that recently had no price anywhere skip the card_prices query and API call
+        if is_known_miss("card_prices", tcgplayer_id, card_doc):
+            return no_price_data
+
         # If not in cache, fetch from database or API
         if db is None:
             client = MongoClient(os.getenv("MONGO_URI"))
@@ -684,8 +638,9 @@ def fetch_single_card_spot_price(card_input, db=None):
                 "source": "database"
             }
         else:
-            # Fetch from TCGPlayer API
-            price_data = fetch_price_from_tcgplayer_api(tcgplayer_id, card_name, card_id)
+            # Fetch from TCGPlayer API (None when the API could not be asked or failed)
+            api_prices = fetch_prices_from_tcgplayer_api({tcgplayer_id: (card_name, card_id)})
+            price_data = (api_prices or {}).get(tcgplayer_id)
 
             # Store new price in database if API call succeeded
             if price_data and price_data.get('normal_price'):
@@ -696,6 +651,11 @@ def fetch_single_card_spot_price(card_input, db=None):
                     "timestamp": datetime.now(),
                     "card_id": card_id
                 })
+            elif not price_data:
+                # Only an answer without a price is a miss; failed calls are retried next time
+                if api_prices is not None:
+                    record_miss("card_prices", tcgplayer_id, card_id)
+                return no_price_data
 
         # Cache the result for 6 hours
         if price_data:
@@ -715,40 +675,168 @@ def fetch_single_card_spot_price(card_input, db=None):
             "error": str(e)
         }
 
-def fetch_price_from_tcgplayer_api(tcgplayer_id, card_name, card_id):
-    """Helper function to fetch prices from TCGPlayer API"""
-    try:
-        # Your TCGPlayer API implementation here
-        # This is a placeholder
-        api_key = os.getenv("TCGPLAYER_API_KEY")
-        if not api_key:
-            return None
+def fetch_prices_from_tcgplayer_api(cards, db=None):
+    """
+    Fetch live TCGPlayer prices for many cards with batched pricing calls.
 
-        # Example API call (replace with actual implementation)
-        response = requests.get(
-            f"https://api.tcgplayer.com/pricing/product/{tcgplayer_id}",
-            headers={"Authorization": f"Bearer {api_key}"}
-        )
+    Args:
+        cards: Dictionary of tcgplayer_id -> (card_name, card_id)
+        db: Optional database; when given, fetched prices are stored in card_prices
 
-        if response.status_code == 200:
-            data = response.json()
-            # Extract relevant price data
-            return {
-                "card_name": card_name,
-                "card_id": card_id,
-                "normal_price": extract_normal_price(data),
-                "foil_price": extract_foil_price(data),
-                "price_last_updated": datetime.now(),
-                "source": "api"
-            }
-        else:
-            logger.warning(f"TCGPlayer API returned status {response.status_code} for {card_name}")
-            return None
+    Returns:
+        Dictionary of tcgplayer_id -> price data for the cards the API priced, or None
+        when the API is not configured or the call failed
+    """
+    if not cards:
+        return {}
+    client = tcgplayer_client.get_client()
+    if not client.configured:
+        return None
+
+    # A malformed id is skipped on its own rather than failing the whole batch
+    product_ids = {}
+    for tcgplayer_id in cards:
+        try:
+            product_ids[tcgplayer_id] = int(tcgplayer_id)
+        except (TypeError, ValueError):
+            logger.warning(f"Skipping non-numeric TCGPlayer id {tcgplayer_id!r}")
+    if not product_ids:
+        return {}
 
+    try:
+        results = client.get_prices(product_ids.values())
     except Exception as e:
-        logger.error(f"Error in TCGPlayer API call for {card_name}: {str(e)}")
+        logger.error(f"Error in TCGPlayer API call for {len(product_ids)} products: {str(e)}")
         return None
 
+    now = datetime.now()
+    price_data = {}
+    for tcgplayer_id, product_id in product_ids.items():
+        card_name, card_id = cards[tcgplayer_id]
+        entry = results.get(product_id)
+        if not entry:
+            continue
+        price_data[tcgplayer_id] = {
+            "card_name": card_name,
+            "card_id": card_id,
+            "normal_price": tcgplayer_client.normal_price(entry),
+            "foil_price": tcgplayer_client.foil_price(entry),
+            "price_last_updated": now,
+            "source": "api"
+        }
+
+    stored = [
+        {
+            "tcgplayer_id": tcgplayer_id,
+            "normal_price": data["normal_price"],
+            "foil_price": data["foil_price"],
+            "timestamp": now,
+            "card_id": data["card_id"]
+        }
+        for tcgplayer_id, data in price_data.items()
+        if data["normal_price"] is not None
+    ]
+    if db is not None and stored:
+        writer = bulk_writer.AdaptiveBulkWriter(db['card_prices'])
+        writer.extend(pymongo.InsertOne(document) for document in stored)
+        writer.close()
+        writer.report()
+
+    return price_data
+
+
+# Grid prices are memoized per card, so overlapping grids share entries
+PRICE_MEMO_TIMEOUT = 15 * 60
+
+# Upper bound on ids accepted by /api/prices
+MAX_PRICE_IDS = 400
+
+
+def get_prices(card_ids):
+    """
+    Current TCGplayer prices for many cards at once.
+
+    Memoized prices are fetched with a single cache mget; the rest are resolved to
+    tcgplayer ids (card documents, then the crosswalk) and priced from products
+    with one $in query each.
+
+    Args:
+        card_ids: Iterable of Scryfall card IDs
+
+    Returns:
+        Dictionary of card_id -> {tcgplayer_id, market_price, low_price, last_updated};
+        cards without a product map to None
+    """
+    card_ids = list(dict.fromkeys(card_id for card_id in card_ids if card_id))
+    if not card_ids:
+        return {}
+
+    memo_keys = [f"grid_price_{card_id}" for card_id in card_ids]
+    prices = {
+        card_id: memo[0]
+        for card_id, memo in zip(card_ids, cache.get_many(*memo_keys))
+        if memo is not None
+    }
+
+    missing = [card_id for card_id in card_ids if card_id not in prices]
+    if not missing:
+        return prices
+
+    tcgplayer_ids = {
+        card["id"]: card["tcgplayer_id"]
+        for card in cards_collection.find(
+            {"id": {"$in": missing}, "tcgplayer_id": {"$ne": None}},
+            {"_id": 0, "id": 1, "tcgplayer_id": 1}
+        )
+    }
+    unlinked = [card_id for card_id in missing if card_id not in tcgplayer_ids]
+    tcgplayer_ids.update(crosswalk.products_for_cards(db, unlinked))
+
+    products = {
+        product["productId"]: product
+        for product in products_collection.find(
+            {"productId": {"$in": list(set(tcgplayer_ids.values()))}},
+            {"_id": 0, "productId": 1, "marketPrice": 1, "lowPrice": 1, "changed_at": 1, "import_date": 1}
+        )
+    }
+
+    fetched = {}
+    for card_id in missing:
+        product = products.get(tcgplayer_ids.get(card_id))
+        # Memoized as a one-element list so that "no product" is cached too
+        fetched[card_id] = [{
+            "tcgplayer_id": product["productId"],
+            "market_price": product.get("marketPrice"),
+            "low_price": product.get("lowPrice"),
+            "last_updated": product.get("changed_at") or product.get("import_date"),
+        } if product else None]
+
+    cache.set_many(
+        {f"grid_price_{card_id}": memo for card_id, memo in fetched.items()},
+        timeout=PRICE_MEMO_TIMEOUT
+    )
+    prices.update({card_id: memo[0] for card_id, memo in fetched.items()})
+    return prices
+
+
+@app.route('/api/prices')
+def api_prices():
+    """Current prices for a comma-separated list of card IDs (?ids=...)"""
+    card_ids = [card_id.strip() for card_id in request.args.get('ids', '').split(',') if card_id.strip()]
+    if not card_ids:
+        return jsonify({"error": "ids is required"}), 400
+    if len(card_ids) > MAX_PRICE_IDS:
+        return jsonify({"error": f"At most {MAX_PRICE_IDS} ids per request"}), 400
+
+    prices = get_prices(card_ids)
+    return jsonify({
+        card_id: {
+            **price,
+            "last_updated": price["last_updated"].isoformat() if price.get("last_updated") else None
+        } if price else None
+        for card_id, price in prices.items()
+    })
+
 
 @app.route('/artists/<artist_name>')
 @cache.cached(timeout=300)
@@ -763,7 +851,8 @@ def get_cards_by_artist(artist_name):
     ).limit(67))
 
     # Render HTML template with the cards
-    return render_template('artist.html', cards=cards, artist_name=artist_name)
+    return render_template('artist.html', cards=cards, artist_name=artist_name,
+                           prices=get_prices(card['id'] for card in cards if card.get('id')))
 
 
 @app.route('/gallery')
@@ -784,6 +873,7 @@ def art_gallery():
         {'$sample': {'size': 373}},
         {'$project': {
             '_id': 0,
+            'id': 1,
             'name': 1,
             'image_uris.art_crop': 1
         }}
@@ -798,7 +888,8 @@ def art_gallery():
 
     return render_template(
         'gallery.html',
-        cards=cards
+        cards=cards,
+        prices=get_prices(card.get('id') for card in cards)
     )
 
 
@@ -809,8 +900,10 @@ def art_gallery():
 def card_detail(card_id, card_slug=None):
     """Card detail page with rulings"""
     try:
-        # Get the card first
-        card = cards_collection.find_one({"id": card_id})
+        # Get the card first, with its rulings joined by oracle_id
+        card = next(cards_collection.aggregate(
+            [{"$match": {"id": card_id}}, {"$limit": 1}] + rulings.card_rulings_stages()
+        ), None)
         if not card:
             return render_template('error.html', message="Card not found"), 404
 
@@ -834,9 +927,6 @@ def card_detail(card_id, card_slug=None):
         thread.daemon = False
         thread.start()
 
-        # Get rulings
-        rulings = fetch_card_rulings(card_id)
-
         # Get other printings of the same card (English only)
         other_printings = []
         if card.get("oracle_id"):
@@ -858,7 +948,7 @@ def card_detail(card_id, card_slug=None):
         # Render template with all card data
         return render_template('card_detail.html',
                             card=card,
-                            rulings=rulings,
+                            rulings=card['rulings'],
                             other_printings=other_printings,
                             cards_by_artist=cards_by_artist)
 
@@ -867,6 +957,239 @@ def card_detail(card_id, card_slug=None):
         return render_template('error.html', message="An error occurred"), 500
 
 
+def build_card_price_history(card, start, end):
+    """
+    Merge spotprices snapshots and daily product history into one daily series.
+
+    Spot prices supply USD/EUR (and market/low when that is all we have); the daily
+    TCGplayer product history, when the card has a tcgplayer_id, wins for market/low.
+
+    Returns:
+        Tuple of (dates, columns) with columns usd, eur, market and low
+    """
+    days = {}
+
+    snapshots = spotprices_collection.find(
+        {"card_id": card["id"], "timestamp": {"$gte": start, "$lte": end}},
+        {"_id": 0, "timestamp": 1, "prices": 1}
+    ).sort("timestamp", pymongo.ASCENDING)
+
+    for snapshot in snapshots:
+        timestamp = snapshot["timestamp"]
+        day = datetime(timestamp.year, timestamp.month, timestamp.day)
+        prices = snapshot.get("prices") or {}
+        # Later snapshots on the same day overwrite earlier ones
+        values = days.setdefault(day, {})
+        for column in ("usd", "eur", "market", "low"):
+            if prices.get(column) is not None:
+                values[column] = prices[column]
+
+    if card.get("tcgplayer_id"):
+        try:
+            product_history = price_history.read_history(
+                price_history_collection, int(card["tcgplayer_id"]), start=start, end=end
+            )
+        except (TypeError, ValueError):
+            product_history = {"dates": []}
+
+        for i, day in enumerate(product_history["dates"]):
+            values = days.setdefault(day, {})
+            if product_history["marketPrice"][i] is not None:
+                values["market"] = product_history["marketPrice"][i]
+            if product_history["lowPrice"][i] is not None:
+                values["low"] = product_history["lowPrice"][i]
+
+    dates = sorted(days)
+    columns = {
+        column: [days[day].get(column) for day in dates]
+        for column in ("usd", "eur", "market", "low")
+    }
+    return dates, columns
+
+
+@app.route('/api/cards/<card_id>/price-history')
+@cache.cached(timeout=600, query_string=True)
+def api_card_price_history(card_id):
+    """
+    Price history for a card as compact columnar JSON.
+
+    Query params:
+        from, to: ISO dates (YYYY-MM-DD), default to the last year
+        points: Target number of points after downsampling (default 200)
+    """
+    try:
+        end = datetime.strptime(request.args["to"], "%Y-%m-%d") if request.args.get("to") else datetime.now()
+        start = datetime.strptime(request.args["from"], "%Y-%m-%d") if request.args.get("from") else end - timedelta(days=365)
+        points = min(max(int(request.args.get("points", 200)), 2), 2000)
+    except ValueError as e:
+        return jsonify({
+            "error": "Invalid parameters",
+            "details": str(e)
+        }), 400
+
+    # Make `to` inclusive of the whole day
+    end = end.replace(hour=23, minute=59, second=59)
+
+    card = cards_collection.find_one({"id": card_id}, {"_id": 0, "id": 1, "name": 1, "tcgplayer_id": 1})
+    if not card:
+        return jsonify({
+            "error": "Card not found",
+            "provided_id": card_id
+        }), 404
+
+    dates, columns = build_card_price_history(card, start, end)
+    raw_points = len(dates)
+    dates, columns = price_history.downsample_columns(dates, columns, points)
+
+    return jsonify({
+        "card_id": card_id,
+        "name": card.get("name"),
+        "tcgplayer_id": card.get("tcgplayer_id"),
+        "from": start.strftime("%Y-%m-%d"),
+        "to": end.strftime("%Y-%m-%d"),
+        "raw_points": raw_points,
+        "points": len(dates),
+        # Epoch milliseconds, aligned with every price column
+        "t": [int(day.timestamp() * 1000) for day in dates],
+        **columns
+    })
+
+
+def parse_movers_args(args):
+    """Read window/set/rarity filters shared by the movers page and API"""
+    window = int(args.get("window", 1))
+    if window not in market_movers.MOVER_WINDOWS:
+        raise ValueError(f"window must be one of {market_movers.MOVER_WINDOWS}")
+    group_id = int(args["set"]) if args.get("set") else None
+    rarity = args.get("rarity") or None
+    return window, group_id, rarity
+
+
+@app.route('/api/movers')
+@cache.cached(timeout=600, query_string=True)
+def api_movers():
+    """
+    Top gainers and losers, precomputed at import time.
+
+    Query params:
+        window: 1, 7 or 30 (days)
+        set: TCGplayer groupId
+        rarity: TCGplayer rarity (e.g. R, M, U, C)
+    """
+    try:
+        window, group_id, rarity = parse_movers_args(request.args)
+    except ValueError as e:
+        return jsonify({
+            "error": "Invalid parameters",
+            "details": str(e)
+        }), 400
+
+    board = market_movers.read_movers(movers_collection, window, group_id, rarity)
+    if not board:
+        return jsonify({
+            "error": "No movers for these filters",
+            "window": window,
+            "set": group_id,
+            "rarity": rarity
+        }), 404
+
+    return jsonify(convert_mongo_doc(board))
+
+
+@app.route('/api/deals')
+@cache.cached(timeout=600, query_string=True)
+def api_deals():
+    """
+    Products priced furthest below their card's Scryfall price, from stored buy indicators.
+
+    Query params:
+        set: TCGplayer groupId
+        rarity: TCGplayer rarity (e.g. R, M, U, C)
+        min_price: Minimum product price in USD
+        limit: Number of deals (default 50, at most 200)
+    """
+    try:
+        group_id = int(request.args["set"]) if request.args.get("set") else None
+        rarity = request.args.get("rarity") or None
+        min_price = float(request.args["min_price"]) if request.args.get("min_price") else None
+        limit = int(request.args.get("limit", buy_indicators.TOP_DEALS))
+        if limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify({
+            "error": "Invalid parameters",
+            "details": str(e)
+        }), 400
+
+    deals = buy_indicators.read_deals(products_collection, group_id, rarity, min_price, limit)
+    return jsonify({
+        "set": group_id,
+        "rarity": rarity,
+        "min_price": min_price,
+        "count": len(deals),
+        "deals": [convert_mongo_doc(deal) for deal in deals]
+    })
+
+
+@app.route('/movers')
+@cache.cached(timeout=600, query_string=True)
+def movers_page():
+    """Market movers page"""
+    try:
+        window, group_id, rarity = parse_movers_args(request.args)
+    except ValueError:
+        window, group_id, rarity = 1, None, None
+
+    board = market_movers.read_movers(movers_collection, window, group_id, rarity)
+    return render_template('movers.html',
+                           board=board,
+                           window=window,
+                           windows=market_movers.MOVER_WINDOWS,
+                           group_id=group_id,
+                           rarity=rarity)
+
+
+@app.route('/sets')
+@cache.cached(timeout=3600)
+def sets_index():
+    """All sets with their current value, from precomputed set_stats"""
+    sets = list(set_stats_collection.find(
+        {"set": {"$exists": True}},
+        {"_id": 0, "rarities": 0}
+    ).sort("totalValue", pymongo.DESCENDING))
+
+    return render_template('sets.html', sets=sets)
+
+
+@app.route('/sets/<set_code>')
+@cache.cached(timeout=3600)
+def set_detail(set_code):
+    """Set page: one read for the set stats, one for its cards"""
+    set_code = set_code.lower()
+    stats = set_stats_collection.find_one(
+        {"set": set_code},
+        {"_id": 0},
+        sort=[("cardCount", pymongo.DESCENDING)]
+    )
+
+    cards = list(cards_collection.find(
+        {"set": set_code, "lang": "en"},
+        {
+            "_id": 0, "id": 1, "name": 1, "artist": 1, "oracle_text": 1, "printed_text": 1,
+            "flavor_text": 1, "set": 1, "set_name": 1, "tcgplayer_id": 1, "image_uris": 1
+        }
+    ).sort("collector_number", pymongo.ASCENDING))
+
+    if not stats and not cards:
+        return render_template('error.html', message="Set not found"), 404
+
+    set_info = dict(stats or {})
+    set_info.setdefault("set", set_code)
+    set_info["name"] = set_info.get("name") or (cards[0].get("set_name") if cards else set_code.upper())
+
+    return render_template('set.html', set=set_info, cards=cards)
+
+
 
 
 @app.route('/')
@@ -906,7 +1229,8 @@ def index():
             }}
         ]))
 
-        return render_template('home.html', hero_card=hero_card, random_cards=random_cards)
+        return render_template('home.html', hero_card=hero_card, random_cards=random_cards,
+                               prices=get_prices(card.get('id') for card in random_cards))
 
     except Exception as e:
         import traceback
@@ -927,6 +1251,36 @@ def health_check():
 def get_healthy():
     return Response('ok', status=200, mimetype='text/plain')
 
+def claim_spot_price_card(cards_collection, card, stale_before):
+    """
+    Atomically mark a card as being priced, so the batch route and the background
+    updater never work on the same card.
+
+    Returns:
+        The claim time, or None when another worker updated the card first
+    """
+    claimed_at = datetime.now()
+    claimed = cards_collection.find_one_and_update(
+        {
+            "_id": card["_id"],
+            "$or": [
+                {"spot_price_updated": {"$exists": False}},
+                {"spot_price_updated": {"$lt": stale_before}}
+            ]
+        },
+        {"$set": {"spot_price_updated": claimed_at}},
+        projection={"_id": 1}
+    )
+    return claimed_at if claimed else None
+
+
+def release_spot_price_claim(card, claimed_at):
+    """Update that puts back a card's previous spot_price_updated after a failed attempt"""
+    previous = card.get("spot_price_updated")
+    update = {"$set": {"spot_price_updated": previous}} if previous else {"$unset": {"spot_price_updated": ""}}
+    return pymongo.UpdateOne({"_id": card["_id"], "spot_price_updated": claimed_at}, update)
+
+
 @app.route('/process_batch', methods=['GET'])
 def process_batch():
     start_time = datetime.now()
@@ -965,12 +1319,23 @@ def process_batch():
 
         logger.info(f"[Batch-{batch_id}] Selected {len(random_cards)} cards for spot price update")
 
+        # Refresh live TCGPlayer prices for the whole batch (250 products per pricing call)
+        live_prices = fetch_prices_from_tcgplayer_api({
+            card["tcgplayer_id"]: (card.get("name"), card.get("id"))
+            for card in random_cards if card.get("tcgplayer_id")
+        }, db) or {}
+        logger.info(f"[Batch-{batch_id}] Stored live TCGPlayer prices for {len(live_prices)} products")
+
         # Process each card
         processed_count = 0
         spot_prices_created = 0
         errors_count = 0
         skipped_count = 0
 
+        # Cards are claimed one by one before they are priced; releases of failed
+        # claims are batched, sized by the cluster's write latency
+        spot_marks = bulk_writer.AdaptiveBulkWriter(cards_collection, name="spot_price_updated")
+
         for i, card in enumerate(random_cards, 1):
             card_id = card.get("id")  # This is the Scryfall ID
             card_name = card.get('name', 'unknown')
@@ -982,6 +1347,12 @@ def process_batch():
                 skipped_count += 1
                 continue
 
+            # The background updater may have taken this card since the batch was selected
+            claimed_at = claim_spot_price_card(cards_collection, card, thirteen_hours_ago)
+            if not claimed_at:
+                skipped_count += 1
+                continue
+
             logger.info(
                 f"[Batch-{batch_id}] [{i}/{len(random_cards)}] Processing {card_name} ({card_set}-{card_number})")
 
@@ -996,18 +1367,16 @@ def process_batch():
                     skipped_count += 1
                     logger.warning(f"[Batch-{batch_id}] No spot price data created for {card_name}")
 
+                # The claim stays as the card's mark, regardless of success
                 processed_count += 1
 
-                # Mark this card as processed regardless of success
-                cards_collection.update_one(
-                    {"_id": card["_id"]},
-                    {"$set": {"spot_price_updated": datetime.now()}}
-                )
-
             except Exception as e:
                 errors_count += 1
                 logger.error(f"[Batch-{batch_id}] Error processing {card_name}: {str(e)}", exc_info=True)
+                spot_marks.add(release_spot_price_claim(card, claimed_at))
 
+        spot_marks.close()
+        writes = spot_marks.report()
         duration = datetime.now() - start_time
 
         # Log summary statistics
@@ -1022,6 +1391,7 @@ def process_batch():
             f'- {errors_count} errors encountered\n'
             f'- {skipped_count} cards skipped\n'
             f'- {len(random_cards)} total cards selected\n'
+            f'- {writes["ops_per_second"]:.0f} writes/second ({writes["batches"]} bulk writes)\n'
             f'- Time elapsed: {duration.total_seconds():.2f} seconds',
             status=200,
             mimetype='text/plain'
@@ -1093,6 +1463,11 @@ def continuous_price_updater(mongo_uri):
                     logger.warning(f"Card missing Scryfall ID: {card_name} - skipping")
                     continue
 
+                # /process_batch may be pricing this card right now
+                claimed_at = claim_spot_price_card(cards_collection, card, twelve_hours_ago)
+                if not claimed_at:
+                    continue
+
                 try:
                     # Generate spot price for this card
                     from main import generate_spot_price  # Import locally to avoid circular imports
@@ -1104,12 +1479,7 @@ def continuous_price_updater(mongo_uri):
                     else:
                         logger.warning(f"No spot price data created for {card_name}")
 
-                    # Mark this card as processed regardless of success
-                    cards_collection.update_one(
-                        {"_id": card["_id"]},
-                        {"$set": {"spot_price_updated": datetime.now()}}
-                    )
-
+                    # The claim stays as the card's mark, regardless of success
                     processed_count += 1
 
                     # Small delay between individual cards to avoid hammering APIs
@@ -1117,6 +1487,7 @@ def continuous_price_updater(mongo_uri):
 
                 except Exception as e:
                     logger.error(f"Error processing {card_name}: {str(e)}", exc_info=True)
+                    cards_collection.bulk_write([release_spot_price_claim(card, claimed_at)])
 
             # Calculate batch processing time
             batch_processing_time = time.time() - batch_start_time
@@ -1222,153 +1593,9 @@ def gemma_search():
 
     return render_template('search_form.html')
 
-# Troubleshooting the rulings fetch
 import requests
 import time
 
-def fetch_card_rulings(card_id, force_update=False):
-    """
-    Fetch rulings for a card from Scryfall API and save to the card document.
-
-    Args:
-        card_id: The Scryfall ID of the card
-        force_update: If True, fetches from API even if we have cached rulings
-
-    Returns:
-        List of rulings for the card
-    """
-    # Check if we already have recent rulings in the database
-    card = cards_collection.find_one({"id": card_id})
-
-    if not card:
-        print(f"Card {card_id} not found in database")
-        return []
-
-    # Check if we already have recent rulings and don't need to force update
-    if not force_update and card.get("rulings") and card.get("rulings_last_updated"):
-        last_updated = card.get("rulings_last_updated")
-        if last_updated and (datetime.now() - last_updated).days < 30:
-            print(f"Using cached rulings for card {card_id}")
-            return card.get("rulings", [])
-
-    # Fetch fresh rulings from Scryfall
-    try:
-        # Use proper URL format for rulings endpoint
-        url = f"https://api.scryfall.com/cards/{card_id}/rulings"
-
-        # Add logging for debugging
-        print(f"Fetching rulings from: {url}")
-
-        # Add proper headers and respect rate limits
-        headers = {
-            'User-Agent': 'MTGAppName/1.0 (your@email.com)'  # Replace with your app info
-        }
-
-        # Make the request with proper error handling
-        response = requests.get(url, headers=headers)
-
-        # Check if we hit a rate limit
-        if response.status_code == 429:
-            # Wait and retry once
-            print("Rate limited, waiting 1 second...")
-            time.sleep(1)
-            response = requests.get(url, headers=headers)
-
-        # Validate response
-        response.raise_for_status()
-
-        # Parse the response
-        data = response.json()
-
-        # Check if we got rulings data
-        if 'data' in data:
-            rulings = data['data']
-            rulings_count = len(rulings)
-            print(f"Found {rulings_count} rulings for card {card_id}")
-
-            # Update the card document with rulings data
-            cards_collection.update_one(
-                {"id": card_id},
-                {
-                    "$set": {
-                        "rulings": rulings,  # Store in card.rulings
-                        "rulings_count": rulings_count,
-                        "rulings_last_updated": datetime.now()
-                    }
-                }
-            )
-
-            return rulings
-        else:
-            print("No 'data' field in rulings response")
-            # Save empty rulings to avoid repeated failed requests
-            cards_collection.update_one(
-                {"id": card_id},
-                {
-                    "$set": {
-                        "rulings": [],  # Store empty list in card.rulings
-                        "rulings_count": 0,
-                        "rulings_last_updated": datetime.now()
-                    }
-                }
-            )
-            return []
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching rulings: {str(e)}")
-        # Return existing rulings if available
-        if card and card.get("rulings"):
-            return card.get("rulings", [])
-        return []
-    except ValueError as e:
-        print(f"Error parsing rulings JSON: {str(e)}")
-        return []
-
-# Batch processing function to populate rulings for all cards
-def populate_rulings_for_all_cards(batch_size=100, delay_seconds=0.1):
-    """
-    Populate rulings for all cards in the database.
-    Use this for initial population or periodic full updates.
-
-    Args:
-        batch_size: Number of cards to process in each batch
-        delay_seconds: Delay between API calls to avoid rate limiting
-    """
-    from datetime import timedelta
-
-    # Get all cards that don't have rulings or haven't been updated recently
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-
-    # Find cards needing rulings update
-    cards_needing_rulings = list(cards_collection.find(
-        {
-            "$or": [
-                {"rulings_data": {"$exists": False}},
-                {"rulings_last_updated": {"$lt": thirty_days_ago}}
-            ]
-        },
-        {"id": 1}
-    ).limit(1000))  # Process in chunks of 1000 cards
-
-    print(f"Found {len(cards_needing_rulings)} cards needing rulings updates")
-
-    # Process in batches with rate limiting
-    for i in range(0, len(cards_needing_rulings), batch_size):
-        batch = cards_needing_rulings[i:i + batch_size]
-        print(
-            f"Processing batch {i // batch_size + 1} of {(len(cards_needing_rulings) + batch_size - 1) // batch_size}")
-
-        for card in batch:
-            card_id = card.get("id")
-            if card_id:
-                # Fetch and save rulings
-                fetch_card_rulings(card_id)
-
-                # Wait to avoid rate limiting
-                time.sleep(delay_seconds)
-
-        print(f"Completed batch {i // batch_size + 1}")
-
 async def fetch_url(session, url):
     """Fetch a single URL and return the status"""
     try:
@@ -0,0 +1,292 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import AutoReconnect, BulkWriteError, ExecutionTimeout, NetworkTimeout, WTimeoutError
+
+# Batch latency the writers aim for; batches that take longer (or fail) make every
+# writer back off so imports leave headroom for the web app's queries
+TARGET_LATENCY = float(os.getenv("BULK_WRITE_TARGET_LATENCY_MS", 250)) / 1000
+
+# Operations per bulk_write: start small, grow additively, halve on congestion
+MIN_BATCH = 100
+INITIAL_BATCH = 1000
+MAX_BATCH = 10000
+BATCH_STEP = 500
+
+# Bulk writes in flight at once; one more after every CONCURRENCY_STREAK batches
+# under the target latency, halved on errors or when the batch cannot shrink further
+MAX_CONCURRENCY = int(os.getenv("BULK_WRITE_MAX_CONCURRENCY", 4))
+CONCURRENCY_STREAK = 8
+
+DECREASE_FACTOR = 0.5
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Server error codes worth retrying: elections, shutdowns, timeouts, throttling
+TRANSIENT_CODES = {
+    6, 7, 50, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436, 16500
+}
+DUPLICATE_KEY = 11000
+
+TRANSIENT_EXCEPTIONS = (AutoReconnect, NetworkTimeout, ExecutionTimeout, WTimeoutError)
+
+COUNT_FIELDS = ("nInserted", "nUpserted", "nMatched", "nModified", "nRemoved")
+
+
+def empty_counts():
+    return dict.fromkeys(COUNT_FIELDS, 0)
+
+
+def add_counts(counts, details):
+    for field in COUNT_FIELDS:
+        counts[field] += details.get(field, 0)
+    return counts
+
+
+class WriteThrottle:
+    """
+    AIMD controller for bulk writes against a shared cluster.
+
+    Every finished bulk write reports its latency. Batches under the target latency
+    grow the batch size by BATCH_STEP, and every CONCURRENCY_STREAK of them adds one
+    write in flight. A slow batch halves the batch size; a failed one (or a slow one
+    at MIN_BATCH) also halves the writes in flight. Only one decrease is
+    applied per congestion event: batches that started before the last decrease
+    do not decrease again.
+    """
+
+    def __init__(self, target_latency=TARGET_LATENCY, min_batch=MIN_BATCH, initial_batch=INITIAL_BATCH,
+                 max_batch=MAX_BATCH, max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES):
+        self.target_latency = target_latency
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.batch_size = max(min_batch, min(initial_batch, max_batch))
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = 1
+        self.max_retries = max_retries
+
+        self.epoch = 0
+        self.streak = 0
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+        self.operations = 0
+        self.batches = 0
+        self.retries = 0
+        self.decreases = 0
+        self.write_seconds = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def acquire(self):
+        """Wait for a free write slot (the caller releases it when its write is done)"""
+        with self.condition:
+            while self.in_flight >= self.concurrency:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record(self, operations, started, seconds, congested, epoch):
+        with self.condition:
+            self.operations += operations
+            self.batches += 1
+            self.write_seconds += seconds
+            self.first_start = started if self.first_start is None else min(self.first_start, started)
+            self.last_end = max(self.last_end or 0.0, started + seconds)
+
+            if congested or seconds > self.target_latency:
+                if epoch == self.epoch:
+                    self.epoch += 1
+                    self.decreases += 1
+                    # Slow batches shrink first; errors, or slow batches that are already
+                    # as small as allowed, also take writes out of flight
+                    if congested or self.batch_size <= self.min_batch:
+                        self.concurrency = max(1, int(self.concurrency * DECREASE_FACTOR))
+                        self.streak = 0
+                    self.batch_size = max(self.min_batch, int(self.batch_size * DECREASE_FACTOR))
+                return
+
+            self.batch_size = min(self.max_batch, self.batch_size + BATCH_STEP)
+            self.streak += 1
+            if self.streak >= CONCURRENCY_STREAK and self.concurrency < self.max_concurrency:
+                self.streak = 0
+                self.concurrency += 1
+                self.condition.notify_all()
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+
+    def execute(self, collection, operations):
+        """
+        Run one unordered bulk write, retrying transient failures, and adapt to its latency.
+
+        Only the operations that failed with a transient error are retried. Duplicate
+        keys on a retry are writes that landed before the connection dropped.
+
+        Returns:
+            Dictionary of nInserted, nUpserted, nMatched, nModified and nRemoved
+        """
+        counts = empty_counts()
+        remaining = list(operations)
+        attempt = 0
+        while remaining:
+            with self.condition:
+                epoch = self.epoch
+            started = time.monotonic()
+            retry = []
+            fatal = False
+            try:
+                add_counts(counts, collection.bulk_write(remaining, ordered=False).bulk_api_result)
+                congested = False
+            except BulkWriteError as e:
+                error = e
+                add_counts(counts, e.details)
+                for write_error in e.details.get("writeErrors", []):
+                    if write_error["code"] in TRANSIENT_CODES:
+                        retry.append(remaining[write_error["index"]])
+                    elif not (attempt and write_error["code"] == DUPLICATE_KEY):
+                        fatal = True
+                # A write concern error means the writes applied but replication is lagging
+                congested = bool(retry or e.details.get("writeConcernErrors"))
+            except TRANSIENT_EXCEPTIONS as e:
+                error = e
+                retry = remaining
+                congested = True
+
+            # Retried operations count once towards throughput
+            self.record(0 if attempt else len(remaining), started, time.monotonic() - started, congested, epoch)
+            if fatal:
+                raise error
+            if not retry:
+                break
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            with self.condition:
+                self.retries += 1
+            self._backoff(attempt)
+            remaining = retry
+        return counts
+
+    def summary(self):
+        """
+        Returns:
+            Dictionary of operations written, batches, retries, decreases, seconds
+            (wall clock from the first write to the last), effective operations per
+            second, mean batch latency and the current batch size/concurrency
+        """
+        with self.condition:
+            seconds = (self.last_end - self.first_start) if self.batches else 0.0
+            return {
+                "operations": self.operations,
+                "batches": self.batches,
+                "retries": self.retries,
+                "decreases": self.decreases,
+                "seconds": round(seconds, 2),
+                "ops_per_second": round(self.operations / seconds, 1) if seconds > 0 else 0.0,
+                "mean_latency": round(self.write_seconds / self.batches, 3) if self.batches else 0.0,
+                "batch_size": self.batch_size,
+                "concurrency": self.concurrency,
+                "target_latency": self.target_latency,
+            }
+
+    def report(self, label):
+        summary = self.summary()
+        print(f"{label}: {summary['operations']} writes in {summary['batches']} batches, "
+              f"{summary['ops_per_second']:.0f} ops/second over {summary['seconds']:.2f} seconds "
+              f"(mean batch {summary['mean_latency'] * 1000:.0f} ms vs target {self.target_latency * 1000:.0f} ms, "
+              f"{summary['decreases']} backoffs, {summary['retries']} retries, "
+              f"settled at {summary['batch_size']} ops x {summary['concurrency']})")
+        return summary
+
+
+class AdaptiveBulkWriter:
+    """
+    Buffer write operations for one collection and flush them through a WriteThrottle.
+
+    Flushes run on background threads; add() blocks when every write slot is busy,
+    so a congested cluster slows the producer down instead of queueing without bound.
+
+        with AdaptiveBulkWriter(db["products"], name="usd prices") as writer:
+            for operation in operations:
+                writer.add(operation)
+        writer.report()
+    """
+
+    def __init__(self, collection, throttle=None, name=None):
+        self.collection = collection
+        self.throttle = throttle or WriteThrottle()
+        self.name = name or collection.name
+        self.counts = empty_counts()
+        self.buffer = []
+        self.pending = deque()
+        self.pool = ThreadPoolExecutor(max_workers=self.throttle.max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.shutdown(wait=True)
+        return False
+
+    def add(self, operation):
+        self.buffer.append(operation)
+        if len(self.buffer) >= self.throttle.batch_size:
+            self.flush()
+
+    def extend(self, operations):
+        for operation in operations:
+            self.add(operation)
+
+    def _write(self, operations):
+        try:
+            return self.throttle.execute(self.collection, operations)
+        finally:
+            self.throttle.release()
+
+    def _collect(self, wait=False):
+        while self.pending and (wait or self.pending[0].done()):
+            add_counts(self.counts, self.pending.popleft().result())
+
+    def flush(self):
+        if not self.buffer:
+            return
+        operations, self.buffer = self.buffer, []
+        self.throttle.acquire()
+        self.pending.append(self.pool.submit(self._write, operations))
+        self._collect()
+
+    def drain(self):
+        """Write what is buffered and wait for every write so far (the writer stays open)"""
+        self.flush()
+        self._collect(wait=True)
+
+    def close(self):
+        """
+        Write what is still buffered and wait for every write to finish.
+
+        Returns:
+            Dictionary of nInserted, nUpserted, nMatched, nModified and nRemoved
+        """
+        self.flush()
+        try:
+            self._collect(wait=True)
+        finally:
+            self.pool.shutdown(wait=True)
+        return self.counts
+
+    def report(self):
+        return self.throttle.report(f"Bulk writes to {self.name}")
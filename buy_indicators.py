@@ -0,0 +1,424 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pymongo
+
+import bulk_writer
+import crosswalk
+import price_matrix
+import snapshots
+
+# TCGplayer price compared against the linked card's Scryfall price
+PRODUCT_PRICE_FIELD = "marketPrice"
+
+# Price gaps smaller than this are treated as no advantage (buy_indicator 0)
+MIN_PRICE_GAP = 0.01
+
+# Groups are loaded and scored concurrently; each worker holds one group's columns
+GROUP_WORKERS = 8
+
+# Cards are fetched by id in chunks of this many ids per query
+CARD_CHUNK_SIZE = 20000
+
+PRODUCT_COLUMNS = ["productId", "groupId", "name", "subTypeName", "extRarity", PRODUCT_PRICE_FIELD]
+
+# Scryfall price strings, flattened server-side
+CARD_PRICE_COLUMNS = {
+    "card_price_usd": "$prices.usd",
+    "card_price_usd_foil": "$prices.usd_foil",
+    "card_price_eur": "$prices.eur",
+    "card_price_eur_foil": "$prices.eur_foil",
+}
+
+# Persisted indicators: a `deal` sub-document on each scored product
+DEAL_FIELD = "deal"
+DEAL_RUNS_COLLECTION = "deal_runs"
+
+# Card prices seen by the last run, to find the cards whose price changed since
+DEAL_STATE_FILE = "deal_card_prices.npz"
+
+# Products per $in query when reloading only the changed ones
+PRODUCT_CHUNK_SIZE = 20000
+
+TOP_DEALS = 50
+MAX_TOP_DEALS = 200
+
+
+def stream_columns(cursor, columns):
+    """Stream projected documents into one list per column; no documents are kept"""
+    values = {column: [] for column in columns}
+    for document in cursor:
+        for column in columns:
+            values[column].append(document.get(column))
+    return pd.DataFrame(values, columns=columns)
+
+
+def load_links(db):
+    """productId -> card_id and match method, from the card <-> product crosswalk"""
+    links = stream_columns(
+        db[crosswalk.LINKS_COLLECTION].find({}, {"_id": 0, "productId": 1, "card_id": 1, "method": 1, "updated_at": 1}),
+        ["productId", "card_id", "method", "updated_at"]
+    )
+    links["productId"] = pd.to_numeric(links["productId"], errors="coerce")
+    return links[links["productId"].notna()].drop_duplicates("productId")
+
+
+def _card_chunk(db, card_ids):
+    frame = stream_columns(
+        db["cards"].aggregate([
+            {"$match": {"id": {"$in": card_ids}}},
+            {"$project": {"_id": 0, "id": 1, **CARD_PRICE_COLUMNS}}
+        ]),
+        ["id", *CARD_PRICE_COLUMNS]
+    )
+    for column in CARD_PRICE_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors="coerce").astype("float64")
+    return frame
+
+
+def load_card_prices(db, card_ids, executor):
+    """Scryfall USD/EUR (and foil) prices of the given cards as float columns"""
+    card_ids = list(card_ids)
+    chunks = [card_ids[i:i + CARD_CHUNK_SIZE] for i in range(0, len(card_ids), CARD_CHUNK_SIZE)]
+    frames = list(executor.map(lambda chunk: _card_chunk(db, chunk), chunks))
+    if not frames:
+        return pd.DataFrame(columns=["id", *CARD_PRICE_COLUMNS])
+    return pd.concat(frames, ignore_index=True).drop_duplicates("id")
+
+
+def compute_indicators(product_price, card_price):
+    """
+    Vectorized buy indicators for aligned arrays of product and card prices.
+
+    buy_indicator is the lower of the two prices over the absolute gap between them
+    (0 when the gap is under MIN_PRICE_GAP). percent_off_delta is the gap as a
+    percentage of the card price (0 for a card price of 0). Either is NaN when a
+    price is missing.
+
+    Returns:
+        (buy_indicator, percent_off_delta) float64 arrays
+    """
+    product_price = np.asarray(product_price, dtype=np.float64)
+    card_price = np.asarray(card_price, dtype=np.float64)
+    delta = product_price - card_price
+    gap = np.abs(delta)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        buy_indicator = np.where(gap < MIN_PRICE_GAP, 0.0, np.fmin(product_price, card_price) / gap)
+        percent_off_delta = np.where(card_price > 0, delta / card_price * 100, 0.0)
+    missing = np.isnan(delta)
+    buy_indicator[missing] = np.nan
+    percent_off_delta[missing] = np.nan
+    return buy_indicator, percent_off_delta
+
+
+def load_products(db, query):
+    """Projected products matching `query` as columns"""
+    products = stream_columns(
+        db["products"].find(query, {"_id": 0, **{column: 1 for column in PRODUCT_COLUMNS}}),
+        PRODUCT_COLUMNS
+    )
+    products["productId"] = pd.to_numeric(products["productId"], errors="coerce")
+    products["product_price"] = pd.to_numeric(products.pop(PRODUCT_PRICE_FIELD), errors="coerce").astype("float64")
+    return products
+
+
+def score_products(products, links, card_prices):
+    """
+    Join projected products to their linked cards and score them.
+
+    Returns:
+        DataFrame with one row per product
+    """
+    frame = products.merge(links.drop(columns="updated_at"), on="productId", how="left")
+    frame = frame.merge(card_prices, left_on="card_id", right_on="id", how="left").drop(columns="id")
+
+    # Foil products are compared with the card's foil price
+    foil = frame["subTypeName"].eq("Foil").to_numpy()
+    card_price = np.where(foil, frame["card_price_usd_foil"].to_numpy(), frame["card_price_usd"].to_numpy())
+    frame["buy_indicator"], frame["percent_off_delta"] = compute_indicators(frame["product_price"], card_price)
+    return frame.rename(columns={"extRarity": "rarity", "method": "match_method"})
+
+
+def score_group(db, game_id, group_id, links, card_prices):
+    """Stream one group's projected products and score them"""
+    return score_products(load_products(db, {"gameId": game_id, "groupId": group_id}), links, card_prices)
+
+
+def _score_groups(db, game_id, group_ids, links, card_prices, executor):
+    frames = list(executor.map(
+        lambda group_id: score_group(db, game_id, group_id, links, card_prices),
+        group_ids
+    ))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def compute_all(db, game_id=crosswalk.MTG_GAME_ID, group_ids=None, workers=GROUP_WORKERS):
+    """
+    Buy indicators for every product of `game_id` (or only the given groups).
+
+    Links and card prices are loaded once; groups are then streamed and scored in
+    parallel, each holding only its projected columns.
+
+    Returns:
+        DataFrame of productId, groupId, name, subTypeName, rarity, product_price,
+        card_id, match_method, card prices, buy_indicator and percent_off_delta
+    """
+    start = time.time()
+    if group_ids is None:
+        group_ids = db["products"].distinct("groupId", {"gameId": game_id})
+    group_ids = sorted(group_id for group_id in group_ids if group_id is not None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        links = load_links(db)
+        card_prices = load_card_prices(db, links["card_id"].dropna().unique(), executor)
+        print(f"Loaded {len(links)} links and prices for {len(card_prices)} cards "
+              f"in {time.time() - start:.2f} seconds")
+
+        scored = _score_groups(db, game_id, group_ids, links, card_prices, executor)
+
+    elapsed = time.time() - start
+    print(f"Scored {len(scored)} products in {len(group_ids)} groups in {elapsed:.2f} seconds "
+          f"({len(scored) / elapsed if elapsed else 0:.0f} products/second)")
+    return scored
+
+
+def compute_from_snapshot(game_id=crosswalk.MTG_GAME_ID, root=snapshots.SNAPSHOT_DIR):
+    """
+    Same scores as compute_all, read from the nightly columnar snapshots instead of Mongo.
+
+    Raises FileNotFoundError when no snapshot has been exported yet.
+
+    Returns:
+        DataFrame as returned by compute_all
+    """
+    start = time.time()
+    products = snapshots.load("products", PRODUCT_COLUMNS, root, gameId=game_id)
+    products["product_price"] = products.pop(PRODUCT_PRICE_FIELD).astype("float64")
+    links = snapshots.load("card_product_links", ["productId", "card_id", "method", "updated_at"], root)
+    card_prices = snapshots.load("cards", ["id", "usd", "usd_foil", "eur", "eur_foil"], root).rename(columns={
+        "usd": "card_price_usd", "usd_foil": "card_price_usd_foil",
+        "eur": "card_price_eur", "eur_foil": "card_price_eur_foil"
+    })
+    scored = score_products(products, links.drop_duplicates("productId"), card_prices.drop_duplicates("id"))
+    print(f"Scored {len(scored)} products from the snapshot in {time.time() - start:.2f} seconds")
+    return scored
+
+
+def latest_import(db):
+    """When products were last imported (newest per-group import marker), or None"""
+    marker = db["import_groups"].find_one({}, {"_id": 0, "import_date": 1}, sort=[("import_date", pymongo.DESCENDING)])
+    return marker.get("import_date") if marker else None
+
+
+def compute(db, game_id=crosswalk.MTG_GAME_ID, root=snapshots.SNAPSHOT_DIR):
+    """
+    Scores from the latest snapshot when it was exported after the last product import,
+    otherwise from Mongo with compute_all.
+
+    Returns:
+        DataFrame as returned by compute_all
+    """
+    export_id = snapshots.latest_export(root)
+    imported_at = latest_import(db)
+    if export_id and (imported_at is None or snapshots.export_started(export_id) >= imported_at):
+        try:
+            return compute_from_snapshot(game_id, root)
+        except FileNotFoundError:
+            pass
+    elif export_id:
+        print(f"Snapshot {export_id} predates the product import of {imported_at}, scoring from Mongo")
+    return compute_all(db, game_id)
+
+
+def ensure_deal_indexes(db):
+    """
+    Indexes for /api/deals and for finding changed products.
+
+    Only discounted products (priced below their card) are indexed. Each filter
+    combination is one indexed read ordered by discount: set + rarity, rarity only,
+    or neither. Set-only queries use the set + rarity prefix and sort one set's deals.
+    """
+    collection = db["products"]
+    discounted = {f"{DEAL_FIELD}.percentOffDelta": {"$lt": 0}}
+    for name, prefix in (
+        ("deal_groupId_rarity_idx", [f"{DEAL_FIELD}.groupId", f"{DEAL_FIELD}.rarity"]),
+        ("deal_rarity_idx", [f"{DEAL_FIELD}.rarity"]),
+        ("deal_top_idx", []),
+    ):
+        collection.create_index(
+            [(field, pymongo.ASCENDING) for field in prefix]
+            + [(f"{DEAL_FIELD}.percentOffDelta", pymongo.ASCENDING), (f"{DEAL_FIELD}.price", pymongo.ASCENDING)],
+            partialFilterExpression=discounted,
+            name=name
+        )
+    collection.create_index([("gameId", pymongo.ASCENDING), ("changed_at", pymongo.ASCENDING)],
+                            name="gameId_changed_at_idx")
+    return collection
+
+
+def load_card_state(path=price_matrix.PRICE_MATRIX_DIR):
+    """Card prices saved by the last run, or None"""
+    state_path = os.path.join(path, DEAL_STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    saved = np.load(state_path, allow_pickle=False)
+    return pd.DataFrame({
+        "id": saved["ids"].astype(object),
+        "card_price_usd": saved["usd"],
+        "card_price_usd_foil": saved["usd_foil"],
+    })
+
+
+def save_card_state(card_prices, path=price_matrix.PRICE_MATRIX_DIR):
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, DEAL_STATE_FILE + ".tmp.npz")
+    np.savez(
+        tmp_path,
+        ids=np.array(card_prices["id"].astype(str).tolist(), dtype=str),
+        usd=card_prices["card_price_usd"].to_numpy(dtype=np.float64),
+        usd_foil=card_prices["card_price_usd_foil"].to_numpy(dtype=np.float64)
+    )
+    os.replace(tmp_path, os.path.join(path, DEAL_STATE_FILE))
+
+
+def changed_cards(previous, current):
+    """Ids of cards whose USD or foil price differs from the previous run (NaN == NaN)"""
+    joined = current.merge(previous, on="id", how="left", suffixes=("", "_previous"), indicator=True)
+    changed = joined["_merge"].eq("left_only").to_numpy().copy()
+    for column in ("card_price_usd", "card_price_usd_foil"):
+        now = joined[column].to_numpy(dtype=np.float64)
+        before = joined[f"{column}_previous"].to_numpy(dtype=np.float64)
+        changed |= ~((now == before) | (np.isnan(now) & np.isnan(before)))
+    return set(joined.loc[changed, "id"])
+
+
+def _deal_operation(row, game_id, now):
+    key = {"productId": int(row.productId), "gameId": game_id}
+    if np.isnan(row.buy_indicator):
+        return pymongo.UpdateOne(key, {"$unset": {DEAL_FIELD: ""}})
+    return pymongo.UpdateOne(key, {"$set": {DEAL_FIELD: {
+        "groupId": None if pd.isna(row.groupId) else int(row.groupId),
+        "rarity": row.rarity if isinstance(row.rarity, str) else None,
+        "price": round(float(row.product_price), 2),
+        "cardPrice": round(float(row.card_price), 2),
+        "cardId": row.card_id,
+        "buyIndicator": round(float(row.buy_indicator), 4),
+        "percentOffDelta": round(float(row.percent_off_delta), 2),
+        "updatedAt": now
+    }}})
+
+
+def update_deals(db, game_id=crosswalk.MTG_GAME_ID, rebuild=False, workers=GROUP_WORKERS,
+                 state_path=price_matrix.PRICE_MATRIX_DIR):
+    """
+    Recompute and store buy indicators for products whose inputs changed since the last run.
+
+    A product is rescored when its row changed (changed_at), its crosswalk link was
+    written, or its linked card's USD/foil price moved. The first run, a missing
+    state file or `rebuild` score every group.
+
+    Returns:
+        Number of products rescored
+    """
+    start = time.time()
+    started_at = datetime.now()
+    ensure_deal_indexes(db)
+    runs = db[DEAL_RUNS_COLLECTION]
+    last_run = None if rebuild else runs.find_one({"gameId": game_id}, sort=[("started_at", pymongo.DESCENDING)])
+    previous = None if last_run is None else load_card_state(state_path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        links = load_links(db)
+        card_prices = load_card_prices(db, links["card_id"].dropna().unique(), executor)
+
+        if previous is None:
+            mode = "full"
+            group_ids = sorted(g for g in db["products"].distinct("groupId", {"gameId": game_id}) if g is not None)
+            scored = _score_groups(db, game_id, group_ids, links, card_prices, executor)
+        else:
+            mode = "incremental"
+            since = last_run["started_at"]
+            moved = changed_cards(previous, card_prices)
+            relinked = links["updated_at"].notna() & (pd.to_datetime(links["updated_at"]) > since)
+            product_ids = links.loc[links["card_id"].isin(moved) | relinked, "productId"].astype(int).tolist()
+            queries = [{"gameId": game_id, "changed_at": {"$gt": since}}] + [
+                {"gameId": game_id, "productId": {"$in": product_ids[i:i + PRODUCT_CHUNK_SIZE]}}
+                for i in range(0, len(product_ids), PRODUCT_CHUNK_SIZE)
+            ]
+            products = pd.concat(list(executor.map(lambda query: load_products(db, query), queries)),
+                                 ignore_index=True).drop_duplicates("productId")
+            scored = score_products(products, links, card_prices)
+            print(f"Deals: {len(moved)} cards changed price, {len(products)} products to rescore")
+
+    if not scored.empty:
+        foil = scored["subTypeName"].eq("Foil")
+        scored["card_price"] = scored["card_price_usd_foil"].where(foil, scored["card_price_usd"])
+        writer = bulk_writer.AdaptiveBulkWriter(db["products"], name="buy indicators")
+        for row in scored[scored["productId"].notna()].itertuples(index=False):
+            writer.add(_deal_operation(row, game_id, started_at))
+        writer.close()
+        writer.report()
+
+    save_card_state(card_prices, state_path)
+    scored_count = int(scored["buy_indicator"].notna().sum()) if not scored.empty else 0
+    runs.insert_one({
+        "gameId": game_id,
+        "started_at": started_at,
+        "mode": mode,
+        "rescored": len(scored),
+        "with_indicator": scored_count,
+        "seconds": round(time.time() - start, 2)
+    })
+    print(f"Deals: rescored {len(scored)} products ({mode}, {scored_count} with an indicator) "
+          f"in {time.time() - start:.2f} seconds")
+    return len(scored)
+
+
+def read_deals(collection, group_id=None, rarity=None, min_price=None, limit=TOP_DEALS):
+    """
+    Top discounted products (priced furthest below their card), one indexed read.
+
+    Returns:
+        List of {productId, name, deal} documents
+    """
+    query = {f"{DEAL_FIELD}.percentOffDelta": {"$lt": 0}}
+    if group_id is not None:
+        query[f"{DEAL_FIELD}.groupId"] = group_id
+    if rarity:
+        query[f"{DEAL_FIELD}.rarity"] = rarity
+    if min_price is not None:
+        query[f"{DEAL_FIELD}.price"] = {"$gte": min_price}
+    return list(
+        collection.find(query, {"_id": 0, "productId": 1, "name": 1, "imageUrl": 1, "url": 1, DEAL_FIELD: 1})
+        .sort(f"{DEAL_FIELD}.percentOffDelta", pymongo.ASCENDING)
+        .limit(min(limit, MAX_TOP_DEALS))
+    )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Compute buy indicators for TCGplayer products")
+    parser.add_argument("--group", type=int, action="append", help="Only these groupIds (repeatable)")
+    parser.add_argument("--output", default="combined_card_prices.csv", help="CSV file to write")
+    parser.add_argument("--persist", action="store_true", help="Store indicators on products (changed products only)")
+    parser.add_argument("--rebuild", action="store_true", help="With --persist, rescore every product")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        if args.persist:
+            update_deals(client["mtgdbmongo"], rebuild=args.rebuild)
+        else:
+            scored = compute_all(client["mtgdbmongo"], group_ids=args.group)
+            scored.to_csv(args.output, index=False)
+            print(f"Saved {len(scored)} rows to {args.output}")
+    finally:
+        client.close()
@@ -0,0 +1,233 @@
+import time
+from datetime import datetime
+
+import pymongo
+
+STAGING_SUFFIX = "__staging"
+PREVIOUS_SUFFIX = "__previous"
+
+# Refuse to swap in a load that is much smaller than the live collection
+MIN_SWAP_RATIO = 0.9
+
+
+class SwapValidationError(Exception):
+    """The staged load does not match what was inserted, so it was not swapped in"""
+
+
+def _hash_value(value):
+    return int(value, 16) if isinstance(value, str) else 0
+
+
+class StagingLoad:
+    """
+    Full reload of a collection through a staging collection.
+
+    Documents are bulk-inserted into <target>__staging with no secondary indexes,
+    exactly one per load key (callers fold rows that share a key first; a duplicate
+    fails the load as soon as it is tracked rather than at the unique index build).
+    The live collection's indexes are built once the load is done, and fields that
+    other jobs added to the live documents are carried over server-side. The load is
+    validated (document count and an order-independent checksum of each document's
+    hash field) before it is renamed over the target. The previous generation stays
+    as <target>__previous for rollback().
+
+    The swap is two renameCollection commands (live -> previous, staging -> live);
+    readers only see either generation, apart from a gap of a few milliseconds
+    between the two renames. If the second rename fails the previous generation is
+    renamed back. Used as a context manager, the staging collection is dropped when
+    the load raises.
+    """
+
+    def __init__(self, db, target, key, hash_field, min_ratio=MIN_SWAP_RATIO):
+        self.db = db
+        self.target = target
+        self.staging_name = target + STAGING_SUFFIX
+        self.previous_name = target + PREVIOUS_SUFFIX
+        self.key = list(key)
+        self.hash_field = hash_field
+        self.min_ratio = min_ratio
+        self.inserted = 0
+        self.checksum = 0
+        self.fields = set()
+        self.keys = set()
+        self.started = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # A load that failed before (or during) finish() never reaches the live collection
+        if exc_type is not None:
+            self.abort()
+        return False
+
+    @property
+    def staging(self):
+        return self.db[self.staging_name]
+
+    def begin(self):
+        """Start from an empty staging collection"""
+        self.db.drop_collection(self.staging_name)
+        self.db.create_collection(self.staging_name)
+        self.started = time.time()
+        return self
+
+    def track(self, documents):
+        """Account for documents inserted into staging by the caller (e.g. through a writer pool)"""
+        for document in documents:
+            key = tuple(document.get(field) for field in self.key)
+            if key in self.keys:
+                raise SwapValidationError(f"Duplicate {self.key} {key} loaded into {self.staging_name}")
+            self.keys.add(key)
+            self.inserted += 1
+            self.checksum ^= _hash_value(document.get(self.hash_field))
+            self.fields.update(document)
+
+    def insert(self, documents):
+        """Insert one batch of documents into staging"""
+        if documents:
+            self.staging.insert_many(documents, ordered=False)
+            self.track(documents)
+
+    def _index_models(self):
+        """The live collection's indexes, with the load key forced unique"""
+        models = []
+        has_key_index = False
+        if self.target in self.db.list_collection_names():
+            for spec in self.db[self.target].list_indexes():
+                if spec["name"] == "_id_":
+                    continue
+                keys = list(spec["key"].items())
+                options = {
+                    name: value for name, value in spec.items()
+                    if name not in ("key", "v", "ns", "background")
+                }
+                if [field for field, _ in keys] == self.key:
+                    options["unique"] = True
+                    has_key_index = True
+                models.append(pymongo.IndexModel(keys, **options))
+
+        if not has_key_index:
+            models.append(pymongo.IndexModel(
+                [(field, pymongo.ASCENDING) for field in self.key],
+                unique=True,
+                name="_".join(self.key) + "_unique_idx"
+            ))
+        return models
+
+    def _carry_over(self):
+        """Copy fields that only exist on live documents (written by other jobs) into staging"""
+        if self.target not in self.db.list_collection_names():
+            return
+        loaded = {"_id"} | (self.fields - set(self.key))
+        self.db[self.target].aggregate([
+            {"$project": {field: 0 for field in sorted(loaded)}},
+            {"$merge": {
+                "into": self.staging_name,
+                "on": self.key,
+                "whenMatched": "merge",
+                "whenNotMatched": "discard"
+            }}
+        ])
+
+    def validate(self):
+        staged = self.staging.count_documents({})
+        if staged != self.inserted:
+            raise SwapValidationError(f"{self.staging_name} has {staged} documents, {self.inserted} were inserted")
+
+        checksum = 0
+        for document in self.staging.find({}, {"_id": 0, self.hash_field: 1}, batch_size=50000):
+            checksum ^= _hash_value(document.get(self.hash_field))
+        if checksum != self.checksum:
+            raise SwapValidationError(f"{self.staging_name} checksum does not match the inserted documents")
+
+        live = self.db[self.target].estimated_document_count()
+        if live and staged < live * self.min_ratio:
+            raise SwapValidationError(
+                f"{self.staging_name} has {staged} documents, fewer than {self.min_ratio:.0%} of {live} live")
+
+    def swap(self):
+        names = self.db.list_collection_names()
+        if self.previous_name in names:
+            self.db.drop_collection(self.previous_name)
+        if self.target in names:
+            self.db[self.target].rename(self.previous_name)
+        try:
+            self.staging.rename(self.target)
+        except Exception:
+            # Something recreated the target between the renames (e.g. a write from the
+            # web app); put the live generation back and leave staging for abort()
+            if self.target in names:
+                self.db[self.previous_name].rename(self.target, dropTarget=True)
+            raise
+
+    def finish(self, carry_over=True):
+        """
+        Build indexes, carry over live-only fields, validate and swap the load in.
+
+        Returns:
+            Dictionary of documents loaded and seconds spent per step
+        """
+        timings = {}
+
+        step = time.time()
+        models = self._index_models()
+        self.staging.create_indexes(models)
+        timings["indexes"] = time.time() - step
+
+        if carry_over:
+            step = time.time()
+            self._carry_over()
+            timings["carry_over"] = time.time() - step
+
+        step = time.time()
+        self.validate()
+        timings["validate"] = time.time() - step
+
+        step = time.time()
+        self.swap()
+        timings["swap"] = time.time() - step
+
+        self.db["collection_swaps"].insert_one({
+            "collection": self.target,
+            "documents": self.inserted,
+            "indexes": len(models),
+            "swapped_at": datetime.now(),
+            "seconds": {name: round(value, 2) for name, value in timings.items()},
+            "load_seconds": round(step - self.started, 2) if self.started else None
+        })
+        print(f"Swapped {self.inserted} documents into {self.target} "
+              + ", ".join(f"{name} {value:.2f}s" for name, value in timings.items()))
+        return {"documents": self.inserted, **timings}
+
+    def abort(self):
+        self.db.drop_collection(self.staging_name)
+
+
+def rollback(db, target):
+    """Put the previous generation of `target` back in place"""
+    previous_name = target + PREVIOUS_SUFFIX
+    if previous_name not in db.list_collection_names():
+        raise SwapValidationError(f"No previous generation of {target} to roll back to")
+    db[target].rename(target + STAGING_SUFFIX, dropTarget=True)
+    db[previous_name].rename(target)
+    print(f"Rolled {target} back to the previous generation")
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Roll a swapped collection back to its previous generation")
+    parser.add_argument("collection", help="Collection to roll back (e.g. products or cards)")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        rollback(client["mtgdbmongo"], args.collection)
+    finally:
+        client.close()
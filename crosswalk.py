@@ -0,0 +1,474 @@
+import argparse
+import os
+import re
+import time
+import unicodedata
+from datetime import datetime
+
+import pandas as pd
+import pymongo
+
+import bulk_writer
+
+# Persistent Scryfall card <-> TCGplayer product links
+LINKS_COLLECTION = "card_product_links"
+
+# One document per update_links run; the last one bounds what the next run re-joins
+RUNS_COLLECTION = "crosswalk_runs"
+
+# Last-change timestamp kept on cards (scryfall_bulk) and products (the importers)
+CHANGED_AT_FIELD = "changed_at"
+
+# Ids per $in query
+ID_CHUNK_SIZE = 20000
+
+MTG_GAME_ID = 1
+
+# Match methods from most to least certain
+MATCH_CONFIDENCE = {
+    "tcgplayer_id": 1.0,
+    "name_set_number": 0.95,
+    "name_set": 0.8,
+    "name_unique": 0.5,
+}
+
+# Per-card timestamps of lookups that found nothing (negative cache), keyed by lookup kind
+LOOKUP_MISS_FIELD = "lookup_misses"
+
+_BRACKETED = re.compile(r"\s*[\(\[][^\)\]]*[\)\]]")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_name(name):
+    """
+    Normalized card name key: lower-cased, diacritics stripped, TCGplayer variant
+    suffixes like '(Showcase)' or '[Foil]' dropped and punctuation folded to spaces.
+
+    'Lim-Dûl's Vault (Borderless)' -> 'lim dul s vault'
+    """
+    if not name:
+        return ""
+    name = _BRACKETED.sub("", str(name))
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", name.lower()).strip()
+
+
+def normalize_number(number):
+    """Collector number key: alphanumerics only, lower-cased, leading zeros dropped"""
+    if number is None:
+        return ""
+    number = _NON_ALNUM.sub("", str(number).lower())
+    return number.lstrip("0") or number
+
+
+def ensure_links_collection(db):
+    collection = db[LINKS_COLLECTION]
+    collection.create_index([("card_id", pymongo.ASCENDING)], unique=True, name="card_id_idx")
+    collection.create_index([("productId", pymongo.ASCENDING)], name="productId_idx")
+    collection.create_index([("name_key", pymongo.ASCENDING), ("set", pymongo.ASCENDING)], name="name_key_set_idx")
+    return collection
+
+
+def ensure_change_indexes(db):
+    """Incremental runs select cards and products by their last-change timestamp"""
+    db["cards"].create_index([(CHANGED_AT_FIELD, pymongo.ASCENDING)], name="changed_at_idx")
+    db["products"].create_index([("gameId", pymongo.ASCENDING), (CHANGED_AT_FIELD, pymongo.ASCENDING)],
+                                name="gameId_changed_at_idx")
+
+
+def load_group_sets(db):
+    """TCGplayer groupId -> Scryfall set code, as resolved by the set_stats refresh"""
+    return {
+        doc["_id"]: doc["set"]
+        for doc in db["set_stats"].find({"set": {"$exists": True}}, {"set": 1})
+    }
+
+
+def card_frame(cards):
+    """Projected cards -> DataFrame with normalized join keys"""
+    frame = pd.DataFrame(list(cards), columns=["id", "name", "set", "collector_number", "tcgplayer_id"])
+    frame["name_key"] = frame["name"].map(normalize_name)
+    frame["set"] = frame["set"].fillna("").str.lower()
+    frame["number_key"] = frame["collector_number"].map(normalize_number)
+    frame["tcgplayer_id"] = pd.to_numeric(frame["tcgplayer_id"], errors="coerce").astype("float64")
+    return frame.drop_duplicates("id")
+
+
+def product_frame(products, group_sets):
+    """Projected products -> DataFrame with normalized join keys"""
+    frame = pd.DataFrame(list(products), columns=["productId", "name", "cleanName", "groupId", "extNumber", "setCode"])
+    # cleanName has the brackets stripped but keeps their contents, so prefer name
+    frame["name_key"] = frame["name"].where(frame["name"].notna(), frame["cleanName"]).map(normalize_name)
+    # Prefer the Scryfall set resolved for the group, fall back to any setCode on the product
+    frame["set"] = frame["groupId"].map(group_sets).fillna(frame["setCode"]).fillna("").astype(str).str.lower()
+    frame["number_key"] = frame["extNumber"].map(normalize_number)
+    frame["productId"] = pd.to_numeric(frame["productId"], errors="coerce").astype("float64")
+    return frame[frame["productId"].notna()].drop_duplicates("productId")
+
+
+def unique_name_products(cards, products):
+    """
+    Names that occur exactly once among the cards and once among the products.
+
+    Returns:
+        DataFrame of name_key, productId
+    """
+    card_names = cards.loc[~cards["name_key"].duplicated(keep=False), "name_key"]
+    unique_products = products[~products["name_key"].duplicated(keep=False) & (products["name_key"] != "")]
+    return unique_products.loc[unique_products["name_key"].isin(card_names), ["name_key", "productId"]]
+
+
+def load_unique_names(db, game_id=MTG_GAME_ID):
+    """
+    unique_name_products for the whole cards and products collections, counted server-side
+    per raw name so only one small document per distinct name is read.
+
+    Returns:
+        DataFrame of name_key, productId
+    """
+    card_counts = {}
+    for doc in db["cards"].aggregate([
+        {"$match": {"lang": "en"}},
+        {"$group": {"_id": "$name", "count": {"$sum": 1}}}
+    ], allowDiskUse=True):
+        key = normalize_name(doc["_id"])
+        card_counts[key] = card_counts.get(key, 0) + doc["count"]
+
+    product_counts = {}
+    product_ids = {}
+    for doc in db["products"].aggregate([
+        {"$match": {"gameId": game_id}},
+        {"$group": {
+            "_id": {"$ifNull": ["$name", "$cleanName"]},
+            "count": {"$sum": 1},
+            "productId": {"$first": "$productId"}
+        }}
+    ], allowDiskUse=True):
+        key = normalize_name(doc["_id"])
+        product_counts[key] = product_counts.get(key, 0) + doc["count"]
+        product_ids[key] = doc["productId"]
+
+    rows = [
+        (key, float(product_ids[key])) for key, count in product_counts.items()
+        if key and count == 1 and card_counts.get(key) == 1
+    ]
+    return pd.DataFrame(rows, columns=["name_key", "productId"])
+
+
+def match_frames(cards, products, unique_names=None):
+    """
+    Link cards to products with a cascade of hash joins on normalized keys.
+
+    Each card is matched at most once, by the most certain method that finds a
+    single product for it. The name-only tier joins against `unique_names` (see
+    load_unique_names), since uniqueness is a property of both whole collections;
+    by default it is computed from the two frames.
+
+    Returns:
+        DataFrame of card_id, productId, method, confidence, name_key, set, number_key
+    """
+    matches = []
+    if unique_names is None:
+        unique_names = unique_name_products(cards, products)
+    remaining = cards
+
+    def take(joined, method):
+        nonlocal remaining
+        # A card that hits several products at this tier is ambiguous; leave it for later
+        joined = joined[~joined["id"].duplicated(keep=False)]
+        joined = joined.assign(method=method, confidence=MATCH_CONFIDENCE[method])
+        matches.append(joined)
+        remaining = remaining[~remaining["id"].isin(joined["id"])]
+
+    by_id = remaining[remaining["tcgplayer_id"].notna()].merge(
+        products[["productId"]], left_on="tcgplayer_id", right_on="productId", how="inner"
+    )
+    take(by_id, "tcgplayer_id")
+
+    keyed = products[(products["name_key"] != "") & (products["set"] != "")]
+
+    full_key = remaining[remaining["number_key"] != ""].merge(
+        keyed[keyed["number_key"] != ""][["productId", "name_key", "set", "number_key"]],
+        on=["name_key", "set", "number_key"], how="inner"
+    )
+    take(full_key, "name_set_number")
+
+    name_set = remaining.merge(keyed[["productId", "name_key", "set"]], on=["name_key", "set"], how="inner")
+    take(name_set, "name_set")
+
+    by_name = remaining.merge(unique_names[["name_key", "productId"]], on="name_key", how="inner")
+    take(by_name, "name_unique")
+
+    if not matches:
+        return pd.DataFrame(columns=["card_id", "productId", "method", "confidence", "name_key", "set", "number_key"])
+
+    linked = pd.concat(matches, ignore_index=True)
+    return linked.rename(columns={"id": "card_id"})[
+        ["card_id", "productId", "method", "confidence", "name_key", "set", "number_key"]
+    ]
+
+
+def link_updates(linked, stored, rebuild=False):
+    """
+    The matches worth writing over the stored links.
+
+    A match is written when the card has no link yet, or when it is at least as certain
+    as the stored link and points elsewhere or by another method (so a name-only link is
+    upgraded once the exact tcgplayer_id product shows up). A weaker match never replaces
+    a stronger link, and an unchanged link is not rewritten. `rebuild` writes every match.
+
+    Args:
+        linked: Matches from match_frames
+        stored: Dictionary of card_id -> stored link ({productId, method, confidence})
+
+    Returns:
+        DataFrame with the rows of `linked` to write
+    """
+    if rebuild or linked.empty:
+        return linked
+
+    def wanted(row):
+        link = stored.get(row.card_id)
+        if link is None:
+            return True
+        if link.get("productId") == int(row.productId) and link.get("method") == row.method:
+            return False
+        return row.confidence >= link.get("confidence", MATCH_CONFIDENCE.get(link.get("method"), 0))
+
+    return linked[[wanted(row) for row in linked.itertuples(index=False)]]
+
+
+def _chunks(values, size=ID_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def load_stored_links(links, card_ids=None):
+    """Stored link per card_id (all links, or those of `card_ids`)"""
+    projection = {"_id": 0, "card_id": 1, "productId": 1, "method": 1, "confidence": 1}
+    if card_ids is None:
+        return {link["card_id"]: link for link in links.find({}, projection)}
+    return {
+        link["card_id"]: link
+        for chunk in _chunks(card_ids)
+        for link in links.find({"card_id": {"$in": chunk}}, projection)
+    }
+
+
+def _changed_candidates(db, links, since, game_id, group_sets):
+    """
+    Cards an incremental run re-joins, and the products they can match.
+
+    Candidates are the cards changed since `since`, the cards whose tcgplayer_id is a
+    product changed since then, and the cards of sets that gained or changed products.
+    Cards already linked by tcgplayer_id cannot be upgraded, so unless the card itself
+    changed they are dropped. Products are read for the candidates' sets and ids only.
+
+    Returns:
+        (cards frame, products frame, stored links of the candidates)
+    """
+    changed = list(db["products"].find(
+        {"gameId": game_id, "changed_at": {"$gt": since}}, {"_id": 0, "productId": 1, "groupId": 1}
+    ))
+    # Products already linked by id are settled; their price changes do not matter here
+    settled = {
+        link["productId"]
+        for chunk in _chunks({p["productId"] for p in changed})
+        for link in links.find({"method": "tcgplayer_id", "productId": {"$in": chunk}}, {"_id": 0, "productId": 1})
+    }
+    changed = [p for p in changed if p["productId"] not in settled]
+    changed_ids = sorted({p["productId"] for p in changed})
+    changed_sets = sorted({group_sets[p["groupId"]] for p in changed if p.get("groupId") in group_sets})
+
+    projection = {"_id": 0, "id": 1, "name": 1, "set": 1, "collector_number": 1, "tcgplayer_id": 1, CHANGED_AT_FIELD: 1}
+    queries = [{"lang": "en", CHANGED_AT_FIELD: {"$gt": since}}]
+    if changed_sets:
+        queries.append({"lang": "en", "set": {"$in": changed_sets}})
+    queries += [{"lang": "en", "tcgplayer_id": {"$in": chunk}} for chunk in _chunks(changed_ids)]
+    documents = {doc["id"]: doc for query in queries for doc in db["cards"].find(query, projection)}
+
+    stored = load_stored_links(links, documents)
+    documents = [
+        doc for card_id, doc in documents.items()
+        if stored.get(card_id, {}).get("method") != "tcgplayer_id"
+        or (doc.get(CHANGED_AT_FIELD) is not None and doc[CHANGED_AT_FIELD] > since)
+    ]
+    cards = card_frame(documents)
+
+    set_groups = {}
+    for group_id, set_code in group_sets.items():
+        set_groups.setdefault(set_code, []).append(group_id)
+    group_ids = sorted({group_id for set_code in cards["set"].unique() for group_id in set_groups.get(set_code, [])})
+    product_ids = sorted({int(tcgplayer_id) for tcgplayer_id in cards["tcgplayer_id"].dropna()})
+
+    projection = {"_id": 0, "productId": 1, "name": 1, "cleanName": 1, "groupId": 1, "extNumber": 1, "setCode": 1}
+    queries = [{"gameId": game_id, "groupId": {"$in": chunk}} for chunk in _chunks(group_ids)]
+    queries += [{"gameId": game_id, "productId": {"$in": chunk}} for chunk in _chunks(product_ids)]
+    products = product_frame(
+        (doc for query in queries for doc in db["products"].find(query, projection)), group_sets
+    )
+    return cards, products, stored
+
+
+def update_links(db, rebuild=False, game_id=MTG_GAME_ID):
+    """
+    Link English cards to products, re-joining only what changed since the last run.
+
+    The first run (or `rebuild`) joins every card against every product. Later runs
+    only take the cards and products changed since the previous run (see
+    _changed_candidates); stored links are replaced by stronger matches but never by
+    weaker ones (see link_updates). Each run is recorded in crosswalk_runs.
+
+    Returns:
+        Number of links written
+    """
+    start = time.time()
+    started_at = datetime.now()
+    links = ensure_links_collection(db)
+    ensure_change_indexes(db)
+    runs = db[RUNS_COLLECTION]
+    last_run = None if rebuild else runs.find_one({"gameId": game_id}, sort=[("started_at", pymongo.DESCENDING)])
+    group_sets = load_group_sets(db)
+
+    if last_run is None:
+        mode = "full"
+        cards = card_frame(
+            db["cards"].find(
+                {"lang": "en"},
+                {"_id": 0, "id": 1, "name": 1, "set": 1, "collector_number": 1, "tcgplayer_id": 1}
+            )
+        )
+        products = product_frame(
+            db["products"].find(
+                {"gameId": game_id},
+                {"_id": 0, "productId": 1, "name": 1, "cleanName": 1, "groupId": 1, "extNumber": 1, "setCode": 1}
+            ),
+            group_sets
+        )
+        stored = {} if rebuild else load_stored_links(links)
+        unique_names = None
+    else:
+        mode = "incremental"
+        cards, products, stored = _changed_candidates(db, links, last_run["started_at"], game_id, group_sets)
+        unique_names = load_unique_names(db, game_id) if not cards.empty else None
+
+    print(f"Crosswalk: joining {len(cards)} cards against {len(products)} products "
+          f"({mode}, loaded in {time.time() - start:.2f} seconds)")
+
+    linked = link_updates(match_frames(cards, products, unique_names), stored, rebuild)
+
+    writer = bulk_writer.AdaptiveBulkWriter(links, name="card/product links")
+    for row in linked.itertuples(index=False):
+        writer.add(pymongo.UpdateOne(
+            {"card_id": row.card_id},
+            {"$set": {
+                "card_id": row.card_id,
+                "productId": int(row.productId),
+                "method": row.method,
+                "confidence": float(row.confidence),
+                "name_key": row.name_key,
+                "set": row.set,
+                "number_key": row.number_key,
+                "updated_at": started_at
+            }},
+            upsert=True
+        ))
+    writer.close()
+    written = writer.report()["operations"]
+
+    runs.insert_one({
+        "gameId": game_id,
+        "started_at": started_at,
+        "mode": mode,
+        "cards": len(cards),
+        "products": len(products),
+        "written": written,
+        "seconds": round(time.time() - start, 2)
+    })
+    methods = linked["method"].value_counts().to_dict() if not linked.empty else {}
+    print(f"Crosswalk: wrote {written} links in {time.time() - start:.2f} seconds {methods}")
+    return written
+
+
+def product_for_card(db, card_id=None, card_name=None, set_code=None):
+    """
+    Look up the linked TCGplayer productId by Scryfall id, or by normalized name + set.
+
+    Returns:
+        The productId, or None if there is no link
+    """
+    links = db[LINKS_COLLECTION]
+    if card_id:
+        link = links.find_one({"card_id": card_id}, {"_id": 0, "productId": 1})
+        if link:
+            return link["productId"]
+
+    if card_name and set_code:
+        link = links.find_one(
+            {"name_key": normalize_name(card_name), "set": set_code.lower()},
+            {"_id": 0, "productId": 1},
+            sort=[("confidence", pymongo.DESCENDING)]
+        )
+        if link:
+            return link["productId"]
+
+    return None
+
+
+def products_for_cards(db, card_ids):
+    """
+    Batch version of product_for_card for Scryfall ids (one indexed $in query).
+
+    Returns:
+        Dictionary of card_id -> productId for the cards that have a link
+    """
+    if not card_ids:
+        return {}
+    return {
+        link["card_id"]: link["productId"]
+        for link in db[LINKS_COLLECTION].find(
+            {"card_id": {"$in": list(card_ids)}},
+            {"_id": 0, "card_id": 1, "productId": 1}
+        )
+    }
+
+
+def clear_lookup_misses(db, group_ids):
+    """
+    Forget negative lookup results for cards in sets that just received new products.
+
+    Args:
+        db: The pymongo database
+        group_ids: TCGplayer groupIds that had products inserted
+
+    Returns:
+        Number of cards whose misses were cleared
+    """
+    group_sets = load_group_sets(db)
+    set_codes = sorted({group_sets[group_id] for group_id in group_ids if group_id in group_sets})
+    if not set_codes:
+        return 0
+
+    result = db["cards"].update_many(
+        {"set": {"$in": set_codes}, LOOKUP_MISS_FIELD: {"$exists": True}},
+        {"$unset": {LOOKUP_MISS_FIELD: ""}}
+    )
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Build or update the card <-> product crosswalk")
+    parser.add_argument("--rebuild", action="store_true", help="Re-join every card and product and overwrite stored links")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        update_links(client["mtgdbmongo"], rebuild=args.rebuild)
+    finally:
+        client.close()
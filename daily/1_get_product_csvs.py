@@ -1,18 +1,16 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+import argparse
 import re
-import time
+import sys
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Website and ChromeDriver Configurations
-webpage_url = 'https://tcgcsv.com/#daily-updates'
-chromedriver_path = r"C:\Users\Owner\Downloads\chromedriver-win64\chromedriver.exe"
+# Shared modules (product_stream, ...) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import product_stream
 
 # Desired game IDs
 # desired_game_ids = {i: None for i in range(1, 87)}
@@ -25,64 +23,16 @@ output_directory = "downloads/"
 os.makedirs(output_directory, exist_ok=True)  # Create the directory if it doesn't exist
 
 
-def get_filtered_csv_links(url, chromedriver_path, game_ids):
+def get_filtered_csv_links(game_ids):
     """
-    Use Selenium to scrape and filter .csv links for the given game IDs.
+    List the .csv links for the given game IDs from tcgcsv's group listings
+    (only the listings of those games are requested, and results are cached locally).
     """
-    # Base URL for handling relative links
-    base_url = "https://tcgcsv.com/"
-
-    # Set up Selenium WebDriver
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    service = Service(chromedriver_path)
-    driver = webdriver.Chrome(service=service, options=options)
-
-    try:
-        # Load the webpage
-        driver.get(url)
-
-        # Wait for the page to fully load
-        WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-
-        # Scroll the page to ensure all dynamic content is loaded
-        for _ in range(5):
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-
-        # Get the fully rendered HTML content
-        html_content = driver.page_source
-
-        # Use BeautifulSoup to extract all links
-        soup = BeautifulSoup(html_content, 'html.parser')
-        all_links = [link.get('href') for link in soup.find_all('a', href=True)]
-
-        # Debug: Print all extracted links (optional for debugging purposes)
-        print("All Links Found on Page:")
-        for link in all_links:
-            print(link)
-
-        # Regex to match .csv links
-        csv_pattern = r'(?:https?://)?tcgplayer/\d+/\d+/ProductsAndPrices\.csv'
-
-        # Filter links that match the .csv pattern
-        csv_links = [link for link in all_links if re.match(csv_pattern, link)]
+    groups = product_stream.discover_groups(game_ids)
+    csv_links = [product_stream.group_csv_url(game_id, group_id) for game_id, group_id in groups]
 
-        # Ensure all links are absolute URLs
-        csv_links = [link if link.startswith("http") else base_url + link for link in csv_links]
-
-        # Filter links for the desired game IDs
-        filtered_links = []
-        for link in csv_links:
-            match = re.search(r'/tcgplayer/(\d+)/', link)
-            if match and int(match.group(1)) in game_ids:
-                filtered_links.append(link)
-
-        print(f"Found {len(filtered_links)} CSV links for the desired game IDs: {game_ids}")
-        return filtered_links
-
-    finally:
-        driver.quit()
+    print(f"Found {len(csv_links)} CSV links for the desired game IDs: {game_ids}")
+    return csv_links
 
 
 def extract_game_and_group_from_link(link):
@@ -97,9 +47,24 @@ def extract_game_and_group_from_link(link):
     return None, None
 
 
+# One pooled session for every download thread
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+# ETag / Last-Modified per link of the files in output_directory. They are kept next
+# to the files rather than in the streaming importer's store: a 304 only means "keep
+# the copy you have" for whoever saved the validator.
+validators_path = os.path.join(output_directory, ".tcgcsv_validators.json")
+validators = product_stream.load_validators(validators_path)
+validators_lock = threading.Lock()
+
+
 def download_file(link, output_directory):
     """
     Download a single .csv file from the given link and save it to the output directory.
+
+    The body is streamed to disk, and a conditional GET skips the download when the
+    file we already have is still current.
     """
     try:
         # Extract game ID and group ID for unique naming
@@ -109,20 +74,36 @@ def download_file(link, output_directory):
         else:
             # Default fallback filename
             filename = f"ProductsAndPrices.csv"
+        filepath = os.path.join(output_directory, filename)
+
+        with validators_lock:
+            validator = validators.get(link, {}) if os.path.exists(filepath) else {}
 
         # Send the GET request
-        response = requests.get(link, timeout=30)
-        if response.status_code == 200:
-            # Save the file locally
-            filepath = os.path.join(output_directory, filename)
-            with open(filepath, "wb") as file:
-                file.write(response.content)
-
-            print(f"Successfully saved: {filepath}")
-            return filepath
-        else:
-            print(f"Failed to download {link} (HTTP {response.status_code})")
-            return None
+        with session.get(link, headers=product_stream.conditional_headers(validator), stream=True, timeout=30) as response:
+            if response.status_code == 304:
+                print(f"Not modified, keeping: {filepath}")
+                return filepath
+
+            if response.status_code == 200:
+                # Save the file locally, replacing the old copy only once complete
+                tmp_path = filepath + ".part"
+                with open(tmp_path, "wb") as file:
+                    for chunk in response.iter_content(chunk_size=product_stream.READ_CHUNK_SIZE):
+                        file.write(chunk)
+                os.replace(tmp_path, filepath)
+
+                with validators_lock:
+                    validators[link] = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    }
+
+                print(f"Successfully saved: {filepath}")
+                return filepath
+            else:
+                print(f"Failed to download {link} (HTTP {response.status_code})")
+                return None
     except Exception as e:
         print(f"Error downloading {link}: {e}")
         return None
@@ -148,21 +129,55 @@ def download_csv_files_concurrently(csv_links, output_directory, max_workers=10)
             except Exception as e:
                 print(f"Error during download of {link}: {e}")
 
+    product_stream.save_validators(validators, validators_path)
+
+
+def stream_csv_links_to_mongo(csv_links):
+    """
+    Import the linked groups straight into MongoDB without writing CSVs to disk.
+    """
+    import pymongo
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    groups = []
+    for link in csv_links:
+        game_id, group_id = extract_game_and_group_from_link(link)
+        if game_id and group_id:
+            groups.append((int(game_id), int(group_id)))
+
+    base_url = os.getenv("TCGCSV_BASE_URL") or product_stream.TCGCSV_BASE_URL
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        product_stream.stream_groups_to_mongo(client["mtgdbmongo"], groups, base_url=base_url)
+    finally:
+        client.close()
+
 
 # Main Execution
 if __name__ == '__main__':
-    print(f"Fetching CSV links for games {desired_game_ids} using Selenium...")
+    parser = argparse.ArgumentParser(description="Download tcgcsv.com product CSVs")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream rows straight into MongoDB instead of saving CSVs to disk")
+    args = parser.parse_args()
+
+    print(f"Fetching CSV links for games {desired_game_ids}...")
 
     # Get filtered .csv links
-    filtered_csv_links = get_filtered_csv_links(webpage_url, chromedriver_path, desired_game_ids)
+    filtered_csv_links = get_filtered_csv_links(desired_game_ids)
 
     if filtered_csv_links:
         print("\nFiltered List of CSV Links:")
         for link in filtered_csv_links:
             print(link)
 
-        # Download the CSV files concurrently
-        print("\nDownloading CSV files concurrently...")
-        download_csv_files_concurrently(filtered_csv_links, output_directory, max_workers=6)
+        if args.stream:
+            print("\nStreaming CSV rows into MongoDB...")
+            stream_csv_links_to_mongo(filtered_csv_links)
+        else:
+            # Download the CSV files concurrently
+            print("\nDownloading CSV files concurrently...")
+            download_csv_files_concurrently(filtered_csv_links, output_directory, max_workers=6)
     else:
         print("No relevant CSV links found.")
\ No newline at end of file
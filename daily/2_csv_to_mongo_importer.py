@@ -1,41 +1,65 @@
 import os
-import csv
+import sys
 import pymongo
-import re
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Shared modules (price_history, ...) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_history
+import collection_swap
+import bulk_writer
+import import_steps
+import product_csv
+
 # Start timing
 start_time = time.time()
 
-client = pymongo.MongoClient(
-    os.getenv('MONGO_URI'),
-    maxPoolSize=50,  # Increase connection pool
-    socketTimeoutMS=30000,  # Increase timeout
-    w=1,  # Reduce write concern for speed
-    journal=False  # Disable journaling for speed
-)
-db = client["mtgdbmongo"]
-collection = db["products"]
-
-# Create compound index if it doesn't exist
-# This dramatically speeds up upsert operations
-if "productId_gameId_idx" not in collection.index_information():
-    print("Creating compound index on productId and gameId...")
-    collection.create_index(
-        [("productId", pymongo.ASCENDING), ("gameId", pymongo.ASCENDING)],
-        unique=True,
-        background=True,
-        name="productId_gameId_idx"
-    )
+# "changed" only upserts rows whose content hash differs from the stored one,
+# "full" rewrites every row, "swap" loads a fresh staging collection and renames it
+# over products once it is complete and validated
+IMPORT_MODE = os.getenv("PRODUCT_IMPORT_MODE", "changed")
 
 # Path to the folder containing CSV files
 csv_folder = "downloads/"  # Replace with your actual folder path
 
 
+# Parsing runs in a process pool across files; bulk writes run on a thread pool so
+# the network round trips overlap with parsing and building the next batches
+PARSE_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+WRITER_THREADS = bulk_writer.MAX_CONCURRENCY
+MAX_PENDING_WRITES = 8
+
+# Batch size and writes in flight follow the observed write latency
+# (BULK_WRITE_TARGET_LATENCY_MS) instead of a fixed 10000-row batch
+throttle = bulk_writer.WriteThrottle()
+
+
+def write_batch(target, group_id, operations, history_ops):
+    """Bulk write one batch of products and their history entries (writer thread)"""
+    write_start = time.time()
+    try:
+        counts = throttle.execute(target, operations)
+        throttle.execute(history_collection, history_ops)
+    finally:
+        throttle.release()
+    return {
+        "group_id": group_id,
+        "rows": len(operations),
+        "inserted": counts["nUpserted"] + counts["nInserted"],
+        "updated": counts["nModified"],
+        "history": len(history_ops),
+        "seconds": time.time() - write_start,
+    }
+
+
 def import_csv_files(folder_path):
     # Get a list of all CSV files in the folder
     csv_files = [f for f in os.listdir(folder_path) if f.endswith('.csv')]
@@ -44,118 +68,272 @@ def import_csv_files(folder_path):
         print("No CSV files found in the specified folder.")
         return
 
-    total_processed = 0
-    total_inserted = 0
-    total_updated = 0
-
     for csv_file in csv_files:
-        file_start_time = time.time()
-
-        # Extract game_id and group_id from filename using regex
-        filename_pattern = r"ProductsAndPrices_game_(\d+)_group_(\d+)"
-        match = re.search(filename_pattern, csv_file)
-
-        if match:
-            game_id = int(match.group(1))
-            group_id = int(match.group(2))
-            print(f"Processing file: {csv_file} (game_id: {game_id}, group_id: {group_id})")
-        else:
+        if not product_csv.parse_filename(csv_file):
             print(f"Could not extract game_id and group_id from filename: {csv_file}")
             print("Skipping this file. Expected format: ProductsAndPrices_game_X_group_Y")
-            continue
-
-        file_path = os.path.join(folder_path, csv_file)
-        current_time = datetime.now()
-
-        # Create a bulk operations object
-        bulk_operations = []
-        processed_count = 0
-
-        # Increased batch size for better performance
-        # MongoDB can handle much larger batches than 3000 documents
-        batch_size = 10000
-
-        # Read the CSV file
-        with open(file_path, 'r', encoding='utf-8') as file:
-            csv_reader = csv.DictReader(file)
-
-            # Process rows in batches for better performance
-            for row in csv_reader:
-                # Convert string values to appropriate types where possible
-                processed_row = {}
-                for key, value in row.items():
-                    # Skip empty values
-                    if value == '':
-                        continue
-
-                    # Try to convert numeric values
-                    if value.replace('.', '', 1).isdigit():
-                        # Check if it's a float or int
-                        if '.' in value:
-                            processed_row[key] = float(value)
-                        else:
-                            processed_row[key] = int(value)
-                    else:
-                        processed_row[key] = value
-
-                # Add game_id and group_id from filename
-                processed_row['gameId'] = game_id
+    csv_files = [f for f in csv_files if product_csv.parse_filename(f)]
+
+    # Swap mode writes products into staging; live products are untouched until the swap
+    staging = None
+    target = collection
+    if IMPORT_MODE == "swap":
+        staging = collection_swap.StagingLoad(
+            db, collection.name, ["productId", "gameId"], product_csv.ROW_HASH_FIELD
+        ).begin()
+        target = staging.staging
+
+    stored_hashes = {}
+    if IMPORT_MODE == "changed":
+        hash_start = time.time()
+        stored_hashes = product_csv.load_row_hashes(collection, {product_csv.parse_filename(f)[0] for f in csv_files})
+        print(f"Loaded {len(stored_hashes)} stored row hashes in {time.time() - hash_start:.2f} seconds")
+
+    import_day = datetime.now()
+    import_day_key = import_day.strftime("%Y-%m-%d")
+    run_id = runs_collection.insert_one({
+        "started_at": import_day,
+        "status": "running",
+        "files": len(csv_files),
+        "mode": IMPORT_MODE
+    }).inserted_id
+
+    files_skipped = 0
+    files_resumed = 0
 
-                # Add import metadata
-                processed_row['import_date'] = current_time
-                processed_row['source_file'] = csv_file
-
-                # Determine unique identifier for upsert
-                if 'productId' in processed_row:
-                    filter_criteria = {
-                        'productId': processed_row['productId'],
-                        'gameId': game_id
-                    }
-
-                    # Add to bulk operations
+    total_processed = 0
+    total_unchanged = 0
+    total_inserted = 0
+    total_updated = 0
+    total_history_writes = 0
+
+    # Per-stage work: rows handled and seconds spent (summed over workers/threads)
+    stage_rows = {"parse": 0, "build": 0, "write": 0}
+    stage_seconds = {"parse": 0.0, "build": 0.0, "write": 0.0}
+
+    # Groups that got brand-new products; cached lookup misses for their sets are stale
+    groups_with_new_products = set()
+
+    # Today's prices for every product, appended as one row of the price matrix
+    matrix_prices = {}
+    matrix_metadata = {}
+
+    pending = deque()
+
+    # Swap loads only mark their files imported once the staging collection is live
+    staged_manifest_ids = []
+
+    def collect(item):
+        nonlocal total_inserted, total_updated, total_history_writes
+        future, manifest_id, rows_committed, last = item
+        result = future.result()
+        total_inserted += result["inserted"]
+        total_updated += result["updated"]
+        total_history_writes += result["history"]
+        stage_rows["write"] += result["rows"]
+        stage_seconds["write"] += result["seconds"]
+        if result["inserted"]:
+            groups_with_new_products.add(result["group_id"])
+
+        # Batches are collected in submission order, so every row before this point is committed
+        progress = {"rows_committed": rows_committed}
+        if last and staging:
+            staged_manifest_ids.append(manifest_id)
+        elif last:
+            progress.update(status="imported", finished_at=datetime.now())
+        manifest_collection.update_one({"_id": manifest_id}, {"$set": progress})
+
+    def submit(group_id, operations, history_ops, manifest_id, rows_committed, last):
+        # Bound the in-flight batches so a slow server applies back-pressure to parsing
+        while len(pending) >= MAX_PENDING_WRITES:
+            collect(pending.popleft())
+        throttle.acquire()
+        future = writers.submit(write_batch, target, group_id, operations, history_ops)
+        pending.append((future, manifest_id, rows_committed, last))
+
+    # The staging load (if any) is entered first so it is aborted only after the
+    # writers have stopped, whatever fails
+    with staging or nullcontext(), \
+            ProcessPoolExecutor(max_workers=PARSE_WORKERS) as parsers, \
+            ThreadPoolExecutor(max_workers=WRITER_THREADS) as writers:
+        parsed_files = [
+            parsers.submit(product_csv.parse_file, os.path.join(folder_path, csv_file))
+            for csv_file in csv_files
+        ]
+
+        for parsed_file in as_completed(parsed_files):
+            parsed = parsed_file.result()
+            csv_file = parsed["csv_file"]
+            game_id = parsed["game_id"]
+            group_id = parsed["group_id"]
+            records = parsed["records"]
+            stage_rows["parse"] += len(records)
+            stage_seconds["parse"] += parsed["seconds"]
+
+            if parsed["skipped"]:
+                print(f"Warning: {parsed['skipped']} records missing productId in {csv_file}, skipped")
+
+            # Files already imported today are only re-read for the price matrix; partially
+            # imported ones resume after their last committed batch
+            manifest_id = f"{import_day_key}:{csv_file}"
+            entry = manifest_collection.find_one({"_id": manifest_id}) or {}
+            same_file = entry.get("checksum") == parsed["checksum"] and entry.get("size") == parsed["size"]
+            if staging:
+                # A staging load always starts empty, so every row is written
+                resume_from = 0
+            elif same_file and entry.get("status") == "imported":
+                resume_from = len(records)
+                files_skipped += 1
+            elif same_file:
+                resume_from = entry.get("rows_committed", 0)
+                files_resumed += 1 if resume_from else 0
+            else:
+                resume_from = 0
+
+            build_start = time.time()
+            current_time = datetime.now()
+            # Sub type rows of a product are written as one document, at its first row
+            products = {product['productId']: product for product in parsed["products"]}
+            bulk_operations = []
+            history_operations = []
+            changed_count = 0
+
+            if resume_from < len(records):
+                if resume_from:
+                    print(f"Resuming {csv_file} after {resume_from} committed records")
+                manifest_collection.update_one(
+                    {"_id": manifest_id},
+                    {"$set": {
+                        "day": import_day_key,
+                        "csv_file": csv_file,
+                        "gameId": game_id,
+                        "groupId": group_id,
+                        "size": parsed["size"],
+                        "checksum": parsed["checksum"],
+                        "rows": len(records),
+                        "rows_committed": resume_from,
+                        "status": "importing",
+                        "started_at": current_time,
+                        "parse_seconds": parsed["seconds"],
+                        "run_id": run_id
+                    }},
+                    upsert=True
+                )
+
+            for row_index, processed_row in enumerate(records):
+                # Add game_id from filename
+                processed_row['gameId'] = game_id
+                write_row = row_index >= resume_from
+                product = products.pop(processed_row['productId'], None)
+
+                # Staging gets exactly one (folded) document per productId
+                if staging and product:
+                    changed_count += 1
+                    document = {**product, 'gameId': game_id, 'changed_at': current_time, 'source_file': csv_file}
+                    staging.track([document])
+                    bulk_operations.append(pymongo.InsertOne(document))
+
+                # Unchanged products are not written at all; import_date lives on the group marker
+                elif write_row and product and stored_hashes.get((game_id, product['productId'])) != product[product_csv.ROW_HASH_FIELD]:
+                    changed_count += 1
                     bulk_operations.append(
                         pymongo.UpdateOne(
-                            filter_criteria,
-                            {'$set': processed_row},
+                            {'productId': product['productId'], 'gameId': game_id},
+                            {'$set': {**product, 'gameId': game_id, 'changed_at': current_time, 'source_file': csv_file}},
                             upsert=True
                         )
                     )
 
-                    processed_count += 1
-
-                    if len(bulk_operations) >= batch_size:
-                        # Set ordered=False for parallel processing of updates
-                        results = collection.bulk_write(bulk_operations, ordered=False)
-                        total_inserted += results.upserted_count
-                        total_updated += results.modified_count
-
-                        print(f"Bulk processed {len(bulk_operations)} records...")
-                        bulk_operations = []
-                else:
-                    print(f"Warning: Record missing productId, skipping: {processed_row}")
-
-            # Process any remaining operations
-            if bulk_operations:
-                results = collection.bulk_write(bulk_operations, ordered=False)
-                total_inserted += results.upserted_count
-                total_updated += results.modified_count
-
-            total_processed += processed_count
-            file_end_time = time.time()
-            file_duration = file_end_time - file_start_time
-            records_per_second = processed_count / file_duration if file_duration > 0 else 0
-
-            print(f"Processed {processed_count} records from {csv_file} in {file_duration:.2f} seconds")
-            print(f"Performance: {records_per_second:.2f} records/second")
+                history_operation = price_history.history_operation(processed_row, current_time) if write_row else None
+                if history_operation:
+                    history_operations.append(history_operation)
+
+                import_steps.add_matrix_row(matrix_prices, matrix_metadata, processed_row, group_id)
+
+                if len(bulk_operations) >= throttle.batch_size or len(history_operations) >= throttle.batch_size:
+                    submit(group_id, bulk_operations, history_operations, manifest_id, row_index + 1, False)
+                    bulk_operations = []
+                    history_operations = []
+
+            if resume_from < len(records):
+                # The final (possibly empty) batch marks the file imported once everything before it is written
+                submit(group_id, bulk_operations, history_operations, manifest_id, len(records), True)
+
+            import_groups_collection.update_one(
+                {"_id": f"{game_id}:{group_id}"},
+                {"$set": {
+                    "gameId": game_id,
+                    "groupId": group_id,
+                    "import_date": current_time,
+                    "source_file": csv_file,
+                    "rows": len(records),
+                    "products": len(parsed["products"]),
+                    "changed": changed_count
+                }},
+                upsert=True
+            )
+
+            stage_rows["build"] += len(records)
+            stage_seconds["build"] += time.time() - build_start
+            total_processed += len(records)
+            total_unchanged += len(parsed["products"]) - changed_count
+            print(f"Processed {len(records)} records from {csv_file} "
+                  f"(game_id: {game_id}, group_id: {group_id}, {changed_count} of {len(parsed['products'])} products changed) "
+                  f"in {parsed['seconds']:.2f} seconds")
+
+        while pending:
+            collect(pending.popleft())
+
+        if staging:
+            # Indexes are built on the loaded staging collection, then it replaces products
+            staging.finish()
+            manifest_collection.update_many(
+                {"_id": {"$in": staged_manifest_ids}},
+                {"$set": {"status": "imported", "finished_at": datetime.now()}}
+            )
+
+    writes = throttle.report("Product writes")
+
+    for stage in ("parse", "build", "write"):
+        rate = stage_rows[stage] / stage_seconds[stage] if stage_seconds[stage] > 0 else 0
+        print(f"Stage {stage}: {stage_rows[stage]} rows in {stage_seconds[stage]:.2f} seconds "
+              f"({rate:.2f} rows/second per worker)")
+
+    # Matrix row, price stats, movers, set stats, crosswalk links and deals
+    import_steps.run_post_import(db, import_day, matrix_prices, matrix_metadata, groups_with_new_products)
 
     end_time = time.time()
     total_duration = end_time - start_time
     print(f"Import complete! Total records processed: {total_processed}")
     print(f"  - {total_inserted} new records inserted")
     print(f"  - {total_updated} existing records updated")
+    print(f"  - {total_unchanged} unchanged or already imported products skipped")
+    print(f"  - {total_history_writes} price history entries written")
+    print(f"  - {files_skipped} files already imported today, {files_resumed} files resumed")
     print(f"Total execution time: {total_duration:.2f} seconds")
     print(f"Overall performance: {total_processed / total_duration:.2f} records/second")
 
+    runs_collection.update_one(
+        {"_id": run_id},
+        {"$set": {
+            "status": "completed",
+            "finished_at": datetime.now(),
+            "seconds": round(total_duration, 2),
+            "files_skipped": files_skipped,
+            "files_resumed": files_resumed,
+            "rows": total_processed,
+            "unchanged": total_unchanged,
+            "inserted": total_inserted,
+            "updated": total_updated,
+            "history_writes": total_history_writes,
+            "writes": writes,
+            "stages": {
+                stage: {"rows": stage_rows[stage], "seconds": round(stage_seconds[stage], 2)}
+                for stage in stage_rows
+            }
+        }}
+    )
+
 
 # Add this function to analyze MongoDB collection
 def analyze_mongodb_performance():
@@ -184,12 +362,46 @@ def analyze_mongodb_performance():
     print(f"Document count: {doc_count}")
 
 
-# Run the import
-try:
-    import_csv_files(csv_folder)
-    analyze_mongodb_performance()
-except Exception as e:
-    print(f"Error during import: {str(e)}")
-finally:
-    client.close()
-    print("MongoDB connection closed.")
\ No newline at end of file
+# Run the import (guarded so parser worker processes, which only need product_csv,
+# don't connect to Mongo or re-run it)
+if __name__ == "__main__":
+    client = pymongo.MongoClient(
+        os.getenv('MONGO_URI'),
+        maxPoolSize=50,  # Increase connection pool
+        socketTimeoutMS=30000,  # Increase timeout
+        w=1,  # Reduce write concern for speed
+        journal=False  # Disable journaling for speed
+    )
+    db = client["mtgdbmongo"]
+    collection = db["products"]
+
+    # Create compound index if it doesn't exist
+    # This dramatically speeds up upsert operations
+    if "productId_gameId_idx" not in collection.index_information():
+        print("Creating compound index on productId and gameId...")
+        collection.create_index(
+            [("productId", pymongo.ASCENDING), ("gameId", pymongo.ASCENDING)],
+            unique=True,
+            background=True,
+            name="productId_gameId_idx"
+        )
+
+    # Daily prices are also appended to bucketed history so they aren't lost on overwrite
+    history_collection = price_history.ensure_price_history_collection(db)
+
+    # Per-group import markers; products only carry import metadata when they change
+    import_groups_collection = db["import_groups"]
+
+    # One entry per file and import day (size, checksum, rows, status, progress, timing),
+    # plus one summary per run
+    manifest_collection = db["import_manifest"]
+    runs_collection = db["import_runs"]
+
+    try:
+        import_csv_files(csv_folder)
+        analyze_mongodb_performance()
+    except Exception as e:
+        print(f"Error during import: {str(e)}")
+    finally:
+        client.close()
+        print("MongoDB connection closed.")
\ No newline at end of file
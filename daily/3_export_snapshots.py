@@ -0,0 +1,21 @@
+import os
+import sys
+import pymongo
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Shared modules (snapshots, ...) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshots
+
+# Nightly, after the product import: projected, typed, partitioned Parquet copies of
+# cards, products and the crosswalk for analytics scripts (see snapshots.load)
+client = pymongo.MongoClient(os.getenv('MONGO_URI'))
+try:
+    rows = snapshots.export_all(client["mtgdbmongo"])
+    print(f"Snapshot export complete: {rows}")
+finally:
+    client.close()
+    print("MongoDB connection closed.")
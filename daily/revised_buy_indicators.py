@@ -1,6 +1,7 @@
 import pymongo
 import pandas as pd
 import os
+import sys
 from dotenv import load_dotenv
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,6 +11,11 @@ from datetime import datetime
 # Load environment variables
 load_dotenv()
 
+# Shared modules (buy_indicators, ...) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import buy_indicators
+
 # Time tracking
 start_time = time.time()
 print(f"Script started at {datetime.now().strftime('%H:%M:%S')}")
@@ -19,247 +25,21 @@ print(f"Connecting to MongoDB...")
 mongo_uri = os.getenv('MONGO_URI')
 client = pymongo.MongoClient(mongo_uri)
 db = client.get_database()
-products_collection = db.products
-cards_collection = db.cards
 print(f"Connected to database: {db.name}")
 
-# Query the products with gameId=1 and groupId=97
-products_query = {"gameId": 1, "groupId": 97}
-products_count = products_collection.count_documents(products_query)
-print(f"Found {products_count} products with gameId=1 and groupId=97")
-
-# Get all products at once
-print(f"Loading all products into memory...")
-products_data = list(products_collection.find(products_query))
-print(f"Loaded {len(products_data)} products into memory")
-
-# Pre-load card data into memory for faster matching, with multiple filters
-print(f"Pre-loading filtered card data for efficient matching...")
-clean_name_map = {}
-name_map = {}
-
-# Build card query with all optimizations
-cards_query = {
-    "lang": "en",  # English cards only
-    "layout": "normal",  # Normal layout cards only
-    "promo": False,  # No promotional cards
-    "games": "paper"  # Only cards available in paper (physical) format
-}
-
-# Count filtered cards for progress reporting
-cards_count = cards_collection.count_documents(cards_query)
-print(f"Building name maps from {cards_count} filtered cards...")
-
-# Process cards in chunks to show progress
-chunk_size = 25000
-processed = 0
-
-# Process cards in chunks but still build complete maps
-for i in range(0, cards_count, chunk_size):
-    chunk_start = time.time()
-    cards_chunk = list(cards_collection.find(cards_query).skip(i).limit(chunk_size))
-    processed += len(cards_chunk)
-    print(f"Processing cards {processed - len(cards_chunk) + 1}-{processed} of {cards_count}...")
-
-    for card in cards_chunk:
-        card_id = card.get("_id")
-
-        # Add to cleanName map
-        if "cleanName" in card and card["cleanName"]:
-            clean_name = card["cleanName"].lower()  # Use lowercase for case-insensitive matching
-            if clean_name not in clean_name_map:
-                clean_name_map[clean_name] = []
-            clean_name_map[clean_name].append(card)
-
-        # Add to name map
-        if "name" in card and card["name"]:
-            name = card["name"].lower()  # Use lowercase for case-insensitive matching
-            if name not in name_map:
-                name_map[name] = []
-            name_map[name].append(card)
-
-    print(f"Processed chunk in {time.time() - chunk_start:.2f} seconds")
-
-print(f"Created maps with {len(clean_name_map)} unique cleanNames and {len(name_map)} unique names")
-
-
-# Define fast match function using pre-loaded maps
-def find_matching_card_fast(product):
-    """Find a matching card using pre-loaded maps for speed"""
-
-    # Try match by cleanName first (if it exists)
-    if 'cleanName' in product and product['cleanName']:
-        clean_name = product['cleanName'].lower()
-        if clean_name in clean_name_map:
-            # If there are multiple matches, try to filter by set if available
-            matches = clean_name_map[clean_name]
-            if len(matches) == 1:
-                return matches[0], "cleanName map"
-            elif 'set' in product and product['set']:
-                for card in matches:
-                    if card.get('set') == product['set']:
-                        return card, "cleanName+set map"
-                # If no exact set match, return first match
-                return matches[0], "cleanName map (multiple)"
-            else:
-                return matches[0], "cleanName map (first)"
-
-    # Try match by name
-    if 'name' in product and product['name']:
-        name = product['name'].lower()
-        if name in name_map:
-            # If there are multiple matches, try to filter by set if available
-            matches = name_map[name]
-            if len(matches) == 1:
-                return matches[0], "name map"
-            elif 'set' in product and product['set']:
-                for card in matches:
-                    if card.get('set') == product['set']:
-                        return card, "name+set map"
-                # If no exact set match, return first match
-                return matches[0], "name map (multiple)"
-            else:
-                return matches[0], "name map (first)"
-
-    # No match found
-    return None, "no match"
-
-
-def extract_prices(prices_data):
-    """Safely extract and convert price data"""
-    prices = {}
-
-    # Handle non-dict prices
-    if not isinstance(prices_data, dict):
-        return prices
-
-    # Regular prices
-    for currency in ['usd', 'eur']:
-        try:
-            if currency in prices_data and prices_data[currency]:
-                prices[currency] = float(prices_data[currency]) if isinstance(prices_data[currency], str) else \
-                    prices_data[currency]
-        except (ValueError, TypeError):
-            prices[currency] = None
-
-    # Foil prices
-    if 'foil' in prices_data and isinstance(prices_data['foil'], dict):
-        for currency in ['usd', 'eur']:
-            try:
-                if currency in prices_data['foil'] and prices_data['foil'][currency]:
-                    prices[f'foil_{currency}'] = float(prices_data['foil'][currency]) if isinstance(
-                        prices_data['foil'][currency], str) else prices_data['foil'][currency]
-            except (ValueError, TypeError):
-                prices[f'foil_{currency}'] = None
-
-    return prices
-
-
-# Process all products
-print(f"\nProcessing all {len(products_data)} products...")
-start_processing = time.time()
-
-combined_data = []
-match_methods = {}
-total_matched = 0
-
-for i, product in enumerate(products_data):
-    # Print progress every 50 products
-    if (i + 1) % 50 == 0 or i == 0 or i == len(products_data) - 1:
-        print(f"Processing product {i + 1}/{len(products_data)}...")
-
-    # Create base record
-    record = {
-        "product_id": str(product.get("_id")),
-        "product_name": product.get("name", ""),
-        "product_clean_name": product.get("cleanName", ""),
-        "set": product.get("setName", product.get("set", "")),
-        "rarity": product.get("rarity", ""),
-        "product_price": product.get("price", None)
-    }
-
-    # Find matching card using fast method
-    matching_card, match_method = find_matching_card_fast(product)
-
-    # Update match statistics
-    if matching_card:
-        total_matched += 1
-        match_methods[match_method] = match_methods.get(match_method, 0) + 1
-
-    # Add card data to record
-    if matching_card:
-        record["card_id"] = str(matching_card.get("_id"))
-        record["card_name"] = matching_card.get("name", "")
-        record["card_clean_name"] = matching_card.get("cleanName", "")
-        record["match_method"] = match_method
-
-        # Extract prices
-        prices = extract_prices(matching_card.get("prices", {}))
-        record.update({
-            "card_price_usd": prices.get("usd"),
-            "card_price_eur": prices.get("eur"),
-            "card_price_foil_usd": prices.get("foil_usd"),
-            "card_price_foil_eur": prices.get("foil_eur")
-        })
-
-        # Calculate additional price metrics if both prices are available
-        if record["product_price"] is not None and record["card_price_usd"] is not None:
-            # Calculate price difference
-            product_price = record["product_price"]
-            card_price = record["card_price_usd"]
-            delta_price = product_price - card_price
-
-            # Determine the lower price
-            low_price = min(product_price, card_price)
-
-            # Calculate the buy indicator (lowPrice / deltaPrice)
-            # Handle division by zero or near-zero
-            if abs(delta_price) < 0.01:  # If prices are almost identical
-                record["buy_indicator"] = 0  # No advantage
-            else:
-                record["buy_indicator"] = low_price / abs(delta_price)
-
-            # Calculate percent difference from delta
-            if card_price > 0:
-                record["percent_off_delta"] = (delta_price / card_price) * 100
-            else:
-                record["percent_off_delta"] = 0
-        else:
-            record["buy_indicator"] = None
-            record["percent_off_delta"] = None
-
-    else:
-        record.update({
-            "card_id": None,
-            "card_name": None,
-            "card_clean_name": None,
-            "match_method": match_method,
-            "card_price_usd": None,
-            "card_price_eur": None,
-            "card_price_foil_usd": None,
-            "card_price_foil_eur": None,
-            "buy_indicator": None,
-            "percent_off_delta": None
-        })
-
-    combined_data.append(record)
-
-# Calculate total processing time
-processing_time = time.time() - start_processing
-print(
-    f"Processed all products in {processing_time:.2f} seconds ({processing_time / len(products_data):.4f} seconds per product)")
-
-# Create DataFrame
-combined_df = pd.DataFrame(combined_data)
+# Score from last night's columnar snapshot when it is newer than the last product
+# import; otherwise stream every MTG group from Mongo in parallel, projected columns only
+combined_df = buy_indicators.compute(db)
 
 # Print match statistics
+total_matched = combined_df['card_id'].notnull().sum()
 print(f"\nMatch statistics:")
-print(f"Total products: {len(products_data)}")
+print(f"Total products: {len(combined_df)}")
 print(f"Products with matching cards: {total_matched}")
-print(f"Match rate: {(total_matched / len(products_data)) * 100:.2f}%")
+print(f"Match rate: {(total_matched / max(len(combined_df), 1)) * 100:.2f}%")
 print("\nMatch methods used:")
-for method, count in sorted(match_methods.items(), key=lambda x: x[1], reverse=True):
-    print(f"- {method}: {count}")
+for method, count in combined_df['match_method'].value_counts().items():
+    print(f"- crosswalk {method}: {count}")
 
 # Display basic information about the results
 print(f"\nCombined data: {len(combined_df)} records")
@@ -269,13 +49,13 @@ print(f"Products with product prices: {combined_df['product_price'].notnull().su
 print(f"Products with buy indicator values: {combined_df['buy_indicator'].notnull().sum()}")
 
 # Summary statistics of the buy indicators
-buy_indicators = combined_df['buy_indicator'].dropna()
-if len(buy_indicators) > 0:
+indicator_values = combined_df['buy_indicator'].dropna()
+if len(indicator_values) > 0:
     print("\nBuy Indicator Statistics:")
-    print(f"Mean: {buy_indicators.mean():.4f}")
-    print(f"Median: {buy_indicators.median():.4f}")
-    print(f"Min: {buy_indicators.min():.4f}")
-    print(f"Max: {buy_indicators.max():.4f}")
+    print(f"Mean: {indicator_values.mean():.4f}")
+    print(f"Median: {indicator_values.median():.4f}")
+    print(f"Min: {indicator_values.min():.4f}")
+    print(f"Max: {indicator_values.max():.4f}")
 
 # Save to CSV file
 output_file = 'combined_card_prices.csv'
@@ -1,170 +1,203 @@
+import argparse
 import pymongo
 import pandas as pd
+import numpy as np
+import bson
 from dotenv import load_dotenv
+from pymongo import monitoring
+from pymongo.errors import OperationFailure
 import os
+import sys
 from time import time
-import json
+from datetime import datetime
 
 # Load environment variables
 load_dotenv()
 
-# Connect to MongoDB
-mongo_uri = os.environ.get("MONGO_URI")
-client = pymongo.MongoClient(mongo_uri)
-db = client.get_database()
-
-print("Connected to database:", db.name)
-print("Available collections:", db.list_collection_names())
-
-# Start timing
-start_time = time()
-
-# 1. Extract pricing data from cards collection
-print("Extracting pricing data from cards collection...")
-cards_pricing = list(db.cards.find(
-    {"tcgplayer_id": {"$exists": True}},
-    {"_id": 1, "name": 1, "set": 1, "tcgplayer_id": 1, "prices.usd": 1, "prices.eur": 1}
-))
-
-# Convert to dataframe
-cards_df = pd.DataFrame(cards_pricing)
-print(f"Retrieved {len(cards_df)} cards with tcgplayer_id")
-
-# Process cards data to extract USD and EUR prices
-if not cards_df.empty and 'prices' in cards_df.columns:
-    # Create usdPrice and eurPrice columns
-    cards_df['usdPrice'] = cards_df['prices'].apply(lambda x: x.get('usd') if x else None)
-    cards_df['eurPrice'] = cards_df['prices'].apply(lambda x: x.get('eur') if x else None)
-
-    # Convert price columns to numeric
-    cards_df['usdPrice'] = pd.to_numeric(cards_df['usdPrice'], errors='coerce')
-    cards_df['eurPrice'] = pd.to_numeric(cards_df['eurPrice'], errors='coerce')
-
-    # Keep only needed columns
-    cards_df = cards_df[['tcgplayer_id', 'name', 'set', 'usdPrice', 'eurPrice']]
-
-    print(f"Prepared cards pricing data with columns: {cards_df.columns.tolist()}")
-    print(f"Cards with tcgplayer_id: {cards_df['tcgplayer_id'].count()}")
-    print(f"Cards with usdPrice: {cards_df['usdPrice'].count()}")
-    print(f"Cards with eurPrice: {cards_df['eurPrice'].count()}")
-
-    # Create multiple versions of tcgplayer_id for matching
-    cards_df['tcgplayer_id_int'] = pd.to_numeric(cards_df['tcgplayer_id'], errors='coerce').fillna(-1).astype(int)
-    cards_df['tcgplayer_id_str'] = cards_df['tcgplayer_id_int'].astype(str)
-
-# 2. Extract product data
-print("\nExtracting product data...")
-products_pricing = list(db.products.find(
-    {},
-    {"_id": 1, "productId": 1, "name": 1, "lowPrice": 1, "midPrice": 1, "marketPrice": 1, "directLowPrice": 1}
-))
-
-# Convert to dataframe
-products_df = pd.DataFrame(products_pricing)
-print(f"Retrieved {len(products_df)} products")
-
-if not products_df.empty:
-    print(f"Products DataFrame columns: {products_df.columns.tolist()}")
-    print(f"Products with productId: {products_df['productId'].count()}")
-
-    # Create multiple versions of productId for matching
-    products_df['productId_int'] = pd.to_numeric(products_df['productId'], errors='coerce').fillna(-1).astype(int)
-    products_df['productId_str'] = products_df['productId_int'].astype(str)
-
-# 3. Attempt matching using different methods
-print("\nAttempting matches between cards and products...")
-
-# Initialize counters for statistics
-total_updates = 0
-cards_with_usd = cards_df['usdPrice'].count()
-cards_with_eur = cards_df['eurPrice'].count()
-
-# Ensure both dataframes are not empty before attempting joins
-if not cards_df.empty and not products_df.empty:
-    # Try joining by integer versions of IDs
-    merged_df = pd.merge(
-        products_df,
-        cards_df,
-        left_on='productId_int',
-        right_on='tcgplayer_id_int',
-        how='left'
-    )
-
-    # Count matches found
-    usd_matched = merged_df['usdPrice'].notna().sum()
-    eur_matched = merged_df['eurPrice'].notna().sum()
-    total_products = len(merged_df)
-
-    print(
-        f"Match results: {usd_matched} products matched with USD prices out of {total_products} ({usd_matched / total_products * 100:.2f}%)")
-    print(f"EUR price matches: {eur_matched} products ({eur_matched / total_products * 100:.2f}%)")
-
-    if usd_matched > 0 or eur_matched > 0:
-        print("\nUpdating products collection with USD and EUR prices...")
-
-        # Create a batch array for bulk updates
-        bulk_updates = []
-
-        # Keep track of matched and updated products
-        updated_products = set()
-
-        # Process each row in the merged dataframe
-        for _, row in merged_df.iterrows():
-            product_id = row['_id']
-            usd_price = row['usdPrice']
-            eur_price = row['eurPrice']
-
-            # Only update if at least one price exists and we haven't updated this product yet
-            if (pd.notna(usd_price) or pd.notna(eur_price)) and product_id not in updated_products:
-                update_dict = {}
-                if pd.notna(usd_price):
-                    update_dict['usdPrice'] = float(usd_price)
-                if pd.notna(eur_price):
-                    update_dict['eurPrice'] = float(eur_price)
-
-                # Add to bulk update array
-                bulk_updates.append(
-                    pymongo.UpdateOne(
-                        {'_id': product_id},
-                        {'$set': update_dict}
-                    )
-                )
-
-                updated_products.add(product_id)
-
-                # If we've accumulated 8013 updates, execute them as a batch
-                if len(bulk_updates) >= 8013:
-                    result = db.products.bulk_write(bulk_updates)
-                    total_updates += result.modified_count
-                    print(f"  Processed {len(bulk_updates)} updates...")
-                    bulk_updates = []
-
-        # Execute any remaining updates
-        if bulk_updates:
-            result = db.products.bulk_write(bulk_updates)
-            total_updates += result.modified_count
-
-        # Report final stats
-        end_time = time()
-        elapsed_time = end_time - start_time
-
+# Shared modules (bulk_writer, ...) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_writer
+
+MTG_GAME_ID = 1
+
+# Stamped on every product that received Scryfall prices in a run
+PRICES_AT_FIELD = "scryfallPricesAt"
+
+
+class TransferCounter(monitoring.CommandListener):
+    """Bytes of BSON sent to and received from the server (commands and replies)"""
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+
+    def started(self, event):
+        self.sent += len(bson.encode(event.command))
+
+    def succeeded(self, event):
+        self.received += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+def to_number(expression, to):
+    """$convert that drops the field when the value is missing or not numeric"""
+    return {"$convert": {"input": expression, "to": to, "onError": "$$REMOVE", "onNull": "$$REMOVE"}}
+
+
+def server_pipeline(run_time):
+    """
+    Join cards to products inside Mongo and merge usdPrice/eurPrice into products.
+
+    tcgplayer_id is normalized to an int (it is stored as int or string), each product
+    takes the first card carrying its id, and the $lookup uses the productId/gameId
+    unique index.
+    """
+    return [
+        {"$match": {"tcgplayer_id": {"$exists": True, "$nin": [None, ""]}}},
+        {"$project": {
+            "_id": 0,
+            "productId": to_number("$tcgplayer_id", "int"),
+            "usdPrice": to_number("$prices.usd", "double"),
+            "eurPrice": to_number("$prices.eur", "double")
+        }},
+        {"$match": {
+            "productId": {"$exists": True},
+            "$or": [{"usdPrice": {"$exists": True}}, {"eurPrice": {"$exists": True}}]
+        }},
+        {"$group": {"_id": "$productId", "usdPrice": {"$first": "$usdPrice"}, "eurPrice": {"$first": "$eurPrice"}}},
+        {"$lookup": {
+            "from": "products",
+            "let": {"productId": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$productId", "$$productId"]},
+                    {"$eq": ["$gameId", MTG_GAME_ID]}
+                ]}}},
+                {"$project": {"_id": 1}}
+            ],
+            "as": "product"
+        }},
+        {"$unwind": "$product"},
+        {"$project": {
+            "_id": "$product._id",
+            "usdPrice": {"$ifNull": ["$usdPrice", "$$REMOVE"]},
+            "eurPrice": {"$ifNull": ["$eurPrice", "$$REMOVE"]},
+            PRICES_AT_FIELD: {"$literal": run_time}
+        }},
+        {"$merge": {"into": "products", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ]
+
+
+def update_server_side(db, run_time):
+    """
+    Returns:
+        Number of products that received prices
+    """
+    print("Joining cards to products server-side ($lookup + $merge)...")
+    db.cards.aggregate(server_pipeline(run_time), allowDiskUse=True)
+    return db.products.count_documents({PRICES_AT_FIELD: run_time})
+
+
+def update_client_side(db, run_time):
+    """
+    Fallback: stream projected columns, join with pandas and build updates from arrays.
+
+    Returns:
+        Number of products that received prices
+    """
+    print("Extracting pricing data from cards collection...")
+    cards = list(db.cards.find(
+        {"tcgplayer_id": {"$exists": True}},
+        {"_id": 0, "tcgplayer_id": 1, "prices.usd": 1, "prices.eur": 1}
+    ))
+    cards_df = pd.DataFrame({
+        "productId": [card.get("tcgplayer_id") for card in cards],
+        "usdPrice": [(card.get("prices") or {}).get("usd") for card in cards],
+        "eurPrice": [(card.get("prices") or {}).get("eur") for card in cards],
+    })
+    del cards
+    print(f"Retrieved {len(cards_df)} cards with tcgplayer_id")
+
+    for column in ("productId", "usdPrice", "eurPrice"):
+        cards_df[column] = pd.to_numeric(cards_df[column], errors="coerce")
+    cards_df = cards_df[cards_df["productId"].notna() & (cards_df["usdPrice"].notna() | cards_df["eurPrice"].notna())]
+    cards_df = cards_df.drop_duplicates("productId")
+    print(f"Cards with usdPrice: {cards_df['usdPrice'].count()}, with eurPrice: {cards_df['eurPrice'].count()}")
+
+    print("\nExtracting product data...")
+    products = list(db.products.find({"gameId": MTG_GAME_ID}, {"_id": 1, "productId": 1}))
+    products_df = pd.DataFrame({
+        "_id": [product["_id"] for product in products],
+        "productId": pd.to_numeric(pd.Series([product.get("productId") for product in products], dtype=object),
+                                   errors="coerce"),
+    })
+    del products
+    print(f"Retrieved {len(products_df)} products")
+
+    merged_df = products_df.merge(cards_df, on="productId", how="inner")
+    print(f"Match results: {len(merged_df)} products matched with card prices out of {len(products_df)}")
+
+    ids = merged_df["_id"].to_numpy()
+    usd = merged_df["usdPrice"].to_numpy(dtype=np.float64)
+    eur = merged_df["eurPrice"].to_numpy(dtype=np.float64)
+    has_usd = ~np.isnan(usd)
+    has_eur = ~np.isnan(eur)
+
+    print("\nUpdating products collection with USD and EUR prices...")
+    writer = bulk_writer.AdaptiveBulkWriter(db.products, name="products usd/eur prices")
+    for mask, fields in (
+        (has_usd & has_eur, ("usdPrice", "eurPrice")),
+        (has_usd & ~has_eur, ("usdPrice",)),
+        (~has_usd & has_eur, ("eurPrice",)),
+    ):
+        columns = [usd[mask] if field == "usdPrice" else eur[mask] for field in fields]
+        for product_id, *values in zip(ids[mask], *columns):
+            update = {field: float(value) for field, value in zip(fields, values)}
+            update[PRICES_AT_FIELD] = run_time
+            writer.add(pymongo.UpdateOne({"_id": product_id}, {"$set": update}))
+    writer.close()
+    writer.report()
+
+    # Save the merged data to CSV for further analysis
+    merged_df.to_csv('products_with_card_prices.csv', index=False)
+    print("Saved combined pricing data to products_with_card_prices.csv")
+    return len(merged_df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy Scryfall USD/EUR prices from cards onto products")
+    parser.add_argument("--mode", choices=("server", "client"), default="server",
+                        help="Join inside Mongo ($lookup/$merge) or in pandas")
+    args = parser.parse_args()
+
+    # Connect to MongoDB
+    transfer = TransferCounter()
+    client = pymongo.MongoClient(os.environ.get("MONGO_URI"), event_listeners=[transfer])
+    db = client.get_database()
+    print("Connected to database:", db.name)
+
+    start_time = time()
+    run_time = datetime.now()
+    mode = args.mode
+    try:
+        if mode == "server":
+            try:
+                updated = update_server_side(db, run_time)
+            except OperationFailure as e:
+                # e.g. servers or roles without $merge support
+                print(f"Server-side join failed ({e}), falling back to the client-side join")
+                mode = "client"
+        if mode == "client":
+            updated = update_client_side(db, run_time)
+
+        elapsed_time = time() - start_time
         print("\n===== SUMMARY =====")
-        print(f"Total cards with tcgplayer_id: {len(cards_df)}")
-        print(f"Cards with USD prices: {cards_with_usd}")
-        print(f"Cards with EUR prices: {cards_with_eur}")
-        print(f"Total products: {len(products_df)}")
-        print(f"Products matched with cards: {len(updated_products)}")
-        print(f"Products updated in database: {total_updates}")
+        print(f"Mode: {mode}")
+        print(f"Products updated with card prices: {updated}")
         print(f"Time elapsed: {elapsed_time:.2f} seconds")
-
-        # Calculate match rate
-        match_rate = len(updated_products) / len(products_df) * 100
-        print(f"Match rate: {match_rate:.2f}%")
-
-        # Save the merged data to CSV for further analysis
-        merged_df.to_csv('products_with_card_prices.csv', index=False)
-        print("Saved combined pricing data to products_with_card_prices.csv")
-    else:
-        print("No matches found between products and cards, no MongoDB updates made")
-else:
-    print("One or both collections were empty, couldn't perform the join")
\ No newline at end of file
+        print(f"Transferred: {transfer.sent / 1e6:.2f} MB sent, {transfer.received / 1e6:.2f} MB received")
+    finally:
+        client.close()
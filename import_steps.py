@@ -0,0 +1,67 @@
+import buy_indicators
+import crosswalk
+import market_movers
+import price_matrix
+import price_stats
+import set_stats
+
+# Product fields the post-import steps need, re-read from products for groups whose
+# file did not change since the last import
+STORED_ROW_FIELDS = ("productId", "gameId", "groupId", "name", "subTypeName", "extRarity", "extNumber") + price_matrix.MATRIX_FIELDS
+
+
+def add_matrix_row(matrix_prices, matrix_metadata, record, group_id=None):
+    """Record one product row's prices and metadata for today's price matrix row"""
+    matrix_key = price_matrix.column_key(record["productId"], record.get("subTypeName"))
+    matrix_prices[matrix_key] = {
+        field: record[field] for field in price_matrix.MATRIX_FIELDS
+        if isinstance(record.get(field), (int, float))
+    }
+    matrix_metadata[matrix_key] = {
+        "productId": record["productId"],
+        "name": record.get("name"),
+        "subTypeName": record.get("subTypeName"),
+        "groupId": record.get("groupId", group_id),
+        "rarity": record.get("extRarity"),
+        "number": record.get("extNumber")
+    }
+
+
+def stored_group_rows(collection, game_id, group_id):
+    """The stored products of one group, with the fields of a CSV row the steps read"""
+    return collection.find(
+        {"gameId": game_id, "groupId": group_id},
+        {"_id": 0, **{field: 1 for field in STORED_ROW_FIELDS}},
+        batch_size=5000
+    )
+
+
+def run_post_import(db, import_day, matrix_prices, matrix_metadata, groups_with_new_products=()):
+    """
+    Steps that follow every product import: the price matrix row, rolling price stats,
+    market movers, set stats, crosswalk links, buy indicators and lookup-miss cleanup.
+    """
+    if matrix_prices:
+        matrix = price_matrix.PriceMatrix()
+        matrix.append_day(import_day, matrix_prices)
+        print(f"Appended {len(matrix_prices)} products to the price matrix ({len(matrix.days)} days)")
+
+        # deltaPrice/globalPrice/EWMA/volatility only need today's row on top of saved state
+        price_stats.update_products(db, matrix)
+
+        # Movers come from today's vs. previous price vectors, never from a history scan
+        boards = market_movers.refresh_movers(db, matrix, matrix_metadata)
+        print(f"Refreshed {boards} market mover leaderboards")
+
+        sets_written = set_stats.refresh_set_stats(db, matrix, matrix_metadata)
+        print(f"Updated stats for {sets_written} sets")
+
+    # New products may complete links for cards that had none
+    crosswalk.update_links(db)
+
+    # Buy indicators only for products whose row, link or card price changed
+    buy_indicators.update_deals(db)
+
+    if groups_with_new_products:
+        cleared = crosswalk.clear_lookup_misses(db, groups_with_new_products)
+        print(f"Cleared cached lookup misses on {cleared} cards in {len(groups_with_new_products)} groups with new products")
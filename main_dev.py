@@ -14,6 +14,8 @@ from flask_caching import Cache
 from flask_cors import CORS
 from pymongo import MongoClient
 
+import rulings
+
 load_dotenv()
 
 # Configure logging
@@ -82,6 +84,7 @@ db = client['mtgdbmongo']
 cards_collection = db['cards']
 products_collection = db['products']
 spotprices_collection = db['spotprices']
+rulings_collection = db[rulings.RULINGS_COLLECTION]
 
 
 app.config['TEMPLATES_AUTO_RELOAD'] = True
@@ -386,7 +389,7 @@ def find_tcgplayer_id_by_name_and_set(card_name, set_code):
 def get_card_rulings(id_value):
     """
     Get rulings for a card by either its Scryfall ID or TCGPlayer ID
-    and store the rulings data array in the rulingsDetails field
+    from the rulings collection (keyed by oracle_id)
     """
     # Initialize MongoDB connection
     client = MongoClient(os.getenv("MONGO_URI"))
@@ -436,153 +439,30 @@ def get_card_rulings(id_value):
 
     logger.info(f"Found card: {card.get('name', 'Unknown')} using {id_type}")
 
-    # Check if we already have rulings data stored
-    if card.get('rulingsDetails'):
-        logger.info(f"Card already has rulings data stored in rulingsDetails")
-        # Convert the MongoDB document to a Python dictionary with ObjectId converted to string
-        card_dict = json.loads(json_util.dumps(card))
-        return jsonify({
-            "message": "Retrieved rulings from database",
-            "card": card_dict
-        })
-
-    # Get the Scryfall ID for constructing the rulings URI
-    scryfall_id = card.get('id')
-    if not scryfall_id:
-        logger.error(f"Card doesn't have a Scryfall ID")
-        return jsonify({
-            "error": "Missing Scryfall ID",
-            "details": "The card was found but doesn't have a Scryfall ID needed for rulings"
-        }), 500
-
-    # Extract or construct the rulings URI
-    rulings_uri = card.get('rulings_uri')
-
-    if not rulings_uri:
-        # Construct the rulings URI from the card ID
-        rulings_uri = f"https://api.scryfall.com/cards/{scryfall_id}/rulings"
-        logger.info(f"Constructed rulings URI: {rulings_uri}")
-
-    # Make request to Scryfall API
-    try:
-        # Add a small delay to respect Scryfall's rate limits
-        time.sleep(0.11)
-
-        logger.info(f"Making request to: {rulings_uri}")
-        response = requests.get(rulings_uri)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-
-        rulings_data = response.json()
-
-        # Extract only the data array from the rulings response
-        rulings_details = rulings_data.get('data', [])
-
-        # Process the rulings to prevent datetime-dictionary operations
-        # Convert any datetime objects to strings to avoid operations between incompatible types
-        processed_rulings = []
-        for ruling in rulings_details:
-            processed_ruling = {}
-            # Safely copy each field
-            for key, value in ruling.items():
-                # Handle the published_at field specifically
-                if key == 'published_at':
-                    # Keep as string to avoid datetime operations
-                    processed_ruling[key] = value
-                # Handle any other datetime fields that might be in the data
-                elif isinstance(value, dict):
-                    # Make a deep copy of dictionaries to avoid reference issues
-                    processed_ruling[key] = dict(value)
-                else:
-                    processed_ruling[key] = value
-            processed_rulings.append(processed_ruling)
-
-        ruling_count = len(processed_rulings)
-        logger.info(f"Got response with {ruling_count} rulings")
-
-        # Update the card document with the processed rulings
-        cards_collection.update_one(
-            {"_id": card["_id"]},
-            {"$set": {"rulingsDetails": processed_rulings}}
-        )
-
-        # Fetch the updated card
-        updated_card = cards_collection.find_one({"_id": card["_id"]})
-
-        # Convert to dictionary with ObjectId converted to string
-        updated_card_dict = json.loads(json_util.dumps(updated_card))
-
-        # Return the updated card with rulings included
-        return jsonify({
-            "message": "Retrieved rulings from Scryfall API and stored in database",
-            "card": updated_card_dict
-        })
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch rulings: {str(e)}")
-        return jsonify({
-            "error": "Failed to fetch rulings",
-            "details": str(e)
-        }), 500
-    except Exception as e:
-        logger.error(f"Error processing rulings for card {card.get('name', 'Unknown')}: {str(e)}")
-        # Log the full exception traceback for debugging
-        import traceback
-        logger.error(traceback.format_exc())
-        return jsonify({
-            "error": "Failed to process rulings",
-            "details": str(e)
-        }), 500
+    # Rulings are shared by every printing and stored once per oracle_id
+    card['rulings'] = rulings.rulings_for(rulings_collection, card)
+    logger.info(f"Card has {len(card['rulings'])} rulings")
 
+    # Convert the MongoDB document to a Python dictionary with ObjectId converted to string
+    card_dict = json.loads(json_util.dumps(card))
+    return jsonify({
+        "message": "Retrieved rulings from database",
+        "card": card_dict
+    })
 
 
 @app.route('/update-all-rulings', methods=['POST'])
 def update_all_rulings():
-    """Update the rulings for all cards in the database"""
-    # This could be a long-running task, consider implementing as a background job
-    client = MongoClient(os.getenv("MONGO_URI"))
-    db = client['mtgdbmongo']
-    cards_collection = db['cards']
-
-    # Find all cards without rulingsData
-    cards_without_rulings = list(cards_collection.find(
-        {"rulingsData": {"$exists": False}},
-        {"id": 1, "name": 1}
-    ))
-
-    logger.info(f"Found {len(cards_without_rulings)} cards without rulings data")
-
-    updated_count = 0
-    for card in cards_without_rulings:
-        card_id = card.get('id')
-        if not card_id:
-            continue
-
-        # Create the rulings URI
-        rulings_uri = f"https://api.scryfall.com/cards/{card_id}/rulings"
-
-        try:
-            # Respect Scryfall's rate limits with a delay between requests
-            time.sleep(0.1)
-
-            response = requests.get(rulings_uri)
-            if response.status_code == 200:
-                rulings_data = response.json()
-
-                # Update the card with the rulings data
-                cards_collection.update_one(
-                    {"id": card_id},
-                    {"$set": {"rulingsData": rulings_data}}
-                )
-
-                updated_count += 1
-                if updated_count % 10 == 0:
-                    logger.info(f"Updated {updated_count} cards so far")
-        except Exception as e:
-            logger.error(f"Error updating rulings for card {card.get('name')}: {str(e)}")
+    """Refresh every card's rulings with one streaming import of the Scryfall rulings bulk file"""
+    try:
+        stats = rulings.refresh_rulings(db)
+    except Exception as e:
+        logger.error(f"Rulings import failed: {str(e)}")
+        return jsonify({"error": "Rulings import failed", "details": str(e)}), 500
 
     return jsonify({
-        "message": f"Updated rulings for {updated_count} cards",
-        "total_cards": len(cards_without_rulings)
+        "message": f"Imported rulings for {stats['oracles']} oracle cards",
+        **stats
     })
 
 
@@ -803,7 +683,10 @@ def art_gallery():
 def card_detail(card_id, card_slug=None):
     """Card detail page with rulings"""
 
-    card = cards_collection.find_one({"id": card_id})
+    # Get the card with its rulings joined by oracle_id
+    card = next(cards_collection.aggregate(
+        [{"$match": {"id": card_id}}, {"$limit": 1}] + rulings.card_rulings_stages()
+    ), None)
     if not card:
         return render_template('error.html', message="Card not found"), 404
 
@@ -811,23 +694,6 @@ def card_detail(card_id, card_slug=None):
     thread.daemon = False  # Ensure thread isn't a daemon
     thread.start()
 
-    # Get rulings from the card document (or API if needed)
-    # If the card already has rulings_data, use that
-    if card.get("rulings_data") is not None:
-        rulings = card.get("rulings_data", [])
-
-        # Check if we need to refresh rulings in the background
-        last_updated = card.get("rulings_last_updated")
-        if last_updated and (datetime.now() - last_updated).days > 30:
-            # Fetch updated rulings in the background
-            from threading import Thread
-            update_thread = Thread(target=fetch_card_rulings, args=(card_id, True))
-            update_thread.daemon = True
-            update_thread.start()
-    else:
-        # No rulings yet, fetch them now
-        rulings = fetch_card_rulings(card_id)
-
     # Get other printings of the same card (English only)
     other_printings = []
     if card.get("oracle_id"):
@@ -856,7 +722,7 @@ def card_detail(card_id, card_slug=None):
     return render_template('card_detail.html',
                            card=card,
                            similar_cards=similar_cards,
-                           rulings=rulings,
+                           rulings=card['rulings'],
                            other_printings=other_printings,
                            cards_by_artist=cards_by_artist)
 
@@ -1224,155 +1090,9 @@ def gemma_search():
     return render_template('search_form.html')
 
 
-# Troubleshooting the rulings fetch
 import requests
 import time
 
-def fetch_card_rulings(card_id, force_update=False):
-    """
-    Fetch rulings for a card from Scryfall API and save to the card document.
-
-    Args:
-        card_id: The Scryfall ID of the card
-        force_update: If True, fetches from API even if we have cached rulings
-
-    Returns:
-        List of rulings for the card
-    """
-    # Check if we already have recent rulings in the database
-    card = cards_collection.find_one({"id": card_id})
-
-    if not card:
-        print(f"Card {card_id} not found in database")
-        return []
-
-    # Check if we already have recent rulings and don't need to force update
-    if not force_update and card.get("rulings") and card.get("rulings_last_updated"):
-        last_updated = card.get("rulings_last_updated")
-        if last_updated and (datetime.now() - last_updated).days < 30:
-            print(f"Using cached rulings for card {card_id}")
-            return card.get("rulings", [])
-
-    # Fetch fresh rulings from Scryfall
-    try:
-        # Use proper URL format for rulings endpoint
-        url = f"https://api.scryfall.com/cards/{card_id}/rulings"
-
-        # Add logging for debugging
-        print(f"Fetching rulings from: {url}")
-
-        # Add proper headers and respect rate limits
-        headers = {
-            'User-Agent': 'MTGAppName/1.0 (your@email.com)'  # Replace with your app info
-        }
-
-        # Make the request with proper error handling
-        response = requests.get(url, headers=headers)
-
-        # Check if we hit a rate limit
-        if response.status_code == 429:
-            # Wait and retry once
-            print("Rate limited, waiting 1 second...")
-            time.sleep(1)
-            response = requests.get(url, headers=headers)
-
-        # Validate response
-        response.raise_for_status()
-
-        # Parse the response
-        data = response.json()
-
-        # Check if we got rulings data
-        if 'data' in data:
-            rulings = data['data']
-            rulings_count = len(rulings)
-            print(f"Found {rulings_count} rulings for card {card_id}")
-
-            # Update the card document with rulings data
-            cards_collection.update_one(
-                {"id": card_id},
-                {
-                    "$set": {
-                        "rulings": rulings,  # Store in card.rulings
-                        "rulings_count": rulings_count,
-                        "rulings_last_updated": datetime.now()
-                    }
-                }
-            )
-
-            return rulings
-        else:
-            print("No 'data' field in rulings response")
-            # Save empty rulings to avoid repeated failed requests
-            cards_collection.update_one(
-                {"id": card_id},
-                {
-                    "$set": {
-                        "rulings": [],  # Store empty list in card.rulings
-                        "rulings_count": 0,
-                        "rulings_last_updated": datetime.now()
-                    }
-                }
-            )
-            return []
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching rulings: {str(e)}")
-        # Return existing rulings if available
-        if card and card.get("rulings"):
-            return card.get("rulings", [])
-        return []
-    except ValueError as e:
-        print(f"Error parsing rulings JSON: {str(e)}")
-        return []
-
-
-
-# Batch processing function to populate rulings for all cards
-def populate_rulings_for_all_cards(batch_size=100, delay_seconds=0.1):
-    """
-    Populate rulings for all cards in the database.
-    Use this for initial population or periodic full updates.
-
-    Args:
-        batch_size: Number of cards to process in each batch
-        delay_seconds: Delay between API calls to avoid rate limiting
-    """
-    from datetime import timedelta
-
-    # Get all cards that don't have rulings or haven't been updated recently
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-
-    # Find cards needing rulings update
-    cards_needing_rulings = list(cards_collection.find(
-        {
-            "$or": [
-                {"rulings_data": {"$exists": False}},
-                {"rulings_last_updated": {"$lt": thirty_days_ago}}
-            ]
-        },
-        {"id": 1}
-    ).limit(1000))  # Process in chunks of 1000 cards
-
-    print(f"Found {len(cards_needing_rulings)} cards needing rulings updates")
-
-    # Process in batches with rate limiting
-    for i in range(0, len(cards_needing_rulings), batch_size):
-        batch = cards_needing_rulings[i:i + batch_size]
-        print(
-            f"Processing batch {i // batch_size + 1} of {(len(cards_needing_rulings) + batch_size - 1) // batch_size}")
-
-        for card in batch:
-            card_id = card.get("id")
-            if card_id:
-                # Fetch and save rulings
-                fetch_card_rulings(card_id)
-
-                # Wait to avoid rate limiting
-                time.sleep(delay_seconds)
-
-        print(f"Completed batch {i // batch_size + 1}")
-
 
 async def fetch_url(session, url):
     """Fetch a single URL and return the status"""
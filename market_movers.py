@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pymongo
+
+# Precomputed leaderboards, one small document per (window, set, rarity)
+MOVERS_COLLECTION = "movers"
+
+# Look-back windows in days
+MOVER_WINDOWS = (1, 7, 30)
+
+# Entries kept per leaderboard list
+LEADERBOARD_SIZE = 25
+
+# Percent change on sub-$0.50 cards is mostly noise, so they only rank by absolute change
+MIN_PRICE_FOR_PERCENT = 0.5
+
+MOVERS_FIELD = "marketPrice"
+
+_LISTS = {
+    # list name: (column, ascending)
+    "gainers_abs": ("change", False),
+    "losers_abs": ("change", True),
+    "gainers_pct": ("pct", False),
+    "losers_pct": ("pct", True),
+}
+
+
+def ensure_movers_collection(db):
+    """Create the leaderboard index so every request is a single indexed read"""
+    collection = db[MOVERS_COLLECTION]
+    collection.create_index(
+        [("window", pymongo.ASCENDING), ("groupId", pymongo.ASCENDING), ("rarity", pymongo.ASCENDING)],
+        unique=True,
+        name="window_groupId_rarity_idx"
+    )
+    return collection
+
+
+def _previous_row(matrix, days):
+    """Row holding the most recent import at least `days` before the latest one, or None"""
+    target = matrix.days[-1] - timedelta(days=days)
+    rows = matrix.day_range(end=target)
+    return rows.stop - 1 if rows.stop > 0 else None
+
+
+def compute_movers(matrix, metadata, windows=MOVER_WINDOWS, field=MOVERS_FIELD, size=LEADERBOARD_SIZE):
+    """
+    Build every leaderboard from the current and previous price vectors.
+
+    Args:
+        matrix: An open PriceMatrix with today's row appended
+        metadata: Dictionary of column_key -> {productId, name, groupId, rarity, subTypeName}
+        windows: Look-back windows in days
+        field: Price field to rank on
+        size: Entries per list
+
+    Returns:
+        List of leaderboard documents
+    """
+    if not matrix.days or not metadata:
+        return []
+
+    keys = [key for key in metadata if key in matrix.columns]
+    cols = np.array([matrix.columns[key] for key in keys], dtype=np.int64)
+    prices = matrix.matrix(field)
+    current = np.asarray(prices[len(matrix.days) - 1], dtype=np.float64)[cols]
+
+    base = pd.DataFrame({
+        "key": keys,
+        "productId": [metadata[key].get("productId") for key in keys],
+        "name": [metadata[key].get("name") for key in keys],
+        "subTypeName": [metadata[key].get("subTypeName") for key in keys],
+        "groupId": [metadata[key].get("groupId") for key in keys],
+        "rarity": [metadata[key].get("rarity") for key in keys],
+        "price": current,
+    })
+
+    documents = []
+    as_of = matrix.days[-1]
+
+    for window in windows:
+        row = _previous_row(matrix, window)
+        if row is None:
+            continue
+
+        frame = base.copy()
+        frame["previous"] = np.asarray(prices[row], dtype=np.float64)[cols]
+        frame = frame[frame["price"].notna() & frame["previous"].notna()]
+        frame["change"] = frame["price"] - frame["previous"]
+        frame["pct"] = np.where(
+            frame["previous"] >= MIN_PRICE_FOR_PERCENT,
+            frame["change"] / frame["previous"] * 100,
+            np.nan
+        )
+
+        boards = {}
+        for list_name, (column, ascending) in _LISTS.items():
+            ranked = frame[frame[column].notna()].sort_values(column, ascending=ascending)
+            # Losers only list drops and gainers only rises
+            ranked = ranked[ranked[column] < 0] if ascending else ranked[ranked[column] > 0]
+
+            scopes = [
+                ranked.head(size).assign(scope_group=None, scope_rarity=None),
+                ranked.groupby("groupId", sort=False).head(size).assign(
+                    scope_group=lambda f: f["groupId"], scope_rarity=None),
+                ranked.groupby("rarity", sort=False).head(size).assign(
+                    scope_group=None, scope_rarity=lambda f: f["rarity"]),
+                ranked.groupby(["groupId", "rarity"], sort=False).head(size).assign(
+                    scope_group=lambda f: f["groupId"], scope_rarity=lambda f: f["rarity"]),
+            ]
+
+            for scoped in scopes:
+                for (group_id, rarity), entries in scoped.groupby(["scope_group", "scope_rarity"], dropna=False, sort=False):
+                    group_id = None if pd.isna(group_id) else int(group_id)
+                    rarity = None if pd.isna(rarity) else rarity
+                    board = boards.setdefault((group_id, rarity), {name: [] for name in _LISTS})
+                    board[list_name] = [
+                        {
+                            "productId": int(entry.productId),
+                            "name": entry.name,
+                            "subTypeName": entry.subTypeName,
+                            "groupId": None if pd.isna(entry.groupId) else int(entry.groupId),
+                            "rarity": None if pd.isna(entry.rarity) else entry.rarity,
+                            "price": round(float(entry.price), 2),
+                            "previous": round(float(entry.previous), 2),
+                            "change": round(float(entry.change), 2),
+                            "pct": None if pd.isna(entry.pct) else round(float(entry.pct), 1),
+                        }
+                        for entry in entries.itertuples(index=False)
+                    ]
+
+        for (group_id, rarity), board in boards.items():
+            documents.append({
+                "_id": f"{window}:{group_id if group_id is not None else '*'}:{rarity or '*'}",
+                "window": window,
+                "groupId": group_id,
+                "rarity": rarity,
+                "asOf": as_of,
+                "previousDay": matrix.days[row],
+                **board
+            })
+
+    return documents
+
+
+def refresh_movers(db, matrix, metadata):
+    """
+    Recompute and store every leaderboard, dropping boards that no longer have entries.
+
+    Returns:
+        Number of leaderboards written
+    """
+    collection = ensure_movers_collection(db)
+    documents = compute_movers(matrix, metadata)
+    if not documents:
+        return 0
+
+    collection.bulk_write(
+        [pymongo.ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents],
+        ordered=False
+    )
+    collection.delete_many({"asOf": {"$lt": matrix.days[-1]}})
+    return len(documents)
+
+
+def read_movers(collection, window=1, group_id=None, rarity=None):
+    """Fetch one precomputed leaderboard (a single indexed read)"""
+    return collection.find_one(
+        {"window": window, "groupId": group_id, "rarity": rarity},
+        {"_id": 0}
+    )
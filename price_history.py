@@ -0,0 +1,326 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pymongo
+
+# Collection holding per-product price history fed by the daily CSV import
+HISTORY_COLLECTION = "price_history"
+
+# Price columns from the TCGplayer ProductsAndPrices CSVs that we keep history for
+PRICE_FIELDS = ("lowPrice", "midPrice", "highPrice", "marketPrice", "directLowPrice")
+
+# One slot per day of the month, so a bucket never grows after it is created
+DAYS_PER_BUCKET = 31
+
+# "bucket" stores one document per product per month with fixed-size arrays,
+# "timeseries" stores one measurement per product per day in a time-series collection
+HISTORY_MODE = os.getenv("PRICE_HISTORY_MODE", "bucket")
+
+_EMPTY_BUCKET = [None] * DAYS_PER_BUCKET
+
+
+def month_start(day):
+    """Return midnight on the first day of the month containing `day`"""
+    return datetime(day.year, day.month, 1)
+
+
+def bucket_id(product_id, sub_type, month):
+    """Build the deterministic _id of a monthly bucket, e.g. '9722:Normal:2025-04'"""
+    return f"{product_id}:{sub_type or 'Normal'}:{month.strftime('%Y-%m')}"
+
+
+def ensure_price_history_collection(db, mode=None):
+    """
+    Create the price history collection and its indexes if they don't exist.
+
+    Args:
+        db: The pymongo database
+        mode: "bucket" or "timeseries" (defaults to PRICE_HISTORY_MODE)
+
+    Returns:
+        The price history collection
+    """
+    mode = mode or HISTORY_MODE
+
+    if HISTORY_COLLECTION not in db.list_collection_names():
+        if mode == "timeseries":
+            db.create_collection(
+                HISTORY_COLLECTION,
+                timeseries={"timeField": "ts", "metaField": "meta", "granularity": "hours"}
+            )
+        else:
+            db.create_collection(HISTORY_COLLECTION)
+
+    collection = db[HISTORY_COLLECTION]
+
+    if mode == "timeseries":
+        collection.create_index(
+            [("meta.productId", pymongo.ASCENDING), ("meta.subTypeName", pymongo.ASCENDING), ("ts", pymongo.ASCENDING)],
+            name="meta_productId_subType_ts_idx"
+        )
+    else:
+        # A year of history for one product is a single range scan on this index
+        collection.create_index(
+            [("productId", pymongo.ASCENDING), ("subTypeName", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+            name="productId_subType_month_idx"
+        )
+
+    return collection
+
+
+def _slot_set(field, index, value):
+    """
+    Aggregation expression that writes `value` into slot `index` of a fixed-size array,
+    allocating the array the first time the bucket is touched.
+    """
+    array = {"$ifNull": [f"${field}", _EMPTY_BUCKET]}
+    return {
+        "$concatArrays": [
+            {"$slice": [array, index]},
+            [value],
+            {"$slice": [array, index + 1, DAYS_PER_BUCKET]}
+        ]
+    }
+
+
+def history_update(row, day):
+    """
+    Build the bucket-mode upsert for one CSV row.
+
+    The update is a pipeline so the same operation allocates a new month's arrays and
+    writes today's slot; re-running an import on the same day overwrites the slot
+    instead of appending a duplicate.
+
+    Args:
+        row: The processed CSV row (must contain productId)
+        day: The datetime of the import
+
+    Returns:
+        A pymongo.UpdateOne, or None if the row has no prices
+    """
+    prices = {field: row[field] for field in PRICE_FIELDS if isinstance(row.get(field), (int, float))}
+    if not prices:
+        return None
+
+    sub_type = row.get("subTypeName") or "Normal"
+    month = month_start(day)
+    index = day.day - 1
+
+    stage = {
+        "productId": row["productId"],
+        "gameId": row.get("gameId"),
+        "groupId": row.get("groupId"),
+        "subTypeName": sub_type,
+        "month": month,
+        "updated_at": day
+    }
+    for field, value in prices.items():
+        stage[field] = _slot_set(field, index, float(value))
+
+    return pymongo.UpdateOne(
+        {"_id": bucket_id(row["productId"], sub_type, month)},
+        [{"$set": stage}],
+        upsert=True
+    )
+
+
+def history_insert(row, day):
+    """
+    Build the time-series measurement for one CSV row.
+
+    Time-series collections cannot upsert, so a rerun on the same day adds a second
+    measurement for the day; read_history keeps the one recorded last.
+
+    Returns:
+        A pymongo.InsertOne, or None if the row has no prices
+    """
+    prices = {field: float(row[field]) for field in PRICE_FIELDS if isinstance(row.get(field), (int, float))}
+    if not prices:
+        return None
+
+    document = {
+        "ts": datetime(day.year, day.month, day.day),
+        "recorded_at": day,
+        "meta": {
+            "productId": row["productId"],
+            "gameId": row.get("gameId"),
+            "subTypeName": row.get("subTypeName") or "Normal"
+        }
+    }
+    document.update(prices)
+    return pymongo.InsertOne(document)
+
+
+def history_operation(row, day, mode=None):
+    """Return the write operation for `row` in the configured history mode"""
+    if (mode or HISTORY_MODE) == "timeseries":
+        return history_insert(row, day)
+    return history_update(row, day)
+
+
+def read_history(collection, product_id, start=None, end=None, sub_type="Normal", mode=None):
+    """
+    Read the price history of one product as columnar lists.
+
+    Bucket mode reads every month in the range with a single indexed query, so a year
+    of history is one round trip returning at most 12 small documents.
+
+    Args:
+        collection: The price history collection
+        product_id: The TCGplayer productId
+        start: First day to include (defaults to one year ago)
+        end: Last day to include (defaults to today)
+        sub_type: The product sub type (Normal, Foil, ...)
+        mode: "bucket" or "timeseries" (defaults to PRICE_HISTORY_MODE)
+
+    Returns:
+        Dictionary with a "dates" list and one list per price field, oldest first
+    """
+    end = end or datetime.now()
+    start = start or end - timedelta(days=365)
+    start_day = datetime(start.year, start.month, start.day)
+    end_day = datetime(end.year, end.month, end.day)
+
+    history = {"dates": []}
+    for field in PRICE_FIELDS:
+        history[field] = []
+
+    if (mode or HISTORY_MODE) == "timeseries":
+        cursor = collection.find(
+            {
+                "meta.productId": product_id,
+                "meta.subTypeName": sub_type,
+                "ts": {"$gte": start_day, "$lte": end_day}
+            },
+            {"_id": 0, "meta": 0}
+        ).sort([("ts", pymongo.ASCENDING), ("recorded_at", pymongo.ASCENDING)])
+
+        for measurement in cursor:
+            # Same-day reruns leave several measurements per day; the last recorded wins
+            if history["dates"] and history["dates"][-1] == measurement["ts"]:
+                for field in PRICE_FIELDS:
+                    history[field][-1] = measurement.get(field)
+                continue
+            history["dates"].append(measurement["ts"])
+            for field in PRICE_FIELDS:
+                history[field].append(measurement.get(field))
+        return history
+
+    cursor = collection.find(
+        {
+            "productId": product_id,
+            "subTypeName": sub_type,
+            "month": {"$gte": month_start(start_day), "$lte": end_day}
+        },
+        {"_id": 0, "month": 1, **{field: 1 for field in PRICE_FIELDS}}
+    ).sort("month", pymongo.ASCENDING)
+
+    for bucket in cursor:
+        month = bucket["month"]
+        for index in range(DAYS_PER_BUCKET):
+            values = [(bucket.get(field) or _EMPTY_BUCKET)[index] for field in PRICE_FIELDS]
+            if all(value is None for value in values):
+                continue
+
+            day = month + timedelta(days=index)
+            # Slots past the end of a short month never get written, but guard anyway
+            if day.month != month.month or day < start_day or day > end_day:
+                continue
+
+            history["dates"].append(day)
+            for field, value in zip(PRICE_FIELDS, values):
+                history[field].append(value)
+
+    return history
+
+
+def lttb_indices(x, y, points):
+    """
+    Pick `points` indices that preserve the visual shape of (x, y) using
+    Largest-Triangle-Three-Buckets. Area computation inside each bucket is vectorized,
+    so the Python loop only runs once per output point.
+
+    Args:
+        x: 1-D float array, strictly increasing
+        y: 1-D float array without NaNs
+        points: Target number of points
+
+    Returns:
+        Sorted int array of selected indices (always includes the first and last point)
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    # points - 2 buckets over the interior; first and last points are always kept
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+
+        # The third triangle vertex is the average of the next bucket (or the last point)
+        if i + 2 < len(edges):
+            next_start, next_stop = edges[i + 1], edges[i + 2]
+            cx = x[next_start:next_stop].mean()
+            cy = y[next_start:next_stop].mean()
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+
+        bx = x[start:stop]
+        by = y[start:stop]
+        areas = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample_columns(dates, columns, points):
+    """
+    Downsample aligned price series to roughly `points` rows.
+
+    One LTTB pass runs over the densest series and the same rows are kept for every
+    column, so the result stays columnar with a single shared time axis.
+
+    Args:
+        dates: List of datetimes, oldest first
+        columns: Dictionary of column name -> list of floats/None, aligned with dates
+        points: Target number of rows
+
+    Returns:
+        Tuple of (dates, columns) with NaNs converted back to None
+    """
+    if not dates:
+        return [], {name: [] for name in columns}
+
+    x = np.array([d.timestamp() for d in dates], dtype=np.float64)
+    arrays = {
+        name: np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        for name, values in columns.items()
+    }
+
+    if points and len(dates) > points:
+        # Use the column with the most observations to decide which rows matter
+        primary = max(arrays.values(), key=lambda values: np.count_nonzero(~np.isnan(values)))
+        valid = ~np.isnan(primary)
+        if valid.any():
+            y = np.interp(x, x[valid], primary[valid])
+        else:
+            y = np.zeros_like(x)
+
+        keep = lttb_indices(x, y, points)
+        dates = [dates[i] for i in keep]
+        arrays = {name: values[keep] for name, values in arrays.items()}
+
+    result = {}
+    for name, values in arrays.items():
+        rounded = np.round(values, 2)
+        result[name] = [None if np.isnan(v) else float(v) for v in rounded]
+
+    return dates, result
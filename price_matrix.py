@@ -0,0 +1,197 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+# Where the day-by-product matrices live; one raw float32 file per price field plus index.json
+PRICE_MATRIX_DIR = os.getenv(
+    "PRICE_MATRIX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "price_matrix")
+)
+
+# Same fields the price history buckets keep
+MATRIX_FIELDS = ("lowPrice", "midPrice", "highPrice", "marketPrice", "directLowPrice")
+
+# Column capacity grows in steps so new products rarely force a rewrite of the files
+INITIAL_CAPACITY = 1 << 16
+
+DTYPE = np.float32
+
+
+def column_key(product_id, sub_type=None):
+    """Key of a product column, e.g. '9722:Normal'"""
+    return f"{product_id}:{sub_type or 'Normal'}"
+
+
+class PriceMatrix:
+    """
+    Memory-mapped float32 matrices of shape (days, products), one per price field.
+
+    Rows are import days, columns are products. Files are plain row-major float32 so
+    every process mapping them read-only shares the same OS page cache, and a day of
+    history for the whole catalog or years of history for one product are both plain
+    NumPy slices. Missing prices are NaN.
+
+    There is a single writer (the daily import); index.json is replaced atomically
+    after the data is written, so readers never see a partially appended row.
+    """
+
+    def __init__(self, path=PRICE_MATRIX_DIR, fields=MATRIX_FIELDS):
+        self.path = path
+        self.fields = tuple(fields)
+        self.days = []
+        self.columns = {}
+        self.capacity = INITIAL_CAPACITY
+        self._maps = {}
+        self._load_index()
+
+    # ------------------------------------------------------------------ index
+
+    def _index_path(self):
+        return os.path.join(self.path, "index.json")
+
+    def _field_path(self, field):
+        return os.path.join(self.path, f"{field}.f32")
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path()):
+            return
+
+        with open(self._index_path(), "r", encoding="utf-8") as f:
+            index = json.load(f)
+
+        self.days = [datetime.strptime(day, "%Y-%m-%d") for day in index["days"]]
+        self.columns = index["columns"]
+        self.capacity = index["capacity"]
+
+    def _write_index(self):
+        index = {
+            "days": [day.strftime("%Y-%m-%d") for day in self.days],
+            "capacity": self.capacity,
+            "columns": self.columns
+        }
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path())
+
+    # ------------------------------------------------------------------ reads
+
+    def matrix(self, field):
+        """Read-only (days, capacity) memmap for `field`; columns past len(columns) are NaN"""
+        if not self.days:
+            return np.empty((0, self.capacity), dtype=DTYPE)
+
+        cached = self._maps.get(field)
+        if cached is None or cached.shape[0] != len(self.days):
+            cached = np.memmap(self._field_path(field), dtype=DTYPE, mode="r",
+                               shape=(len(self.days), self.capacity))
+            self._maps[field] = cached
+        return cached
+
+    def column(self, product_id, sub_type=None):
+        """Column number of a product, or None if it has never been imported"""
+        return self.columns.get(column_key(product_id, sub_type))
+
+    def day_range(self, start=None, end=None):
+        """Row slice covering [start, end] (both inclusive, either may be None)"""
+        days = np.array([day.toordinal() for day in self.days], dtype=np.int64)
+        first = 0 if start is None else int(np.searchsorted(days, start.toordinal(), side="left"))
+        last = len(days) if end is None else int(np.searchsorted(days, end.toordinal(), side="right"))
+        return slice(first, last)
+
+    def history(self, product_id, field="marketPrice", start=None, end=None, sub_type=None):
+        """
+        History of one product as (dates, float32 array); empty if the product is unknown
+        """
+        col = self.column(product_id, sub_type)
+        if col is None:
+            return [], np.empty(0, dtype=DTYPE)
+
+        rows = self.day_range(start, end)
+        return self.days[rows], np.array(self.matrix(field)[rows, col])
+
+    def latest(self, field="marketPrice", lag=0):
+        """Whole-catalog prices `lag` imports before the most recent one"""
+        if len(self.days) <= lag:
+            return np.full(len(self.columns), np.nan, dtype=DTYPE)
+        return np.array(self.matrix(field)[len(self.days) - 1 - lag, :len(self.columns)])
+
+    def product_keys(self):
+        """Column keys ordered by column number"""
+        keys = [None] * len(self.columns)
+        for key, col in self.columns.items():
+            keys[col] = key
+        return keys
+
+    # ----------------------------------------------------------------- writes
+
+    def _grow(self, needed):
+        """Rewrite every field file with a larger column capacity"""
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+
+        for field in self.fields:
+            old = self.matrix(field) if self.days else None
+            tmp_path = self._field_path(field) + ".tmp"
+            grown = np.memmap(tmp_path, dtype=DTYPE, mode="w+",
+                              shape=(max(len(self.days), 1), capacity))
+            grown[:] = np.nan
+            if old is not None:
+                grown[:len(self.days), :self.capacity] = old
+            grown.flush()
+            del grown
+            self._maps.pop(field, None)
+            os.replace(tmp_path, self._field_path(field))
+
+        self.capacity = capacity
+
+    def append_day(self, day, prices):
+        """
+        Append (or replace, if `day` is already the last row) one day of prices.
+
+        Args:
+            day: The import datetime
+            prices: Dictionary of column_key -> {field: value}
+        """
+        os.makedirs(self.path, exist_ok=True)
+        day = datetime(day.year, day.month, day.day)
+        if self.days and self.days[-1] > day:
+            raise ValueError(f"Cannot append {day:%Y-%m-%d} after {self.days[-1]:%Y-%m-%d}")
+
+        for key in prices:
+            if key not in self.columns:
+                self.columns[key] = len(self.columns)
+
+        if len(self.columns) > self.capacity:
+            self._grow(len(self.columns))
+
+        replace_last = bool(self.days) and self.days[-1] == day
+
+        keys = list(prices)
+        cols = np.fromiter((self.columns[key] for key in keys), dtype=np.int64, count=len(keys))
+
+        for field in self.fields:
+            row = np.full(self.capacity, np.nan, dtype=DTYPE)
+            values = np.fromiter(
+                (np.nan if prices[key].get(field) is None else prices[key][field] for key in keys),
+                dtype=DTYPE, count=len(keys)
+            )
+            row[cols] = values
+
+            # Overwrite in place, then drop anything past the row (left over from a crashed
+            # append that never made it into index.json) without touching mapped rows
+            offset = (len(self.days) - (1 if replace_last else 0)) * self.capacity * row.itemsize
+            path = self._field_path(field)
+            with open(path, "r+b" if self.days and os.path.exists(path) else "wb") as f:
+                f.seek(offset)
+                f.write(row.tobytes())
+                f.truncate()
+            self._maps.pop(field, None)
+
+        if not replace_last:
+            self.days.append(day)
+
+        self._write_index()
@@ -0,0 +1,373 @@
+import argparse
+import os
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pymongo
+
+import bulk_writer
+import price_matrix
+
+# Rolling window (in import days) for min/max and volatility
+STATS_WINDOW = 30
+
+# Spans of the exponentially weighted moving averages
+EWMA_SPANS = (7, 30)
+
+# Field the rolling statistics are computed on
+STATS_FIELD = "marketPrice"
+
+# Fields averaged into deltaPrice, as in price_values_sample.csv
+DELTA_FIELDS = ("lowPrice", "midPrice", "highPrice", "marketPrice")
+
+STATE_FILE = "stats_state.npz"
+
+# One document per stats run ({_id: "products", asOf, window, spans, updated_at}); the
+# date is kept here rather than on every product so unchanged stats are no-op updates
+STATS_META_COLLECTION = "price_stats_meta"
+
+
+class RollingStats:
+    """
+    Per-product rolling statistics kept as NumPy arrays (one slot per matrix column).
+
+    Every statistic is maintained incrementally: consuming one new day of the price
+    matrix touches each product a constant number of times, so a daily update is
+    O(products) no matter how long the window is. A full rebuild is the same step
+    folded over every day, which keeps the two paths from drifting apart.
+
+    Rolling min/max only rescan the window for the few products whose current
+    extreme just fell out of it.
+
+    The state from before the last consumed row is kept as well, because a rerun of
+    the import on the same day replaces that row of the matrix; the row is then
+    consumed again on top of the prior day's state.
+    """
+
+    ARRAYS = ("roll_min", "roll_max", "ret_sum", "ret_sq_sum", "ret_count")
+
+    def __init__(self, window=STATS_WINDOW, spans=EWMA_SPANS):
+        self.window = window
+        self.spans = tuple(spans)
+        self.rows = 0  # number of matrix rows consumed
+        self.size = 0
+        self.ewma = {span: np.empty(0) for span in self.spans}
+        self.roll_min = np.empty(0)
+        self.roll_max = np.empty(0)
+        self.ret_sum = np.empty(0)
+        self.ret_sq_sum = np.empty(0)
+        self.ret_count = np.empty(0, dtype=np.int64)
+        self.prior = None  # state before the last consumed row
+
+    def _snapshot(self):
+        return {
+            "rows": self.rows,
+            "size": self.size,
+            "ewma": {span: values.copy() for span, values in self.ewma.items()},
+            **{name: getattr(self, name).copy() for name in self.ARRAYS}
+        }
+
+    def _restore(self, state):
+        self.rows = state["rows"]
+        self.size = state["size"]
+        self.ewma = {span: values.copy() for span, values in state["ewma"].items()}
+        for name in self.ARRAYS:
+            setattr(self, name, state[name].copy())
+
+    # ------------------------------------------------------------ persistence
+
+    @classmethod
+    def load(cls, path, window=STATS_WINDOW, spans=EWMA_SPANS):
+        """Load saved state, or return an empty state if there is none (or it is stale)"""
+        stats = cls(window, spans)
+        state_path = os.path.join(path, STATE_FILE)
+        if not os.path.exists(state_path):
+            return stats
+
+        saved = np.load(state_path)
+        if int(saved["window"]) != window or tuple(saved["spans"]) != tuple(spans):
+            return stats
+
+        stats.rows = int(saved["rows"])
+        stats.size = len(saved["roll_min"])
+        stats.ewma = {span: saved[f"ewma_{span}"] for span in spans}
+        stats.roll_min = saved["roll_min"]
+        stats.roll_max = saved["roll_max"]
+        stats.ret_sum = saved["ret_sum"]
+        stats.ret_sq_sum = saved["ret_sq_sum"]
+        stats.ret_count = saved["ret_count"]
+        if "prior_rows" in saved:
+            stats.prior = {
+                "rows": int(saved["prior_rows"]),
+                "size": len(saved["prior_roll_min"]),
+                "ewma": {span: saved[f"prior_ewma_{span}"] for span in spans},
+                **{name: saved[f"prior_{name}"] for name in cls.ARRAYS}
+            }
+        return stats
+
+    def save(self, path):
+        arrays = {f"ewma_{span}": values for span, values in self.ewma.items()}
+        if self.prior is not None:
+            arrays["prior_rows"] = self.prior["rows"]
+            arrays.update({f"prior_ewma_{span}": values for span, values in self.prior["ewma"].items()})
+            arrays.update({f"prior_{name}": self.prior[name] for name in self.ARRAYS})
+        tmp_path = os.path.join(path, STATE_FILE + ".tmp.npz")
+        np.savez(
+            tmp_path,
+            rows=self.rows,
+            window=self.window,
+            spans=np.array(self.spans),
+            roll_min=self.roll_min,
+            roll_max=self.roll_max,
+            ret_sum=self.ret_sum,
+            ret_sq_sum=self.ret_sq_sum,
+            ret_count=self.ret_count,
+            **arrays
+        )
+        os.replace(tmp_path, os.path.join(path, STATE_FILE))
+
+    # ---------------------------------------------------------------- update
+
+    def _resize(self, size):
+        """Extend state arrays for products that appeared since the last update"""
+        extra = size - self.size
+        if extra <= 0:
+            return
+
+        nans = np.full(extra, np.nan)
+        self.ewma = {span: np.concatenate([values, nans]) for span, values in self.ewma.items()}
+        self.roll_min = np.concatenate([self.roll_min, nans])
+        self.roll_max = np.concatenate([self.roll_max, nans])
+        self.ret_sum = np.concatenate([self.ret_sum, np.zeros(extra)])
+        self.ret_sq_sum = np.concatenate([self.ret_sq_sum, np.zeros(extra)])
+        self.ret_count = np.concatenate([self.ret_count, np.zeros(extra, dtype=np.int64)])
+        self.size = size
+
+    @staticmethod
+    def _returns(current, previous):
+        """Daily log returns; NaN where either price is missing or not positive"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = np.log(current / previous)
+        returns[~((current > 0) & (previous > 0))] = np.nan
+        return returns
+
+    def _step(self, prices, t):
+        """Consume row `t` of the (days, products) price matrix"""
+        n = self.size
+        current = np.asarray(prices[t, :n], dtype=np.float64)
+        has_price = ~np.isnan(current)
+
+        for span, ewma in self.ewma.items():
+            alpha = 2.0 / (span + 1)
+            blended = alpha * current + (1 - alpha) * ewma
+            self.ewma[span] = np.where(np.isnan(ewma), current, np.where(has_price, blended, ewma))
+
+        # Rolling sums of log returns over the last `window` returns
+        if t >= 1:
+            returns = self._returns(current, np.asarray(prices[t - 1, :n], dtype=np.float64))
+            added = ~np.isnan(returns)
+            self.ret_sum[added] += returns[added]
+            self.ret_sq_sum[added] += returns[added] ** 2
+            self.ret_count[added] += 1
+
+        if t - self.window >= 1:
+            expired = self._returns(
+                np.asarray(prices[t - self.window, :n], dtype=np.float64),
+                np.asarray(prices[t - self.window - 1, :n], dtype=np.float64)
+            )
+            removed = ~np.isnan(expired)
+            self.ret_sum[removed] -= expired[removed]
+            self.ret_sq_sum[removed] -= expired[removed] ** 2
+            self.ret_count[removed] -= 1
+
+        # Rolling min/max over the last `window` prices
+        self.roll_min = np.fmin(self.roll_min, current)
+        self.roll_max = np.fmax(self.roll_max, current)
+
+        if t - self.window >= 0:
+            leaving = np.asarray(prices[t - self.window, :n], dtype=np.float64)
+            stale = np.flatnonzero((leaving == self.roll_min) | (leaving == self.roll_max))
+            if len(stale):
+                block = np.asarray(prices[t - self.window + 1:t + 1, :n], dtype=np.float64)[:, stale]
+                # All-NaN windows are expected for products that stopped being listed
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", category=RuntimeWarning)
+                    self.roll_min[stale] = np.nanmin(block, axis=0)
+                    self.roll_max[stale] = np.nanmax(block, axis=0)
+
+        self.rows = t + 1
+
+    def update(self, matrix, field=STATS_FIELD):
+        """
+        Consume every matrix row not seen yet (one row on a normal daily run). When the
+        last row was already consumed it may have been replaced by a same-day rerun,
+        so it is consumed again from the prior day's state.
+
+        Returns:
+            Number of rows consumed
+        """
+        prices = matrix.matrix(field)
+        total_rows = len(matrix.days)
+        if total_rows < self.rows:
+            # The matrix was rebuilt underneath us; start over
+            self.__init__(self.window, self.spans)
+        elif total_rows == self.rows and self.prior is not None and self.prior["rows"] == total_rows - 1:
+            self._restore(self.prior)
+
+        self._resize(len(matrix.columns))
+
+        consumed = 0
+        for t in range(self.rows, total_rows):
+            if t == total_rows - 1:
+                self.prior = self._snapshot()
+            self._step(prices, t)
+            consumed += 1
+        return consumed
+
+    def volatility(self):
+        """Standard deviation of daily log returns over the window (NaN below 2 returns)"""
+        count = self.ret_count.astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = (self.ret_sq_sum - self.ret_sum ** 2 / count) / (count - 1)
+        variance = np.where(count >= 2, np.maximum(variance, 0.0), np.nan)
+        return np.sqrt(variance)
+
+
+def delta_prices(matrix):
+    """
+    deltaPrice, deltaRatio and delta_values_used for every column of the latest day.
+
+    deltaPrice is the mean of the available low/mid/high/market prices and deltaRatio
+    is lowPrice / deltaPrice, matching price_values_sample.csv.
+    """
+    latest = np.vstack([matrix.latest(field).astype(np.float64) for field in DELTA_FIELDS])
+    used = np.count_nonzero(~np.isnan(latest), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta_price = np.nansum(latest, axis=0) / used
+        delta_ratio = latest[0] / delta_price
+    delta_price[used == 0] = np.nan
+    delta_ratio[~np.isfinite(delta_ratio)] = np.nan
+    return delta_price, delta_ratio, used
+
+
+def _clean(value):
+    """NumPy scalar -> rounded float, or None for NaN"""
+    value = float(value)
+    return None if np.isnan(value) else round(value, 4)
+
+
+def write_product_stats(products_collection, matrix, stats, throttle=None):
+    """
+    Bulk-write the latest statistics onto the products collection.
+
+    Only products with a price on the latest day are written. globalPrice blends
+    deltaPrice with the Scryfall usdPrice already on the product inside the update
+    pipeline, so no product needs to be read first. The day the stats are as of is
+    stored once in STATS_META_COLLECTION, so products whose values did not change are
+    no-op updates that the server does not rewrite. Writes go through an adaptive
+    bulk writer (a shared bulk_writer.WriteThrottle can be passed in).
+
+    Returns:
+        Number of products modified
+    """
+    if not matrix.days:
+        return 0
+
+    delta_price, delta_ratio, delta_used = delta_prices(matrix)
+    volatility = stats.volatility()
+    as_of = matrix.days[-1]
+
+    # One document per productId: prefer the Normal column, else whichever sub type exists
+    chosen = {}
+    for key, col in matrix.columns.items():
+        product_id, sub_type = key.rsplit(":", 1)
+        if product_id not in chosen or sub_type == "Normal":
+            chosen[product_id] = col
+
+    writer = bulk_writer.AdaptiveBulkWriter(products_collection, throttle, name="product stats")
+    for product_id, col in chosen.items():
+        if delta_used[col] == 0:
+            continue
+
+        delta = _clean(delta_price[col])
+        fields = {
+            "deltaPrice": delta,
+            "deltaRatio": _clean(delta_ratio[col]),
+            "delta_values_used": int(delta_used[col]),
+            "globalPrice": {"$avg": [delta, "$usdPrice"]},
+            "global_values_used": {"$add": [1, {"$cond": [{"$isNumber": "$usdPrice"}, 1, 0]}]},
+            "priceStats": {
+                "window": stats.window,
+                "min": _clean(stats.roll_min[col]),
+                "max": _clean(stats.roll_max[col]),
+                "volatility": _clean(volatility[col]),
+                **{f"ewma{span}": _clean(values[col]) for span, values in stats.ewma.items()}
+            }
+        }
+
+        try:
+            product_id = int(product_id)
+        except ValueError:
+            pass
+
+        # $literal keeps plain values from being read as expressions inside the pipeline
+        stage = {
+            name: value if name in ("globalPrice", "global_values_used") else {"$literal": value}
+            for name, value in fields.items()
+        }
+        writer.add(pymongo.UpdateOne({"productId": product_id}, [{"$set": stage}]))
+
+    modified = writer.close()["nModified"]
+    writer.report()
+
+    products_collection.database[STATS_META_COLLECTION].update_one(
+        {"_id": products_collection.name},
+        {"$set": {"asOf": as_of, "window": stats.window, "spans": list(stats.spans), "updated_at": datetime.now()}},
+        upsert=True
+    )
+    return modified
+
+
+def update_products(db, matrix=None, rebuild=False):
+    """
+    Bring rolling statistics up to date with the price matrix and write them to products.
+
+    Args:
+        db: The pymongo database
+        matrix: An open PriceMatrix (opened from PRICE_MATRIX_DIR if omitted)
+        rebuild: Ignore saved state and recompute from the first day
+
+    Returns:
+        Number of products modified
+    """
+    matrix = matrix or price_matrix.PriceMatrix()
+    stats = RollingStats() if rebuild else RollingStats.load(matrix.path)
+
+    start = time.time()
+    consumed = stats.update(matrix)
+    stats.save(matrix.path)
+    print(f"Rolling stats: consumed {consumed} day(s) for {stats.size} products in {time.time() - start:.2f} seconds")
+
+    start = time.time()
+    modified = write_product_stats(db["products"], matrix, stats)
+    print(f"Rolling stats: updated {modified} products in {time.time() - start:.2f} seconds")
+    return modified
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Update rolling price statistics on products")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute from the first day of the matrix")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        print(f"Updating price statistics at {datetime.now().strftime('%H:%M:%S')}")
+        update_products(client["mtgdbmongo"], rebuild=args.rebuild)
+    finally:
+        client.close()
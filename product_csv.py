@@ -0,0 +1,184 @@
+import hashlib
+import os
+import re
+import time
+
+import pandas as pd
+
+# Declared column types of the TCGplayer ProductsAndPrices CSVs. Columns not listed
+# here (game-specific ext* fields) are read as strings.
+PRODUCT_SCHEMA = {
+    "productId": "Int64",
+    "categoryId": "Int64",
+    "groupId": "Int64",
+    "imageCount": "Int64",
+    "lowPrice": "float64",
+    "midPrice": "float64",
+    "highPrice": "float64",
+    "marketPrice": "float64",
+    "directLowPrice": "float64",
+}
+
+FILENAME_PATTERN = re.compile(r"ProductsAndPrices_game_(\d+)_group_(\d+)")
+
+CHUNK_SIZE = 20000
+
+# Field holding the content hash of the CSV rows a product was last written from
+ROW_HASH_FIELD = "rowHash"
+
+# tcgcsv lists a product once per sub type (Normal, Foil, ...); every row's prices are
+# kept on the product under subTypes.<subTypeName>
+SUBTYPES_FIELD = "subTypes"
+SUBTYPE_PRICE_FIELDS = ("lowPrice", "midPrice", "highPrice", "marketPrice", "directLowPrice")
+
+
+def parse_filename(csv_file):
+    """(game_id, group_id) from a ProductsAndPrices_game_X_group_Y file name, or None"""
+    match = FILENAME_PATTERN.search(csv_file)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def read_chunks(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Stream a products CSV as typed DataFrames using pandas' C reader.
+
+    Every column outside PRODUCT_SCHEMA is typed as a string, and empty cells
+    come back as missing values.
+    """
+    header = pd.read_csv(file_path, nrows=0, encoding="utf-8").columns
+    dtypes = {column: PRODUCT_SCHEMA.get(column, "string") for column in header}
+    yield from pd.read_csv(
+        file_path,
+        dtype=dtypes,
+        chunksize=chunk_size,
+        encoding="utf-8",
+        engine="c",
+        keep_default_na=False,
+        na_values=[""]
+    )
+
+
+def frame_records(frame):
+    """DataFrame -> list of dicts of plain Python values, dropping empty cells"""
+    columns = list(frame.columns)
+    values = [frame[column].to_numpy(dtype=object, na_value=None).tolist() for column in columns]
+    return [
+        {key: value for key, value in zip(columns, row) if value is not None}
+        for row in zip(*values)
+    ]
+
+
+_CONVERTERS = {"Int64": int, "float64": float}
+
+
+def type_row(header, values):
+    """
+    Type one raw CSV row with PRODUCT_SCHEMA (the row-at-a-time counterpart of
+    read_chunks, for rows parsed off a network stream). Empty cells are dropped.
+    """
+    record = {}
+    for column, value in zip(header, values):
+        if value == "":
+            continue
+        convert = _CONVERTERS.get(PRODUCT_SCHEMA.get(column))
+        if convert is None:
+            record[column] = value
+        else:
+            try:
+                record[column] = convert(value)
+            except ValueError:
+                continue
+    return record
+
+
+def row_hash(record):
+    """Short content hash of one parsed CSV row or product document (independent of column order)"""
+    return hashlib.blake2b(repr(sorted(record.items())).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def fold_rows(records):
+    """
+    One product document per productId from its sub type rows.
+
+    The Normal row (else the first row) supplies the top-level fields, so the product
+    no longer flips between its Normal and Foil prices from one import to the next.
+    Each document carries the hash of its folded content in ROW_HASH_FIELD.
+
+    Returns:
+        List of product documents, in the order their productIds first appear
+    """
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record["productId"], []).append(record)
+
+    products = []
+    for rows in grouped.values():
+        base = next((row for row in rows if (row.get("subTypeName") or "Normal") == "Normal"), rows[0])
+        document = {key: value for key, value in base.items() if key != ROW_HASH_FIELD}
+        document[SUBTYPES_FIELD] = {
+            row.get("subTypeName") or "Normal": {field: row[field] for field in SUBTYPE_PRICE_FIELDS if field in row}
+            for row in sorted(rows, key=lambda row: row.get("subTypeName") or "Normal")
+        }
+        document[ROW_HASH_FIELD] = row_hash(document)
+        products.append(document)
+    return products
+
+
+def load_row_hashes(collection, game_ids):
+    """(gameId, productId) -> stored row hash, from one projected streaming read of products"""
+    hashes = {}
+    cursor = collection.find(
+        {"gameId": {"$in": list(game_ids)}, ROW_HASH_FIELD: {"$exists": True}},
+        {"_id": 0, "gameId": 1, "productId": 1, ROW_HASH_FIELD: 1},
+        batch_size=50000
+    )
+    for doc in cursor:
+        hashes[(doc["gameId"], doc["productId"])] = doc[ROW_HASH_FIELD]
+    return hashes
+
+
+def file_checksum(file_path, block_size=1 << 20):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_file(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Parse one products CSV into records (runs in a worker process).
+
+    Rows without a productId are dropped. `records` has one entry per CSV row (price
+    history and the matrix are kept per sub type); `products` has one folded, hashed
+    document per productId (see fold_rows).
+
+    Returns:
+        Dictionary with csv_file, game_id, group_id, size, checksum, records,
+        products, skipped and seconds
+    """
+    start = time.time()
+    csv_file = os.path.basename(file_path)
+    game_id, group_id = parse_filename(csv_file)
+
+    records = []
+    skipped = 0
+    for chunk in read_chunks(file_path, chunk_size):
+        has_id = chunk["productId"].notna() if "productId" in chunk else pd.Series(False, index=chunk.index)
+        skipped += int((~has_id).sum())
+        records.extend(frame_records(chunk[has_id]))
+
+    return {
+        "csv_file": csv_file,
+        "game_id": game_id,
+        "group_id": group_id,
+        "size": os.path.getsize(file_path),
+        "checksum": file_checksum(file_path),
+        "records": records,
+        "products": fold_rows(records),
+        "skipped": skipped,
+        "seconds": time.time() - start,
+    }
@@ -0,0 +1,414 @@
+import asyncio
+import codecs
+import csv
+import json
+import os
+import time
+from datetime import datetime
+
+import aiohttp
+import pymongo
+import requests
+
+import bulk_writer
+import import_steps
+import price_history
+import product_csv
+
+# tcgcsv.com serves one ProductsAndPrices CSV per game/group
+TCGCSV_BASE_URL = os.getenv("TCGCSV_BASE_URL", "https://tcgcsv.com")
+
+# ETag / Last-Modified of every group file the streaming import has written to Mongo,
+# for conditional GETs (the CSV downloader keeps its own store next to its files)
+VALIDATORS_PATH = os.getenv(
+    "TCGCSV_VALIDATORS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tcgcsv_validators.json")
+)
+
+# Discovered groups per game, refreshed after GROUPS_CACHE_TTL seconds
+GROUPS_CACHE_PATH = os.getenv(
+    "TCGCSV_GROUPS_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tcgcsv_groups.json")
+)
+GROUPS_CACHE_TTL = int(os.getenv("TCGCSV_GROUPS_CACHE_TTL", 12 * 60 * 60))
+
+MAX_CONNECTIONS = 8
+READ_CHUNK_SIZE = 1 << 16
+BATCH_SIZE = 5000
+
+# Batches waiting for a writer; a full queue pauses the downloads
+QUEUE_BATCHES = 16
+WRITERS = 4
+
+REQUEST_TIMEOUT = 60
+
+# Group files can take minutes to stream, so downloads are bounded per connect and
+# per socket read instead of by a total time
+CONNECT_TIMEOUT = 15
+READ_TIMEOUT = 60
+
+
+def group_csv_url(game_id, group_id, base_url=None):
+    return f"{(base_url or TCGCSV_BASE_URL).rstrip('/')}/tcgplayer/{game_id}/{group_id}/ProductsAndPrices.csv"
+
+
+def _fetch_results(session, url):
+    response = session.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get("results") or []
+
+
+def discover_groups(game_ids, base_url=None, cache_path=GROUPS_CACHE_PATH, ttl=GROUPS_CACHE_TTL):
+    """
+    List the (game_id, group_id) pairs with product files, from tcgcsv's JSON listings.
+
+    Only the group listings of the requested games (TCGplayer categories) are fetched,
+    and each game's listing is cached locally for `ttl` seconds.
+
+    Returns:
+        Sorted list of (game_id, group_id)
+    """
+    base_url = (base_url or TCGCSV_BASE_URL).rstrip("/")
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as file:
+            cache = json.load(file)
+
+    now = time.time()
+    fetched = False
+    groups = []
+    with requests.Session() as session:
+        for game_id in sorted(game_ids):
+            key = f"{base_url}|{game_id}"
+            entry = cache.get(key)
+            if not entry or now - entry["fetched_at"] > ttl:
+                results = _fetch_results(session, f"{base_url}/tcgplayer/{game_id}/groups")
+                entry = {
+                    "fetched_at": now,
+                    "groups": sorted(int(group["groupId"]) for group in results if group.get("groupId") is not None)
+                }
+                cache[key] = entry
+                fetched = True
+            groups.extend((game_id, group_id) for group_id in entry["groups"])
+
+    if fetched and cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(cache, file)
+        os.replace(tmp_path, cache_path)
+
+    return groups
+
+
+def load_validators(path=VALIDATORS_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_validators(validators, path=VALIDATORS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(validators, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def conditional_headers(validator):
+    headers = {}
+    if validator.get("etag"):
+        headers["If-None-Match"] = validator["etag"]
+    if validator.get("last_modified"):
+        headers["If-Modified-Since"] = validator["last_modified"]
+    return headers
+
+
+def _record_boundary(buffer):
+    """Index just past the last newline that ends a complete CSV record, or 0"""
+    end = buffer.rfind("\n")
+    # A newline inside a quoted field has an odd number of quotes before it
+    while end >= 0 and buffer.count('"', 0, end) % 2:
+        end = buffer.rfind("\n", 0, end)
+    return end + 1
+
+
+async def stream_rows(response, chunk_size=READ_CHUNK_SIZE):
+    """Yield raw CSV rows (lists of strings) as response bytes arrive"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in response.content.iter_chunked(chunk_size):
+        buffer += decoder.decode(chunk)
+        boundary = _record_boundary(buffer)
+        if boundary:
+            for row in csv.reader(buffer[:boundary].splitlines(keepends=True)):
+                yield row
+            buffer = buffer[boundary:]
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        for row in csv.reader(buffer.splitlines(keepends=True)):
+            yield row
+
+
+def product_write_batch(collection, history_collection, throttle, stored_hashes=None):
+    """
+    Default sink: upsert products and their price history, as the CSV importer does.
+    The sub type rows of a product are folded into one document (product_csv.fold_rows);
+    products whose hash matches `stored_hashes` ((gameId, productId) -> row hash, see
+    product_csv.load_row_hashes) are not written. Every row gets its history entry.
+    Writes go through
+    `throttle` (a bulk_writer.WriteThrottle), which retries transient errors and
+    records the write latency.
+
+    Returns a function (game_id, group_id, records) -> (upserted, modified) run on a
+    writer thread.
+    """
+    stored_hashes = stored_hashes if stored_hashes is not None else {}
+
+    def write(game_id, group_id, records):
+        now = datetime.now()
+        source_file = f"ProductsAndPrices_game_{game_id}_group_{group_id}.csv"
+        operations = []
+        history_ops = []
+        for product in product_csv.fold_rows(records):
+            if stored_hashes.get((game_id, product["productId"])) == product[product_csv.ROW_HASH_FIELD]:
+                continue
+            operations.append(pymongo.UpdateOne(
+                {"productId": product["productId"], "gameId": game_id},
+                {"$set": {**product, "gameId": game_id, "changed_at": now, "source_file": source_file}},
+                upsert=True
+            ))
+        for record in records:
+            record["gameId"] = game_id
+            history_op = price_history.history_operation(record, now)
+            if history_op:
+                history_ops.append(history_op)
+
+        throttle.acquire()
+        try:
+            counts = throttle.execute(collection, operations)
+            throttle.execute(history_collection, history_ops)
+        finally:
+            throttle.release()
+        return counts["nUpserted"], counts["nModified"]
+
+    return write
+
+
+class StreamingImport:
+    """
+    Download group CSVs and write their rows to Mongo while the bytes are arriving.
+
+    Downloads share one pooled aiohttp session. Each response is parsed row by row,
+    typed with the product_csv schema and cut into batches. The batches go through
+    a bounded queue to writer tasks, which run the blocking bulk writes on threads.
+    Groups whose ETag/Last-Modified still match get a 304 and are not downloaded.
+    Every row read is also kept for today's price matrix row.
+    """
+
+    def __init__(self, write_batch, validators=None, max_connections=MAX_CONNECTIONS,
+                 batch_size=BATCH_SIZE, queue_batches=QUEUE_BATCHES, writers=WRITERS):
+        self.write_batch = write_batch
+        self.validators = validators if validators is not None else {}
+        self.max_connections = max_connections
+        self.batch_size = batch_size
+        self.queue_batches = queue_batches
+        self.writers = writers
+        self.stats = {
+            "downloaded": 0, "not_modified": 0, "failed": 0,
+            "rows": 0, "inserted": 0, "updated": 0, "bytes": 0,
+            "read_seconds": 0.0, "write_seconds": 0.0,
+        }
+        self.groups = {}
+        self.write_failures = set()
+        self.new_product_groups = set()
+        self.matrix_prices = {}
+        self.matrix_metadata = {}
+
+    async def _download(self, session, queue, game_id, group_id, url):
+        validator = self.validators.get(url, {})
+        try:
+            async with session.get(url, headers=conditional_headers(validator)) as response:
+                if response.status == 304:
+                    self.stats["not_modified"] += 1
+                    self.groups[(game_id, group_id)] = "not_modified"
+                    return
+                if response.status != 200:
+                    print(f"Failed to download {url} (HTTP {response.status})")
+                    self.stats["failed"] += 1
+                    self.groups[(game_id, group_id)] = "failed"
+                    return
+
+                header = None
+                batch = []
+                rows = 0
+                read_start = time.time()
+                async for values in stream_rows(response):
+                    if header is None:
+                        header = values
+                        continue
+                    record = product_csv.type_row(header, values)
+                    if "productId" not in record:
+                        continue
+                    # Never split the sub type rows of one product across batches, so each
+                    # batch folds them into a complete product document
+                    if len(batch) >= self.batch_size and record["productId"] != batch[-1]["productId"]:
+                        self.stats["read_seconds"] += time.time() - read_start
+                        await queue.put((game_id, group_id, batch))
+                        read_start = time.time()
+                        batch = []
+                    import_steps.add_matrix_row(self.matrix_prices, self.matrix_metadata, record, group_id)
+                    batch.append(record)
+                    rows += 1
+                if batch:
+                    await queue.put((game_id, group_id, batch))
+                self.stats["read_seconds"] += time.time() - read_start
+
+                self.stats["downloaded"] += 1
+                self.stats["rows"] += rows
+                self.stats["bytes"] += response.content.total_bytes
+                self.groups[(game_id, group_id)] = "downloaded"
+
+                # Only remember validators once the whole body was read and queued
+                self.validators[url] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "rows": rows,
+                    "fetched_at": datetime.now().isoformat(),
+                }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error downloading {url}: {e}")
+            self.stats["failed"] += 1
+            self.groups[(game_id, group_id)] = "failed"
+
+    async def _writer(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                game_id, group_id, records = item
+                write_start = time.time()
+                inserted, updated = await asyncio.to_thread(self.write_batch, game_id, group_id, records)
+                self.stats["inserted"] += inserted
+                self.stats["updated"] += updated
+                if inserted:
+                    self.new_product_groups.add((game_id, group_id))
+                self.stats["write_seconds"] += time.time() - write_start
+            except Exception as e:
+                # Keep draining the queue; the group is re-downloaded next run
+                print(f"Error writing batch for group {item[1]}: {e}")
+                self.write_failures.add((item[0], item[1]))
+            finally:
+                queue.task_done()
+
+    async def run(self, groups, base_url=None):
+        """
+        Stream every (game_id, group_id) in `groups`.
+
+        Returns:
+            The stats dictionary (groups downloaded / not modified / failed, rows, timings)
+        """
+        queue = asyncio.Queue(maxsize=self.queue_batches)
+        writer_tasks = [asyncio.create_task(self._writer(queue)) for _ in range(self.writers)]
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                await asyncio.gather(*[
+                    self._download(session, queue, game_id, group_id, group_csv_url(game_id, group_id, base_url))
+                    for game_id, group_id in groups
+                ])
+        finally:
+            for _ in writer_tasks:
+                await queue.put(None)
+            await asyncio.gather(*writer_tasks)
+
+        for game_id, group_id in self.write_failures:
+            self.validators.pop(group_csv_url(game_id, group_id, base_url), None)
+            self.groups[(game_id, group_id)] = "failed"
+            self.stats["failed"] += 1
+            self.stats["downloaded"] -= 1
+
+        return self.stats
+
+
+def fill_not_modified(db, history_collection, importer, day):
+    """
+    Give groups whose file did not change (HTTP 304) today's history slot and matrix
+    row, from their stored products.
+
+    Returns:
+        Number of products read
+    """
+    read = 0
+    with bulk_writer.AdaptiveBulkWriter(history_collection, name="not modified price history") as writer:
+        for (game_id, group_id), status in importer.groups.items():
+            if status != "not_modified":
+                continue
+            for product in import_steps.stored_group_rows(db["products"], game_id, group_id):
+                read += 1
+                import_steps.add_matrix_row(importer.matrix_prices, importer.matrix_metadata, product, group_id)
+                history_op = price_history.history_operation(product, day)
+                if history_op:
+                    writer.add(history_op)
+    return read
+
+
+def stream_groups_to_mongo(db, groups, base_url=None, validators_path=VALIDATORS_PATH):
+    """
+    Download and import the given groups straight into the products collection, then
+    run the same post-import steps as the CSV importer.
+
+    Returns:
+        The StreamingImport stats
+    """
+    start = time.time()
+    import_day = datetime.now()
+    validators = load_validators(validators_path)
+    throttle = bulk_writer.WriteThrottle()
+    history_collection = price_history.ensure_price_history_collection(db)
+
+    hash_start = time.time()
+    stored_hashes = product_csv.load_row_hashes(db["products"], {game_id for game_id, _ in groups})
+    print(f"Loaded {len(stored_hashes)} stored row hashes in {time.time() - hash_start:.2f} seconds")
+
+    importer = StreamingImport(
+        product_write_batch(db["products"], history_collection, throttle, stored_hashes),
+        validators,
+        writers=throttle.max_concurrency
+    )
+    stats = asyncio.run(importer.run(groups, base_url))
+    save_validators(validators, validators_path)
+
+    stats["not_modified_rows"] = fill_not_modified(db, history_collection, importer, import_day)
+
+    now = datetime.now()
+    markers = [
+        pymongo.UpdateOne(
+            {"_id": f"{game_id}:{group_id}"},
+            {"$set": {"gameId": game_id, "groupId": group_id, "import_date": now, "source": "stream"}},
+            upsert=True
+        )
+        for (game_id, group_id), status in importer.groups.items() if status == "downloaded"
+    ]
+    if markers:
+        db["import_groups"].bulk_write(markers, ordered=False)
+
+    elapsed = time.time() - start
+    print(f"Streamed {stats['downloaded']} groups ({stats['not_modified']} not modified, {stats['failed']} failed), "
+          f"{stats['rows']} rows, {stats['bytes'] / 1e6:.1f} MB in {elapsed:.2f} seconds "
+          f"({stats['rows'] / elapsed if elapsed else 0:.0f} rows/second)")
+    print(f"  - read {stats['read_seconds']:.2f} s, write {stats['write_seconds']:.2f} s "
+          f"({stats['inserted']} inserted, {stats['updated']} updated)")
+    stats["writes"] = throttle.report("Streamed product writes")
+
+    # Matrix row, price stats, movers, set stats, crosswalk links and deals
+    import_steps.run_post_import(
+        db, import_day, importer.matrix_prices, importer.matrix_metadata,
+        {group_id for _, group_id in importer.new_product_groups}
+    )
+    return stats
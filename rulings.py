@@ -0,0 +1,175 @@
+import argparse
+import os
+import time
+from datetime import datetime
+
+import pymongo
+
+import bulk_writer
+import scryfall_bulk
+
+# One document per oracle card: {_id: oracle_id, rulings: [...], count, contentHash, updated_at}
+RULINGS_COLLECTION = "rulings"
+
+# Fields earlier per-printing fetches left on card documents
+LEGACY_CARD_FIELDS = ("rulings", "rulingsData", "rulingsDetails", "rulings_data", "rulings_count",
+                      "rulings_last_updated")
+
+# The oracle id of a card; reversible cards only carry it on their faces
+CARD_ORACLE_ID = {"$ifNull": ["$oracle_id", {"$arrayElemAt": ["$card_faces.oracle_id", 0]}]}
+
+
+def group_rulings(path):
+    """
+    Stream a rulings bulk file and group it by oracle_id, in file order.
+
+    Returns:
+        Tuple of (dictionary of oracle_id -> list of rulings, rulings read)
+    """
+    grouped = {}
+    read = 0
+    for ruling in scryfall_bulk.iter_bulk_objects(path):
+        read += 1
+        oracle_id = ruling.get("oracle_id")
+        if not oracle_id:
+            continue
+        grouped.setdefault(oracle_id, []).append({
+            "source": ruling.get("source"),
+            "published_at": ruling.get("published_at"),
+            "comment": ruling.get("comment"),
+        })
+    return grouped, read
+
+
+def ingest_rulings(db, path):
+    """
+    Load a rulings bulk file into the rulings collection.
+
+    Only oracles whose rulings changed are rewritten; oracles that are no longer in the
+    file are removed.
+
+    Returns:
+        Dictionary of rulings read, oracles, new, changed, unchanged, removed and seconds
+    """
+    start = time.time()
+    collection = db[RULINGS_COLLECTION]
+    grouped, read = group_rulings(path)
+    if not grouped:
+        raise ValueError(f"{path} holds no rulings, refusing to empty {RULINGS_COLLECTION}")
+
+    stored = {
+        document["_id"]: document.get(scryfall_bulk.CONTENT_HASH_FIELD)
+        for document in collection.find({}, {scryfall_bulk.CONTENT_HASH_FIELD: 1}, batch_size=50000)
+    }
+
+    stats = {"rulings": read, "oracles": len(grouped), "new": 0, "changed": 0, "unchanged": 0, "removed": 0}
+    now = datetime.now()
+    with bulk_writer.AdaptiveBulkWriter(collection, name=RULINGS_COLLECTION) as writer:
+        for oracle_id, oracle_rulings in grouped.items():
+            content_hash = scryfall_bulk.content_hash(oracle_rulings)
+            if oracle_id not in stored:
+                stats["new"] += 1
+            elif stored[oracle_id] != content_hash:
+                stats["changed"] += 1
+            else:
+                stats["unchanged"] += 1
+                continue
+            writer.add(pymongo.ReplaceOne({"_id": oracle_id}, {
+                "rulings": oracle_rulings,
+                "count": len(oracle_rulings),
+                scryfall_bulk.CONTENT_HASH_FIELD: content_hash,
+                "updated_at": now
+            }, upsert=True))
+
+        for oracle_id in stored.keys() - grouped.keys():
+            stats["removed"] += 1
+            writer.add(pymongo.DeleteOne({"_id": oracle_id}))
+    writer.report()
+
+    stats["seconds"] = round(time.time() - start, 2)
+    print(f"Rulings import complete: {stats['rulings']} rulings for {stats['oracles']} oracles, "
+          f"{stats['new']} new, {stats['changed']} changed, {stats['removed']} removed "
+          f"in {stats['seconds']:.2f} seconds")
+    return stats
+
+
+def refresh_rulings(db, directory=scryfall_bulk.BULK_DIR, client=None):
+    """Download the current rulings bulk file (when it changed) and import it"""
+    return ingest_rulings(db, scryfall_bulk.download_bulk_file("rulings", directory, client))
+
+
+def card_rulings_stages(rulings_collection=RULINGS_COLLECTION):
+    """
+    Aggregation stages that attach each card's rulings (joined by oracle_id) as `rulings`.
+
+    Returns:
+        List of pipeline stages
+    """
+    return [
+        {"$lookup": {
+            "from": rulings_collection,
+            "let": {"oracle_id": CARD_ORACLE_ID},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$oracle_id"]}}},
+                {"$project": {"_id": 0, "rulings": 1}}
+            ],
+            "as": "oracle_rulings"
+        }},
+        {"$set": {"rulings": {"$ifNull": [{"$arrayElemAt": ["$oracle_rulings.rulings", 0]}, []]}}},
+        {"$unset": "oracle_rulings"}
+    ]
+
+
+def rulings_for(collection, card):
+    """
+    Rulings of one card document, by its oracle id.
+
+    Returns:
+        List of rulings (source, published_at, comment)
+    """
+    oracle_id = card.get("oracle_id") or next(
+        (face.get("oracle_id") for face in card.get("card_faces") or [] if face.get("oracle_id")), None
+    )
+    if not oracle_id:
+        return []
+    document = collection.find_one({"_id": oracle_id}, {"_id": 0, "rulings": 1})
+    return document["rulings"] if document else []
+
+
+def drop_card_copies(db):
+    """
+    Remove the rulings that per-printing fetches stored on card documents.
+
+    Returns:
+        Number of cards modified
+    """
+    result = db[scryfall_bulk.CARDS_COLLECTION].update_many(
+        {"$or": [{field: {"$exists": True}} for field in LEGACY_CARD_FIELDS]},
+        {"$unset": {field: "" for field in LEGACY_CARD_FIELDS}}
+    )
+    print(f"Removed per-printing rulings from {result.modified_count} cards")
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Import Scryfall rulings into the rulings collection")
+    parser.add_argument("--path", help="Rulings bulk file to import instead of downloading the current one")
+    parser.add_argument("--drop-card-copies", action="store_true",
+                        help="Also remove the rulings stored on card documents by per-printing fetches")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        db = client["mtgdbmongo"]
+        if args.path:
+            ingest_rulings(db, args.path)
+        else:
+            refresh_rulings(db)
+        if args.drop_card_copies:
+            drop_card_copies(db)
+    finally:
+        client.close()
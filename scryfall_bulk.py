@@ -0,0 +1,290 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import ijson
+import pymongo
+
+import bulk_writer
+import collection_swap
+import scryfall_client
+
+CARDS_COLLECTION = "cards"
+
+# Downloaded bulk files, one per type, next to a marker of the version they hold
+BULK_DIR = os.getenv(
+    "SCRYFALL_BULK_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "scryfall")
+)
+
+# Field holding the content hash of the Scryfall object a card was last written from
+CONTENT_HASH_FIELD = "contentHash"
+
+# When a card was last written with new content (the crosswalk re-joins changed cards)
+CHANGED_AT_FIELD = "changed_at"
+
+BATCH_SIZE = 5000
+
+# Incremental ingest: the file is cut into blocks of whole lines (Scryfall writes one
+# card object per line) and each block is parsed and hashed in a worker process
+PARSE_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+PARSE_CHUNK_BYTES = 4 << 20
+
+# Parsed blocks waiting to be diffed and written, per worker; bounds memory
+PENDING_CHUNKS_PER_WORKER = 2
+
+# A "line" longer than this means the file is not one object per line
+MAX_LINE_BYTES = 64 << 20
+
+
+class BulkLayoutError(Exception):
+    """The bulk file is not one card object per line, so it cannot be split for the workers"""
+
+
+def download_bulk_file(kind, directory=BULK_DIR, client=None):
+    """
+    Download the latest bulk file of one type (all_cards, default_cards, rulings, ...)
+    unless the local copy is already that version. The file is streamed to disk.
+
+    Returns:
+        Path of the local file
+    """
+    client = client or scryfall_client.get_client()
+    # Always revalidated: a conditional GET that is usually answered 304
+    info = client.get_json(f"/bulk-data/{kind}", ttl=0)
+    if info is None:
+        raise scryfall_client.ScryfallError(f"Unknown bulk data type {kind}")
+
+    path = os.path.join(directory, f"{kind}.json")
+    marker_path = path + ".updated_at"
+    if os.path.exists(path) and os.path.exists(marker_path):
+        with open(marker_path, "r", encoding="utf-8") as file:
+            if file.read().strip() == info["updated_at"]:
+                print(f"{kind} bulk file is current ({info['updated_at']})")
+                return path
+
+    start = time.time()
+    client.download(info["download_uri"], path)
+    with open(marker_path, "w", encoding="utf-8") as file:
+        file.write(info["updated_at"])
+
+    print(f"Downloaded {kind} bulk file ({os.path.getsize(path) / 1e6:.1f} MB) in {time.time() - start:.2f} seconds")
+    return path
+
+
+def iter_bulk_objects(path):
+    """Stream the objects of a Scryfall bulk-data JSON array without loading the file"""
+    with open(path, "rb") as file:
+        yield from ijson.items(file, "item", use_float=True)
+
+
+def content_hash(card):
+    """Short content hash of one Scryfall object (independent of key order)"""
+    payload = json.dumps(card, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def iter_line_chunks(path, chunk_bytes=PARSE_CHUNK_BYTES):
+    """Yield blocks of whole lines of a file, about `chunk_bytes` each"""
+    with open(path, "rb") as file:
+        remainder = b""
+        for block in iter(lambda: file.read(chunk_bytes), b""):
+            block = remainder + block
+            end = block.rfind(b"\n") + 1
+            if not end:
+                if len(block) > MAX_LINE_BYTES:
+                    raise BulkLayoutError(f"{path} has a line longer than {MAX_LINE_BYTES} bytes")
+                remainder = block
+                continue
+            yield block[:end]
+            remainder = block[end:]
+        if remainder:
+            yield remainder
+
+
+def parse_chunk(chunk):
+    """
+    Parse one block of lines into cards carrying their content hash (runs in a worker process).
+
+    Returns:
+        List of card dictionaries
+    """
+    body = chunk.strip().lstrip(b"[").rstrip(b"]").strip().rstrip(b",")
+    if not body:
+        return []
+    try:
+        cards = list(ijson.items(io.BytesIO(b"[" + body + b"]"), "item", use_float=True))
+    except ijson.JSONError as e:
+        raise BulkLayoutError(f"Block does not hold whole card objects: {e}") from e
+    for card in cards:
+        card[CONTENT_HASH_FIELD] = content_hash(card)
+    return cards
+
+
+def is_line_delimited(path, chunk_bytes=PARSE_CHUNK_BYTES):
+    """True when the first block of the file parses on its own (one object per line)"""
+    try:
+        parse_chunk(next(iter_line_chunks(path, chunk_bytes), b""))
+    except BulkLayoutError:
+        return False
+    return True
+
+
+def iter_parsed_chunks(path, workers=PARSE_WORKERS, chunk_bytes=PARSE_CHUNK_BYTES):
+    """Parsed, hashed cards of a line-delimited bulk file, one list per block, in file order"""
+    with ProcessPoolExecutor(max_workers=workers) as parsers:
+        pending = deque()
+        for chunk in iter_line_chunks(path, chunk_bytes):
+            if len(pending) >= workers * PENDING_CHUNKS_PER_WORKER:
+                yield pending.popleft().result()
+            pending.append(parsers.submit(parse_chunk, chunk))
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_hashed_batches(path, batch_size=BATCH_SIZE):
+    """Single-process counterpart of iter_parsed_chunks for files of any layout"""
+    batch = []
+    for card in iter_bulk_objects(path):
+        card[CONTENT_HASH_FIELD] = content_hash(card)
+        batch.append(card)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ensure_id_index(collection):
+    """Cards are diffed and upserted by Scryfall id"""
+    for spec in collection.list_indexes():
+        if list(spec["key"]) == ["id"]:
+            return
+    collection.create_index([("id", pymongo.ASCENDING)], name="id_idx")
+
+
+def _write_changed(collection, writer, cards, stats):
+    """Compare one batch against the stored hashes and queue upserts for new or changed cards"""
+    ids = [card["id"] for card in cards if card.get("id")]
+    now = datetime.now()
+    stored = {
+        document["id"]: document.get(CONTENT_HASH_FIELD)
+        for document in collection.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, CONTENT_HASH_FIELD: 1})
+    }
+    for card in cards:
+        stats["read"] += 1
+        card_id = card.get("id")
+        if not card_id:
+            stats["skipped"] += 1
+            continue
+        if card_id not in stored:
+            stats["new"] += 1
+        elif stored[card_id] != card[CONTENT_HASH_FIELD]:
+            stats["changed"] += 1
+        else:
+            stats["unchanged"] += 1
+            continue
+        # $set keeps fields other jobs maintain on cards (spot prices, lookup misses, ...)
+        writer.add(pymongo.UpdateOne({"id": card_id}, {"$set": {**card, CHANGED_AT_FIELD: now}}, upsert=True))
+
+
+def ingest_cards(db, path, workers=PARSE_WORKERS, chunk_bytes=PARSE_CHUNK_BYTES):
+    """
+    Incremental load of the cards collection from a bulk file.
+
+    The file is streamed, never loaded whole: a line-delimited file is parsed in blocks
+    across `workers` processes (with a bounded number of blocks in flight), any other
+    layout through one ijson stream. Each batch is diffed against the stored content
+    hashes with one indexed read, and only new or changed cards are upserted through
+    unordered bulk writes.
+
+    Returns:
+        Dictionary of cards read, new, changed, unchanged, skipped (no id) and seconds
+    """
+    start = time.time()
+    collection = db[CARDS_COLLECTION]
+    ensure_id_index(collection)
+
+    if workers and not is_line_delimited(path, chunk_bytes):
+        print(f"{path} is not one card per line, parsing it as a single stream")
+        workers = 0
+    batches = iter_parsed_chunks(path, workers, chunk_bytes) if workers else iter_hashed_batches(path)
+
+    stats = {"read": 0, "new": 0, "changed": 0, "unchanged": 0, "skipped": 0}
+    with bulk_writer.AdaptiveBulkWriter(collection, name="cards") as writer:
+        for cards in batches:
+            _write_changed(collection, writer, cards, stats)
+    writer.report()
+
+    stats["seconds"] = round(time.time() - start, 2)
+    print(f"Cards ingest complete: {stats['read']} read, {stats['new']} new, {stats['changed']} changed, "
+          f"{stats['unchanged']} unchanged in {stats['seconds']:.2f} seconds")
+    return stats
+
+
+def swap_load_cards(db, path, batch_size=BATCH_SIZE):
+    """
+    Full reload of the cards collection from a bulk file through a staging collection.
+
+    Fields that other jobs keep on cards (spot_price_updated, lookup_misses, ...) are
+    carried over from the live documents before the swap. Every card is stamped as
+    changed, so the next crosswalk run re-joins all of them.
+
+    Returns:
+        Number of cards loaded
+    """
+    start = time.time()
+    loaded_at = datetime.now()
+    staging = collection_swap.StagingLoad(db, CARDS_COLLECTION, ["id"], CONTENT_HASH_FIELD).begin()
+
+    batch = []
+    try:
+        for card in iter_bulk_objects(path):
+            card[CONTENT_HASH_FIELD] = content_hash(card)
+            card[CHANGED_AT_FIELD] = loaded_at
+            batch.append(card)
+            if len(batch) >= batch_size:
+                staging.insert(batch)
+                batch = []
+        staging.insert(batch)
+        print(f"Staged {staging.inserted} cards in {time.time() - start:.2f} seconds")
+
+        staging.finish()
+    except Exception:
+        staging.abort()
+        raise
+
+    print(f"Cards reload complete in {time.time() - start:.2f} seconds")
+    return staging.inserted
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Load a Scryfall bulk-data file into MongoDB")
+    parser.add_argument("path", help="Path to a Scryfall bulk-data JSON file (e.g. all-cards.json)")
+    parser.add_argument("--swap", action="store_true", help="Full reload through a staging collection")
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS,
+                        help="Parse processes for the incremental ingest (0 = single stream)")
+    parser.add_argument("--rollback", action="store_true", help="Restore the previous cards generation")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        db = client["mtgdbmongo"]
+        if args.rollback:
+            collection_swap.rollback(db, CARDS_COLLECTION)
+        elif args.swap:
+            swap_load_cards(db, args.path)
+        else:
+            ingest_cards(db, args.path, args.workers)
+    finally:
+        client.close()
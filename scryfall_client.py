@@ -0,0 +1,390 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limiter is then shared by threads only
+    fcntl = None
+
+SCRYFALL_API_URL = os.getenv("SCRYFALL_API_URL", "https://api.scryfall.com")
+
+# Scryfall asks for 50-100 ms between requests; the bucket allows short bursts of
+# BURST requests and refills at REQUESTS_PER_SECOND
+REQUESTS_PER_SECOND = float(os.getenv("SCRYFALL_REQUESTS_PER_SECOND", 10))
+BURST = 10
+
+# Token bucket state shared by every thread and process on this machine (gunicorn
+# workers, import jobs, ...)
+RATE_STATE_PATH = os.getenv(
+    "SCRYFALL_RATE_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "scryfall_rate.state")
+)
+
+# GET responses are kept on disk and served without a request for CACHE_TTL seconds,
+# then revalidated with their ETag / Last-Modified
+CACHE_DIR = os.getenv(
+    "SCRYFALL_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "scryfall_cache")
+)
+CACHE_TTL = int(os.getenv("SCRYFALL_CACHE_TTL", 24 * 60 * 60))
+
+# Entries not written (fetched or revalidated) for CACHE_MAX_AGE seconds are deleted by
+# a sweep that runs at most every CACHE_SWEEP_INTERVAL seconds, from put()
+CACHE_MAX_AGE = int(os.getenv("SCRYFALL_CACHE_MAX_AGE", 7 * 24 * 60 * 60))
+CACHE_SWEEP_INTERVAL = 60 * 60
+
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+POOL_SIZE = 8
+REQUEST_TIMEOUT = 30
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# The collection endpoint takes up to 75 card identifiers per request
+MAX_IDENTIFIERS_PER_CALL = 75
+
+# Scryfall asks API clients to identify themselves and to send an Accept header
+REQUEST_HEADERS = {"User-Agent": "mtgdbmongo/1.0", "Accept": "application/json"}
+
+
+class ScryfallError(Exception):
+    """Raised when the API keeps failing after every retry"""
+
+
+class TokenBucket:
+    """
+    Token bucket limiter whose state lives in a small file guarded by flock, so every
+    thread and process using the same state file shares one budget.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=BURST, state_path=RATE_STATE_PATH):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        if rate and state_path:
+            os.makedirs(os.path.dirname(state_path), exist_ok=True)
+
+    def _update(self, change):
+        """Run change(tokens, updated, paused_until) -> (state, result) under the locks"""
+        with self.lock, open(self.state_path, "a+", encoding="utf-8") as file:
+            if fcntl:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    tokens, updated, paused_until = (float(value) for value in file.read().split())
+                except ValueError:
+                    tokens, updated, paused_until = self.burst, time.time(), 0.0
+                state, result = change(tokens, updated, paused_until)
+                file.seek(0)
+                file.truncate()
+                file.write(" ".join(repr(value) for value in state))
+                file.flush()
+                return result
+            finally:
+                if fcntl:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def wait(self):
+        """Block until a request may be sent"""
+        if not self.rate:
+            return
+
+        def take(tokens, updated, paused_until):
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            if now < paused_until:
+                return (tokens, now, paused_until), paused_until - now
+            if tokens >= 1:
+                return (tokens - 1, now, paused_until), 0.0
+            return (tokens, now, paused_until), (1 - tokens) / self.rate
+
+        while True:
+            delay = self._update(take)
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Hold every caller back (used when the server answers 429 with Retry-After)"""
+        if not self.rate:
+            return
+        self._update(lambda tokens, updated, paused_until: (
+            (0.0, time.time(), max(paused_until, time.time() + seconds)), None
+        ))
+
+
+class ResponseCache:
+    """
+    GET responses on disk, one JSON file per URL, written atomically. Expired
+    entries are kept for revalidation until they are CACHE_MAX_AGE old, then swept.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, max_age=CACHE_MAX_AGE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_age = max_age
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        if not self.directory:
+            return None
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, entry):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(url)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + CACHE_SWEEP_INTERVAL
+            self.sweep(now)
+        finally:
+            self._sweep_lock.release()
+
+    def sweep(self, now=None):
+        """
+        Delete entries (and leftover temporary files) older than max_age.
+
+        Returns:
+            Number of files deleted
+        """
+        if not self.directory or not os.path.isdir(self.directory):
+            return 0
+        cutoff = (now or time.time()) - self.max_age
+        deleted = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        deleted += 1
+                except OSError:
+                    # Another process swept or rewrote it first
+                    continue
+        return deleted
+
+    def fresh(self, entry, ttl=None):
+        return time.time() - entry["fetched_at"] < (self.ttl if ttl is None else ttl)
+
+
+class ScryfallClient:
+    """
+    Client for the Scryfall API.
+
+    One pooled keep-alive session is shared by every call, and every request waits
+    on a token bucket shared across threads and processes. GET responses (including
+    404s) are cached on disk for `cache_ttl` seconds and then revalidated with
+    If-None-Match / If-Modified-Since. 429/5xx/connection errors are retried with
+    full-jitter exponential backoff, honouring Retry-After.
+    """
+
+    def __init__(self, base_url=None, rate=REQUESTS_PER_SECOND, burst=BURST, state_path=RATE_STATE_PATH,
+                 cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL, max_retries=MAX_RETRIES, pool_size=POOL_SIZE,
+                 timeout=REQUEST_TIMEOUT):
+        self.base_url = (base_url or SCRYFALL_API_URL).rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.limiter = TokenBucket(rate, burst, state_path)
+        self.cache = ResponseCache(cache_dir, cache_ttl)
+        self.stats = {"requests": 0, "cache_hits": 0, "revalidated": 0, "retries": 0}
+        self._stats_lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers.update(REQUEST_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _url(self, path):
+        return path if path.startswith(("http://", "https://")) else f"{self.base_url}{path}"
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def request(self, method, path, headers=None, **kwargs):
+        """
+        Send one request under the rate limit, retrying 429/5xx/connection errors.
+
+        Returns:
+            requests.Response (any status that is not retried)
+        """
+        url = self._url(path)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            self._count("requests")
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise ScryfallError(f"{method} {path} failed: {e}") from e
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                retry_after = response.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    self.limiter.pause(float(retry_after))
+                response.close()
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+                continue
+            return response
+
+        raise ScryfallError(f"{method} {path} failed after {self.max_retries + 1} attempts")
+
+    def get_json(self, path, params=None, ttl=None):
+        """
+        Cached GET of a JSON resource.
+
+        Args:
+            path: API path (e.g. /cards/tcgplayer/123) or absolute URL
+            params: Optional query parameters
+            ttl: Seconds a cached response is served without revalidation
+                (defaults to the client's cache_ttl; 0 always revalidates)
+
+        Returns:
+            Parsed JSON body, or None when the resource does not exist (404)
+        """
+        url = requests.Request("GET", self._url(path), params=params).prepare().url
+        entry = self.cache.get(url)
+        if entry and self.cache.fresh(entry, ttl):
+            self._count("cache_hits")
+            return entry["body"]
+
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.request("GET", url, headers=headers)
+        if response.status_code == 304 and entry:
+            self._count("revalidated")
+            entry["fetched_at"] = time.time()
+            self.cache.put(url, entry)
+            return entry["body"]
+
+        if response.status_code not in (200, 404):
+            raise ScryfallError(f"GET {path} returned status {response.status_code}")
+
+        body = response.json() if response.status_code == 200 else None
+        self.cache.put(url, {
+            "url": url,
+            "status": response.status_code,
+            "fetched_at": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body": body
+        })
+        return body
+
+    def post_json(self, path, payload):
+        """
+        Uncached POST of a JSON payload.
+
+        Returns:
+            Parsed JSON body
+        """
+        response = self.request("POST", path, json=payload)
+        if response.status_code != 200:
+            raise ScryfallError(f"POST {path} returned status {response.status_code}")
+        return response.json()
+
+    def download(self, url, path):
+        """
+        Stream a file (bulk data, images) to disk, replacing `path` only once complete.
+
+        Returns:
+            Bytes written
+        """
+        response = self.request("GET", url, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise ScryfallError(f"GET {url} returned status {response.status_code}")
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            written = 0
+            with open(tmp_path, "wb") as file:
+                for block in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    file.write(block)
+                    written += len(block)
+        os.replace(tmp_path, path)
+        return written
+
+    def cards_collection(self, identifiers):
+        """
+        Look up to MAX_IDENTIFIERS_PER_CALL cards with one request to /cards/collection.
+
+        Args:
+            identifiers: Scryfall card identifiers, e.g. {"id": ...} or
+                {"set": ..., "collector_number": ...}
+
+        Returns:
+            Tuple of (cards found, identifiers not found)
+        """
+        identifiers = list(identifiers)
+        if len(identifiers) > MAX_IDENTIFIERS_PER_CALL:
+            raise ValueError(f"At most {MAX_IDENTIFIERS_PER_CALL} identifiers per call, got {len(identifiers)}")
+        if not identifiers:
+            return [], []
+        data = self.post_json("/cards/collection", {"identifiers": identifiers})
+        return data.get("data") or [], data.get("not_found") or []
+
+    def card_by_tcgplayer_id(self, tcgplayer_id):
+        """The Scryfall card for a TCGplayer product id, or None"""
+        return self.get_json(f"/cards/tcgplayer/{int(tcgplayer_id)}")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide client, so every caller shares the session and cache"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ScryfallClient()
+        return _client
@@ -0,0 +1,201 @@
+"""
+Local stand-in for the Scryfall API (card lookups by TCGplayer id and bulk data).
+
+Run it to benchmark ScryfallClient (rate limit, cache, retries) without touching
+the real API:
+
+    python scryfall_stub.py --lookups 500 --latency 0.02 --error-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import scryfall_client
+
+BULK_UPDATED_AT = "2025-01-01T10:00:00.000+00:00"
+
+
+def stub_card_id(tcgplayer_id):
+    return f"00000000-0000-0000-0000-{tcgplayer_id:012d}"
+
+
+def stub_card(tcgplayer_id):
+    """A card derived from the id, so repeated runs agree; ids ending in 0 are unknown"""
+    if tcgplayer_id % 10 == 0:
+        return None
+    usd = round((tcgplayer_id % 5000) / 100 + 0.1, 2)
+    return {
+        "object": "card",
+        "id": stub_card_id(tcgplayer_id),
+        "oracle_id": f"11111111-0000-0000-0000-{tcgplayer_id // 2:012d}",
+        "name": f"Stub Card {tcgplayer_id}",
+        "set": "stb",
+        "tcgplayer_id": tcgplayer_id,
+        "uri": f"https://api.scryfall.com/cards/stub-{tcgplayer_id}",
+        "prices": {"usd": f"{usd:.2f}", "usd_foil": f"{usd * 2.5:.2f}", "eur": f"{usd * 0.9:.2f}", "eur_foil": None},
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "ScryfallStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None, raw=None):
+        payload = raw if raw is not None else (json.dumps(body).encode() if body is not None else b"")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_json(self, body):
+        """200 with an ETag, or 304 when the client already holds this version"""
+        payload = json.dumps(body).encode()
+        etag = '"' + hashlib.md5(payload).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.count("not_modified")
+            return self._send(304, headers={"ETag": etag})
+        self._send(200, headers={"ETag": etag}, raw=payload)
+
+    def _throttled(self):
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            self.server.count("injected_errors")
+            self._send(429, {"object": "error", "status": 429}, {"Retry-After": "0"})
+            return True
+        return False
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/cards/tcgplayer/"):
+            self.server.count("cards")
+            if self._throttled():
+                return
+            card = stub_card(int(path.rsplit("/", 1)[1]))
+            if card is None:
+                return self._send(404, {"object": "error", "status": 404, "code": "not_found"})
+            return self._send_json(card)
+
+        if path.startswith("/bulk-data/"):
+            self.server.count("bulk_data")
+            kind = path.rsplit("/", 1)[1]
+            return self._send_json({
+                "object": "bulk_data",
+                "type": kind,
+                "updated_at": BULK_UPDATED_AT,
+                "download_uri": f"{self.server.url}/files/{kind}.json"
+            })
+
+        if path.startswith("/files/"):
+            self.server.count("files")
+            cards = [card for card in (stub_card(i) for i in range(1, self.server.bulk_cards + 1)) if card]
+            payload = ("[\n" + ",\n".join(json.dumps(card) for card in cards) + "\n]\n").encode()
+            return self._send(200, raw=payload)
+
+        self._send(404, {"object": "error", "status": 404})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.split("?")[0] != "/cards/collection":
+            return self._send(404, {"object": "error", "status": 404})
+        self.server.count("collection")
+        if self._throttled():
+            return
+
+        identifiers = body.get("identifiers") or []
+        if len(identifiers) > scryfall_client.MAX_IDENTIFIERS_PER_CALL:
+            return self._send(422, {"object": "error", "status": 422, "code": "too_many_identifiers"})
+
+        found, not_found = [], []
+        for identifier in identifiers:
+            # Stub card ids end in their TCGplayer id
+            card_id = identifier.get("id") or ""
+            tail = card_id.rsplit("-", 1)[-1]
+            card = stub_card(int(tail)) if tail.isdigit() else None
+            if card and card["id"] == card_id:
+                found.append(card)
+            else:
+                not_found.append(identifier)
+        self._send(200, {"object": "list", "not_found": not_found, "data": found})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, error_rate=0.0, bulk_cards=1000):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bulk_cards = bulk_cards
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub(**kwargs):
+    """Start a stub server on a free local port in a background thread"""
+    server = StubServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ScryfallClient against a local stub API")
+    parser.add_argument("--lookups", type=int, default=500, help="Cards to look up by TCGplayer id")
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--rate", type=float, default=scryfall_client.REQUESTS_PER_SECOND,
+                        help="Client requests per second (0 = unlimited)")
+    parser.add_argument("--workers", type=int, default=scryfall_client.POOL_SIZE, help="Concurrent lookups")
+    parser.add_argument("--collection", action="store_true",
+                        help="Look cards up in batches through /cards/collection instead of one by one")
+    args = parser.parse_args()
+
+    server = start_stub(latency=args.latency, error_rate=args.error_rate)
+    with tempfile.TemporaryDirectory() as directory:
+        client = scryfall_client.ScryfallClient(
+            base_url=server.url, rate=args.rate, state_path=f"{directory}/rate.state",
+            cache_dir=f"{directory}/cache", pool_size=args.workers
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                if args.collection:
+                    batch_size = scryfall_client.MAX_IDENTIFIERS_PER_CALL
+                    batches = [
+                        [{"id": stub_card_id(i)} for i in range(start, min(start + batch_size, args.lookups + 1))]
+                        for start in range(1, args.lookups + 1, batch_size)
+                    ]
+                    start = time.time()
+                    found = sum(len(cards) for cards, _ in executor.map(client.cards_collection, batches))
+                    elapsed = time.time() - start
+                    print(f"collection: {found}/{args.lookups} cards in {len(batches)} calls, {elapsed:.2f} seconds "
+                          f"({args.lookups / elapsed:.0f} lookups/sec), client: {client.stats}")
+                for label in () if args.collection else ("cold", "cached"):
+                    start = time.time()
+                    found = sum(card is not None for card in
+                                executor.map(client.card_by_tcgplayer_id, range(1, args.lookups + 1)))
+                    elapsed = time.time() - start
+                    print(f"{label}: {found}/{args.lookups} cards in {elapsed:.2f} seconds "
+                          f"({args.lookups / elapsed:.0f} lookups/sec), client: {client.stats}")
+            print(f"Server calls: {server.counts}")
+        finally:
+            client.close()
+            server.shutdown()
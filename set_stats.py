@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import pymongo
+
+# One document per TCGplayer group (set), maintained by the daily import
+SET_STATS_COLLECTION = "set_stats"
+
+# Most valuable cards kept per set and per rarity
+TOP_N = 10
+
+SET_STATS_FIELD = "marketPrice"
+
+# Fields that move with the previous day even when a set's value does not
+DAILY_FIELDS = ("previousTotal", "change", "changePct", "rarities", "asOf")
+
+
+def ensure_set_stats_collection(db):
+    """Indexes for the sets index page (by value) and set pages (by Scryfall set code)"""
+    collection = db[SET_STATS_COLLECTION]
+    collection.create_index([("set", pymongo.ASCENDING), ("cardCount", pymongo.DESCENDING)], name="set_cardCount_idx")
+    collection.create_index([("totalValue", pymongo.DESCENDING)], name="totalValue_idx")
+    return collection
+
+
+def _price_frame(matrix, metadata, field):
+    """
+    Today's and the previous import's price for every card in today's import, one row
+    per productId (Normal printing preferred over other sub types). Sealed products
+    (boxes, bundles, decks) carry neither a rarity nor a collector number and are left out.
+    """
+    keys = [key for key in metadata if key in matrix.columns]
+    cols = np.array([matrix.columns[key] for key in keys], dtype=np.int64)
+    prices = matrix.matrix(field)
+    last = len(matrix.days) - 1
+
+    frame = pd.DataFrame({
+        "productId": [metadata[key].get("productId") for key in keys],
+        "name": [metadata[key].get("name") for key in keys],
+        "normal": [(metadata[key].get("subTypeName") or "Normal") == "Normal" for key in keys],
+        "groupId": [metadata[key].get("groupId") for key in keys],
+        "rarity": [metadata[key].get("rarity") or "Unknown" for key in keys],
+        "card": [bool(metadata[key].get("rarity") or metadata[key].get("number")) for key in keys],
+        "price": np.asarray(prices[last], dtype=np.float64)[cols],
+        "previous": np.asarray(prices[last - 1], dtype=np.float64)[cols] if last >= 1 else np.nan,
+    })
+    frame = frame[frame["groupId"].notna() & frame["card"]]
+    frame = frame.sort_values("normal", ascending=False).drop_duplicates("productId")
+    return frame
+
+
+def _top(frame, n=TOP_N):
+    top = frame[frame["price"].notna()].nlargest(n, "price")
+    return [
+        {"productId": int(row.productId), "name": row.name, "price": round(float(row.price), 2)}
+        for row in top.itertuples(index=False)
+    ]
+
+
+def _summary(frame):
+    priced = frame["price"].dropna()
+    previous_total = float(frame["previous"].sum())
+    total = float(priced.sum())
+    return {
+        "cardCount": int(len(frame)),
+        "pricedCount": int(len(priced)),
+        "totalValue": round(total, 2),
+        "medianValue": round(float(priced.median()), 2) if len(priced) else None,
+        "previousTotal": round(previous_total, 2),
+        "change": round(total - previous_total, 2),
+        "changePct": round((total - previous_total) / previous_total * 100, 2) if previous_total > 0 else None,
+        "top": _top(frame),
+    }
+
+
+def compute_set_stats(matrix, metadata, field=SET_STATS_FIELD):
+    """
+    Build set statistics for every group in today's import from the current and
+    previous price vectors (no reads from Mongo).
+
+    Returns:
+        Dictionary of groupId -> fields to $set on the set_stats document
+    """
+    if not matrix.days or not metadata:
+        return {}
+
+    frame = _price_frame(matrix, metadata, field)
+    as_of = matrix.days[-1]
+
+    stats = {}
+    for group_id, group in frame.groupby("groupId", sort=False):
+        fields = _summary(group)
+        fields["rarities"] = {
+            str(rarity): _summary(by_rarity)
+            for rarity, by_rarity in group.groupby("rarity", sort=False)
+        }
+        fields["asOf"] = as_of
+        stats[int(group_id)] = fields
+    return stats
+
+
+def refresh_set_stats(db, matrix, metadata, game_id=None):
+    """
+    Write set statistics for every group in the import, then attach the Scryfall set
+    code to groups seen for the first time. Groups whose value and card count did not
+    change only get their day-over-day fields (change, changePct, previousTotal,
+    rarities and asOf) rewritten.
+
+    Returns:
+        Number of set_stats documents written
+    """
+    collection = ensure_set_stats_collection(db)
+    stats = compute_set_stats(matrix, metadata)
+    if not stats:
+        return 0
+
+    existing = {
+        doc["_id"]: doc
+        for doc in collection.find(
+            {"_id": {"$in": list(stats)}},
+            {"totalValue": 1, "cardCount": 1, "set": 1}
+        )
+    }
+
+    operations = []
+    for group_id, fields in stats.items():
+        previous = existing.get(group_id)
+        if previous and previous.get("totalValue") == fields["totalValue"] and previous.get("cardCount") == fields["cardCount"]:
+            daily = {name: fields[name] for name in DAILY_FIELDS}
+            operations.append(pymongo.UpdateOne({"_id": group_id}, {"$set": daily}))
+            continue
+
+        document = {"groupId": group_id, **fields}
+        if game_id is not None:
+            document["gameId"] = game_id
+        operations.append(pymongo.UpdateOne({"_id": group_id}, {"$set": document}, upsert=True))
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+    # Resolve the Scryfall set for new groups through any card that links to one of its products
+    product_ids = {}
+    for meta in metadata.values():
+        product_ids.setdefault(meta.get("groupId"), []).append(meta.get("productId"))
+
+    for group_id in stats:
+        if existing.get(group_id, {}).get("set"):
+            continue
+
+        card = db["cards"].find_one(
+            {"tcgplayer_id": {"$in": product_ids.get(group_id, [])[:200]}},
+            {"_id": 0, "set": 1, "set_name": 1, "released_at": 1}
+        )
+        if card and card.get("set"):
+            collection.update_one(
+                {"_id": group_id},
+                {"$set": {"set": card["set"], "name": card.get("set_name"), "released_at": card.get("released_at")}}
+            )
+
+    return len(operations)
@@ -0,0 +1,258 @@
+import argparse
+import os
+import shutil
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pymongo
+
+import crosswalk
+
+# Nightly columnar copies of the collections analytics scripts read, one directory per export
+SNAPSHOT_DIR = os.getenv(
+    "SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "snapshots")
+)
+
+# "parquet" (smaller) or "ipc" (Arrow IPC files, zero-copy when memory-mapped)
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "parquet")
+
+# Exports kept on disk
+KEEP_SNAPSHOTS = 3
+
+# Documents per record batch while exporting
+EXPORT_BATCH_SIZE = 50000
+
+LATEST_FILE = "LATEST"
+
+# Export directories are named after the time the export started
+EXPORT_ID_FORMAT = "%Y-%m-%dT%H%M%S"
+
+# name -> (collection, query, [(column, document path, arrow type)], partition columns)
+SNAPSHOTS = {
+    "cards": ("cards", {}, [
+        ("id", "id", pa.string()),
+        ("oracle_id", "oracle_id", pa.string()),
+        ("name", "name", pa.string()),
+        ("set", "set", pa.string()),
+        ("collector_number", "collector_number", pa.string()),
+        ("rarity", "rarity", pa.string()),
+        ("lang", "lang", pa.string()),
+        ("released_at", "released_at", pa.string()),
+        ("type_line", "type_line", pa.string()),
+        ("artist", "artist", pa.string()),
+        ("cmc", "cmc", pa.float64()),
+        ("tcgplayer_id", "tcgplayer_id", pa.int64()),
+        ("usd", "prices.usd", pa.float64()),
+        ("usd_foil", "prices.usd_foil", pa.float64()),
+        ("eur", "prices.eur", pa.float64()),
+        ("eur_foil", "prices.eur_foil", pa.float64()),
+    ], ["set"]),
+    "products": ("products", {}, [
+        ("gameId", "gameId", pa.int64()),
+        ("groupId", "groupId", pa.int64()),
+        ("productId", "productId", pa.int64()),
+        ("name", "name", pa.string()),
+        ("cleanName", "cleanName", pa.string()),
+        ("subTypeName", "subTypeName", pa.string()),
+        ("extRarity", "extRarity", pa.string()),
+        ("extNumber", "extNumber", pa.string()),
+        ("lowPrice", "lowPrice", pa.float64()),
+        ("midPrice", "midPrice", pa.float64()),
+        ("highPrice", "highPrice", pa.float64()),
+        ("marketPrice", "marketPrice", pa.float64()),
+        ("directLowPrice", "directLowPrice", pa.float64()),
+        ("usdPrice", "usdPrice", pa.float64()),
+        ("eurPrice", "eurPrice", pa.float64()),
+        ("deltaPrice", "deltaPrice", pa.float64()),
+        ("globalPrice", "globalPrice", pa.float64()),
+        ("changed_at", "changed_at", pa.timestamp("ms")),
+    ], ["gameId", "groupId"]),
+    "card_product_links": (crosswalk.LINKS_COLLECTION, {}, [
+        ("card_id", "card_id", pa.string()),
+        ("productId", "productId", pa.int64()),
+        ("method", "method", pa.string()),
+        ("confidence", "confidence", pa.float64()),
+        ("updated_at", "updated_at", pa.timestamp("ms")),
+    ], []),
+}
+
+
+def _value(document, path):
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def _record_batch(documents, columns, schema):
+    """Projected documents -> typed RecordBatch (unparseable numbers become nulls)"""
+    frame = {}
+    for column, path, arrow_type in columns:
+        values = [_value(document, path) for document in documents]
+        if pa.types.is_floating(arrow_type):
+            values = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").astype("float64")
+        elif pa.types.is_integer(arrow_type):
+            values = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").astype("Int64")
+        elif pa.types.is_timestamp(arrow_type):
+            values = pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").dt.floor("ms")
+        else:
+            values = pd.Series([None if value is None else str(value) for value in values], dtype=object)
+        frame[column] = values
+    return pa.RecordBatch.from_pandas(pd.DataFrame(frame), schema=schema, preserve_index=False)
+
+
+def _batches(collection, query, columns, partitions, schema, stats, batch_size=EXPORT_BATCH_SIZE):
+    projection = {"_id": 0, **{path: 1 for _, path, _ in columns}}
+    cursor = collection.find(query, projection, batch_size=batch_size)
+    if partitions:
+        # Partition-ordered input writes one file per partition
+        cursor = cursor.sort([(column, pymongo.ASCENDING) for column in partitions]).allow_disk_use(True)
+
+    documents = []
+    for document in cursor:
+        documents.append(document)
+        if len(documents) >= batch_size:
+            stats["rows"] += len(documents)
+            yield _record_batch(documents, columns, schema)
+            documents = []
+    if documents:
+        stats["rows"] += len(documents)
+        yield _record_batch(documents, columns, schema)
+
+
+def export_snapshot(db, name, export_dir, file_format=SNAPSHOT_FORMAT):
+    """
+    Write one projected, typed, partitioned snapshot of a collection.
+
+    Returns:
+        Number of rows written
+    """
+    collection_name, query, columns, partitions = SNAPSHOTS[name]
+    schema = pa.schema([(column, arrow_type) for column, _, arrow_type in columns])
+    stats = {"rows": 0}
+    ds.write_dataset(
+        _batches(db[collection_name], query, columns, partitions, schema, stats),
+        os.path.join(export_dir, name),
+        schema=schema,
+        format=file_format,
+        partitioning=ds.partitioning(
+            pa.schema([schema.field(column) for column in partitions]), flavor="hive"
+        ) if partitions else None,
+        existing_data_behavior="delete_matching",
+        max_partitions=1 << 20,
+        max_rows_per_group=1 << 20,
+    )
+    return stats["rows"]
+
+
+def export_all(db, root=SNAPSHOT_DIR, names=None, keep=KEEP_SNAPSHOTS):
+    """
+    Nightly export: write every snapshot into a new directory, then point LATEST at it.
+
+    Readers never see a half-written export because LATEST is only replaced once
+    every snapshot of the export is complete.
+
+    Returns:
+        Dictionary of snapshot name -> rows written
+    """
+    start = time.time()
+    export_id = datetime.now().strftime(EXPORT_ID_FORMAT)
+    export_dir = os.path.join(root, export_id)
+    os.makedirs(export_dir, exist_ok=True)
+
+    rows = {}
+    for name in names or SNAPSHOTS:
+        step = time.time()
+        rows[name] = export_snapshot(db, name, export_dir)
+        print(f"Snapshot {name}: {rows[name]} rows in {time.time() - step:.2f} seconds")
+
+    tmp_path = os.path.join(root, LATEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(export_id)
+    os.replace(tmp_path, os.path.join(root, LATEST_FILE))
+
+    exports = sorted(entry for entry in os.listdir(root) if os.path.isdir(os.path.join(root, entry)))
+    for old_export in exports[:-keep] if keep else []:
+        shutil.rmtree(os.path.join(root, old_export), ignore_errors=True)
+
+    print(f"Exported snapshots to {export_dir} in {time.time() - start:.2f} seconds")
+    return rows
+
+
+def latest_export(root=SNAPSHOT_DIR):
+    """Id of the most recent complete export, or None"""
+    path = os.path.join(root, LATEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read().strip() or None
+
+
+def export_started(export_id):
+    """When an export began reading Mongo, from its id"""
+    return datetime.strptime(export_id, EXPORT_ID_FORMAT)
+
+
+def open_snapshot(name, root=SNAPSHOT_DIR, export_id=None, file_format=SNAPSHOT_FORMAT):
+    """
+    Open a snapshot as a memory-mapped pyarrow Dataset (latest complete export
+    unless `export_id` is given).
+
+    Raises FileNotFoundError when there is no snapshot yet.
+    """
+    export_id = export_id or latest_export(root)
+    path = os.path.join(root, export_id, name) if export_id else None
+    if not path or not os.path.isdir(path):
+        raise FileNotFoundError(f"No {name} snapshot in {root}")
+    partitions = SNAPSHOTS[name][3]
+    return ds.dataset(
+        path,
+        format=file_format,
+        partitioning="hive" if partitions else None,
+        filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def load(name, columns=None, root=SNAPSHOT_DIR, export_id=None, **filters):
+    """
+    Read a snapshot into a DataFrame, memory-mapped, with only the requested columns.
+
+    Keyword filters are column equalities (a list or tuple means "any of"), pushed down
+    to partition pruning where the column is a partition key:
+
+        snapshots.load("products", ["productId", "marketPrice"], gameId=1, groupId=[97, 98])
+
+    Returns:
+        pandas DataFrame
+    """
+    dataset = open_snapshot(name, root, export_id)
+    expression = None
+    for column, value in filters.items():
+        condition = ds.field(column).isin(list(value)) if isinstance(value, (list, tuple, set)) \
+            else ds.field(column) == value
+        expression = condition if expression is None else expression & condition
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Export columnar snapshots of cards and products")
+    parser.add_argument("--only", action="append", choices=sorted(SNAPSHOTS), help="Only these snapshots")
+    parser.add_argument("--root", default=SNAPSHOT_DIR, help="Snapshot directory")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(os.getenv("MONGO_URI"))
+    try:
+        export_all(client["mtgdbmongo"], args.root, args.only)
+    finally:
+        client.close()
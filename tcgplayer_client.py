@@ -0,0 +1,235 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TCGPLAYER_API_URL = os.getenv("TCGPLAYER_API_URL", "https://api.tcgplayer.com")
+TCGPLAYER_API_VERSION = os.getenv("TCGPLAYER_API_VERSION", "")
+
+# The pricing endpoint accepts a comma-separated list of up to 250 product ids
+MAX_IDS_PER_CALL = 250
+
+# TCGplayer allows roughly 300 requests per minute per application
+REQUESTS_PER_SECOND = 5.0
+
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Refresh tokens this long before they expire
+TOKEN_MARGIN = 300
+
+POOL_SIZE = 8
+REQUEST_TIMEOUT = 30
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TCGplayerError(Exception):
+    """Raised when the API keeps failing after every retry"""
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads"""
+
+    def __init__(self, rate=REQUESTS_PER_SECOND):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds):
+        """Push every caller back (used when the server answers 429 with Retry-After)"""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+class TCGplayerClient:
+    """
+    Pricing client for the TCGplayer API.
+
+    One pooled session is shared by every call, bearer tokens are cached until
+    shortly before they expire, product ids are sent up to MAX_IDS_PER_CALL per
+    request, and 429/5xx/connection errors are retried with full-jitter
+    exponential backoff under a shared rate limit.
+
+    Authentication uses TCGPLAYER_PUBLIC_KEY/TCGPLAYER_PRIVATE_KEY (client
+    credentials) when set, otherwise a ready-made TCGPLAYER_API_KEY bearer token.
+    """
+
+    def __init__(self, base_url=None, public_key=None, private_key=None, access_token=None,
+                 rate=REQUESTS_PER_SECOND, max_ids=MAX_IDS_PER_CALL, max_retries=MAX_RETRIES,
+                 pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        self.base_url = (base_url or TCGPLAYER_API_URL).rstrip("/")
+        self.public_key = public_key if public_key is not None else os.getenv("TCGPLAYER_PUBLIC_KEY")
+        self.private_key = private_key if private_key is not None else os.getenv("TCGPLAYER_PRIVATE_KEY")
+        self.static_token = access_token if access_token is not None else os.getenv("TCGPLAYER_API_KEY")
+        self.max_ids = max_ids
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.limiter = RateLimiter(rate)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return bool((self.public_key and self.private_key) or self.static_token)
+
+    def close(self):
+        self.session.close()
+
+    # ---------------------------------------------------------------- auth
+
+    def token(self, refresh=False):
+        """Cached bearer token, requesting a new one when missing or about to expire"""
+        if not (self.public_key and self.private_key):
+            return self.static_token
+
+        with self._token_lock:
+            if refresh or not self._token or time.time() >= self._token_expires - TOKEN_MARGIN:
+                self.limiter.wait()
+                response = self.session.post(
+                    f"{self.base_url}/token",
+                    data={
+                        "grant_type": "client_credentials",
+                        "client_id": self.public_key,
+                        "client_secret": self.private_key
+                    },
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                data = response.json()
+                self._token = data["access_token"]
+                self._token_expires = time.time() + float(data.get("expires_in", 3600))
+            return self._token
+
+    # ------------------------------------------------------------- requests
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def _get(self, path):
+        """GET with rate limiting, token refresh on 401 and jittered retries"""
+        version = f"/{TCGPLAYER_API_VERSION}" if TCGPLAYER_API_VERSION else ""
+        url = f"{self.base_url}{version}{path}"
+        refreshed = False
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            try:
+                response = self.session.get(
+                    url,
+                    headers={"Authorization": f"bearer {self.token()}", "Accept": "application/json"},
+                    timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise TCGplayerError(f"GET {path} failed: {e}") from e
+                time.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code == 401 and not refreshed and self.public_key:
+                self.token(refresh=True)
+                refreshed = True
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                retry_after = response.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    self.limiter.pause(float(retry_after))
+                time.sleep(self._backoff(attempt))
+                continue
+
+            # 404 means none of the requested products have prices
+            if response.status_code == 404:
+                return {"results": []}
+
+            if response.status_code != 200:
+                raise TCGplayerError(f"GET {path} returned status {response.status_code}")
+            return response.json()
+
+        raise TCGplayerError(f"GET {path} failed after {self.max_retries + 1} attempts")
+
+    def _price_chunk(self, product_ids):
+        data = self._get(f"/pricing/product/{','.join(str(pid) for pid in product_ids)}")
+        prices = {}
+        for result in data.get("results") or []:
+            prices.setdefault(result["productId"], {})[result.get("subTypeName") or "Normal"] = {
+                "lowPrice": result.get("lowPrice"),
+                "midPrice": result.get("midPrice"),
+                "highPrice": result.get("highPrice"),
+                "marketPrice": result.get("marketPrice"),
+                "directLowPrice": result.get("directLowPrice"),
+            }
+        return prices
+
+    def get_prices(self, product_ids, workers=None):
+        """
+        Current prices for many products.
+
+        Args:
+            product_ids: Iterable of TCGplayer product ids
+            workers: Concurrent pricing calls (defaults to the pool size); the rate
+                limit still applies across all of them
+
+        Returns:
+            Dictionary of productId -> {subTypeName: {lowPrice, midPrice, ...}}
+        """
+        product_ids = list(dict.fromkeys(int(pid) for pid in product_ids if pid is not None))
+        chunks = [product_ids[i:i + self.max_ids] for i in range(0, len(product_ids), self.max_ids)]
+        if not chunks:
+            return {}
+
+        prices = {}
+        if len(chunks) == 1:
+            prices.update(self._price_chunk(chunks[0]))
+            return prices
+
+        with ThreadPoolExecutor(max_workers=min(workers or self.pool_size, len(chunks))) as executor:
+            for chunk_prices in executor.map(self._price_chunk, chunks):
+                prices.update(chunk_prices)
+        return prices
+
+
+def normal_price(prices):
+    """Market (else mid) price of the Normal printing from one get_prices entry"""
+    entry = (prices or {}).get("Normal") or {}
+    return entry.get("marketPrice") if entry.get("marketPrice") is not None else entry.get("midPrice")
+
+
+def foil_price(prices):
+    """Market (else mid) price of the Foil printing from one get_prices entry"""
+    entry = (prices or {}).get("Foil") or {}
+    return entry.get("marketPrice") if entry.get("marketPrice") is not None else entry.get("midPrice")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide client, so every caller shares the session and token"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TCGplayerClient()
+        return _client
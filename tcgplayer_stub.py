@@ -0,0 +1,127 @@
+"""
+Local stand-in for the TCGplayer API (token + pricing endpoints).
+
+Run it to benchmark TCGplayerClient without touching the real API:
+
+    python tcgplayer_stub.py --products 20000 --latency 0.05 --error-rate 0.02
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tcgplayer_client
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "TCGplayerStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body or {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.server.count("token")
+        if self.path.rstrip("/") != "/token":
+            return self._send(404)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send(200, {"access_token": f"stub-{time.time()}", "token_type": "bearer",
+                         "expires_in": self.server.token_ttl})
+
+    def do_GET(self):
+        self.server.count("pricing")
+        time.sleep(self.server.latency)
+
+        if not (self.headers.get("Authorization") or "").lower().startswith("bearer stub"):
+            return self._send(401, {"success": False, "errors": ["Unauthorized"]})
+        if random.random() < self.server.error_rate:
+            self.server.count("injected_errors")
+            return self._send(429, {"success": False}, {"Retry-After": "0"})
+
+        prefix = "/pricing/product/"
+        if not self.path.startswith(prefix):
+            return self._send(404)
+
+        product_ids = [int(pid) for pid in self.path[len(prefix):].split(",") if pid.isdigit()]
+        if len(product_ids) > tcgplayer_client.MAX_IDS_PER_CALL:
+            return self._send(400, {"success": False, "errors": ["Too many product ids"]})
+
+        results = []
+        for product_id in product_ids:
+            # Prices are derived from the id so repeated runs agree
+            market = round((product_id % 5000) / 100 + 0.1, 2)
+            for sub_type in ("Normal", "Foil"):
+                scale = 1.0 if sub_type == "Normal" else 2.5
+                results.append({
+                    "productId": product_id,
+                    "subTypeName": sub_type,
+                    "lowPrice": round(market * scale * 0.8, 2),
+                    "midPrice": round(market * scale, 2),
+                    "highPrice": round(market * scale * 1.5, 2),
+                    "marketPrice": round(market * scale, 2),
+                    "directLowPrice": None,
+                })
+        self._send(200, {"success": True, "errors": [], "results": results})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, error_rate=0.0, token_ttl=1209600):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub(**kwargs):
+    """Start a stub server on a free local port in a background thread"""
+    server = StubServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TCGplayerClient against a local stub API")
+    parser.add_argument("--products", type=int, default=10000, help="Number of product ids to price")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per pricing call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--rate", type=float, default=0, help="Client requests per second (0 = unlimited)")
+    parser.add_argument("--workers", type=int, default=tcgplayer_client.POOL_SIZE, help="Concurrent pricing calls")
+    args = parser.parse_args()
+
+    server = start_stub(latency=args.latency, error_rate=args.error_rate)
+    client = tcgplayer_client.TCGplayerClient(
+        base_url=server.url, public_key="stub", private_key="stub", rate=args.rate, pool_size=args.workers
+    )
+    try:
+        start = time.time()
+        prices = client.get_prices(range(1, args.products + 1), workers=args.workers)
+        elapsed = time.time() - start
+        print(f"Priced {len(prices)} products in {elapsed:.2f} seconds "
+              f"({len(prices) / elapsed:.0f} products/sec), server calls: {server.counts}")
+    finally:
+        client.close()
+        server.shutdown()
@@ -0,0 +1,124 @@
+"""Minimal in-memory stand-ins for the pymongo pieces the import paths use"""
+import pymongo
+import pymongo.errors
+
+
+def _matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$exists" in condition and (field in document) != condition["$exists"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self, name="products"):
+        self.name = name
+        self.documents = []
+
+    def find(self, query=None, projection=None, batch_size=None):
+        for document in self.documents:
+            if _matches(document, query or {}):
+                yield {key: value for key, value in document.items()
+                       if not projection or projection.get(key)}
+
+    def apply(self, operation):
+        if isinstance(operation, pymongo.InsertOne):
+            self.documents.append(dict(operation._doc))
+            return
+        query, update = operation._filter, operation._doc
+        if not isinstance(update, dict):
+            # Pipeline updates (price history buckets) are only counted
+            return
+        for document in self.documents:
+            if _matches(document, query):
+                document.update(update["$set"])
+                return
+        if operation._upsert:
+            self.documents.append({**query, **update["$set"]})
+
+
+class RecordingThrottle:
+    """WriteThrottle stand-in that applies every bulk write to a FakeCollection"""
+
+    def __init__(self):
+        self.written = []
+
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+    def execute(self, collection, operations):
+        self.written.append((collection.name, len(operations)))
+        for operation in operations:
+            collection.apply(operation)
+        return {"nInserted": 0, "nUpserted": len(operations), "nModified": 0}
+
+
+class FakeStagingCollection(FakeCollection):
+    """Collection with the calls StagingLoad makes; unique indexes are enforced when built"""
+
+    def __init__(self, database, name):
+        super().__init__(name)
+        self.database = database
+        self.indexes = []
+
+    def insert_many(self, documents, ordered=True):
+        self.documents.extend(dict(document) for document in documents)
+
+    def insert_one(self, document):
+        self.documents.append(dict(document))
+
+    def count_documents(self, query):
+        return sum(1 for _ in self.find(query))
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    def list_indexes(self):
+        return list(self.indexes)
+
+    def create_indexes(self, models):
+        for model in models:
+            spec = model.document
+            if spec.get("unique"):
+                keys = [tuple(document.get(field) for field in spec["key"]) for document in self.documents]
+                if len(keys) != len(set(keys)):
+                    raise pymongo.errors.DuplicateKeyError(f"E11000 duplicate key in index {spec['name']}")
+            self.indexes.append(spec)
+
+    def rename(self, new_name, dropTarget=False):
+        self.database.move(self.name, new_name, dropTarget)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeStagingCollection(self, name)
+        return self.collections[name]
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    def create_collection(self, name):
+        return self[name]
+
+    def drop_collection(self, name):
+        self.collections.pop(name, None)
+
+    def move(self, old_name, new_name, drop_target=False):
+        if new_name in self.collections and not drop_target:
+            raise pymongo.errors.OperationFailure("target namespace exists")
+        collection = self.collections.pop(old_name)
+        collection.name = new_name
+        self.collections[new_name] = collection
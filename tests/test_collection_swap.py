@@ -0,0 +1,59 @@
+import pytest
+
+import collection_swap
+import product_csv
+from fakes import FakeDatabase
+from test_product_rows import write_fixture
+
+KEY = ["productId", "gameId"]
+
+
+def staged_products(tmp_path):
+    """The documents the importer's swap mode inserts for the Normal + Foil fixture"""
+    parsed = product_csv.parse_file(str(write_fixture(tmp_path)))
+    return [{**product, "gameId": 1} for product in parsed["products"]]
+
+
+def test_swap_load_with_foil_duplicated_product_completes(tmp_path):
+    db = FakeDatabase()
+    db["products"].insert_many([{"productId": 100, "gameId": 1, product_csv.ROW_HASH_FIELD: "00"}])
+
+    load = collection_swap.StagingLoad(db, "products", KEY, product_csv.ROW_HASH_FIELD).begin()
+    load.insert(staged_products(tmp_path))
+    result = load.finish(carry_over=False)
+
+    assert result["documents"] == 2
+    live = db["products"].documents
+    assert sorted(document["productId"] for document in live) == [100, 101]
+    assert next(d for d in live if d["productId"] == 100)["subTypes"]["Foil"]["marketPrice"] == 4.75
+    assert "products__previous" in db.list_collection_names()
+
+
+def test_unfolded_sub_type_rows_fail_before_the_index_build(tmp_path):
+    db = FakeDatabase()
+    rows = [{**row, "gameId": 1, product_csv.ROW_HASH_FIELD: product_csv.row_hash(row)}
+            for row in product_csv.parse_file(str(write_fixture(tmp_path)))["records"]]
+
+    load = collection_swap.StagingLoad(db, "products", KEY, product_csv.ROW_HASH_FIELD).begin()
+    with pytest.raises(collection_swap.SwapValidationError):
+        load.insert(rows)
+
+
+def test_failed_second_rename_puts_the_live_collection_back():
+    db = FakeDatabase()
+    db["products"].insert_many([{"productId": 1, "gameId": 1}])
+    load = collection_swap.StagingLoad(db, "products", KEY, product_csv.ROW_HASH_FIELD).begin()
+
+    original_move = db.move
+
+    def move(old_name, new_name, drop_target=False):
+        if old_name == load.staging_name:
+            raise RuntimeError("rename failed")
+        original_move(old_name, new_name, drop_target)
+
+    db.move = move
+    with pytest.raises(RuntimeError), load:
+        load.swap()
+
+    assert db["products"].documents == [{"productId": 1, "gameId": 1}]
+    assert load.staging_name not in db.list_collection_names()
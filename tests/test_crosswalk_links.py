@@ -0,0 +1,40 @@
+import crosswalk
+
+
+def frames(tcgplayer_id=None):
+    cards = crosswalk.card_frame([
+        {"id": "a", "name": "Lightning Bolt", "set": "LEA", "collector_number": "161", "tcgplayer_id": tcgplayer_id},
+    ])
+    products = crosswalk.product_frame([
+        {"productId": 500, "name": "Lightning Bolt", "groupId": 1, "extNumber": None},
+        {"productId": 600, "name": "Lightning Bolt (Retro Frame)", "groupId": 2, "extNumber": "161"},
+    ], {1: "lea", 2: "plst"})
+    return cards, products
+
+
+def test_exact_id_match_upgrades_a_name_only_link():
+    cards, products = frames(tcgplayer_id=600)
+    stored = {"a": {"productId": 500, "method": "name_set", "confidence": 0.8}}
+
+    written = crosswalk.link_updates(crosswalk.match_frames(cards, products), stored)
+
+    assert written[["card_id", "productId", "method"]].values.tolist() == [["a", 600.0, "tcgplayer_id"]]
+
+
+def test_weaker_match_keeps_the_stored_link():
+    cards, products = frames()
+    stored = {"a": {"productId": 600, "method": "tcgplayer_id", "confidence": 1.0}}
+
+    linked = crosswalk.match_frames(cards, products)
+
+    assert linked["method"].tolist() == ["name_set"]
+    assert crosswalk.link_updates(linked, stored).empty
+    assert len(crosswalk.link_updates(linked, stored, rebuild=True)) == 1
+
+
+def test_unchanged_link_is_not_rewritten():
+    cards, products = frames()
+    stored = {"a": {"productId": 500, "method": "name_set", "confidence": 0.8}}
+
+    assert crosswalk.link_updates(crosswalk.match_frames(cards, products), stored).empty
+    assert len(crosswalk.link_updates(crosswalk.match_frames(cards, products), {})) == 1
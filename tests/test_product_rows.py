@@ -0,0 +1,65 @@
+import csv
+
+import product_csv
+import product_stream
+
+FIXTURE_ROWS = [
+    {"productId": "100", "name": "Lightning Bolt", "groupId": "7", "subTypeName": "Normal",
+     "lowPrice": "0.5", "marketPrice": "1.25"},
+    {"productId": "100", "name": "Lightning Bolt", "groupId": "7", "subTypeName": "Foil",
+     "lowPrice": "3.0", "marketPrice": "4.75"},
+    {"productId": "101", "name": "Counterspell", "groupId": "7", "subTypeName": "Normal",
+     "lowPrice": "0.2", "marketPrice": "0.4"},
+]
+
+
+def write_fixture(tmp_path):
+    path = tmp_path / "ProductsAndPrices_game_1_group_7.csv"
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=list(FIXTURE_ROWS[0]))
+        writer.writeheader()
+        writer.writerows(FIXTURE_ROWS)
+    return path
+
+
+def test_fold_keeps_normal_prices_on_top_and_every_sub_type(tmp_path):
+    parsed = product_csv.parse_file(str(write_fixture(tmp_path)))
+
+    assert len(parsed["records"]) == 3
+    products = {product["productId"]: product for product in parsed["products"]}
+    assert sorted(products) == [100, 101]
+    assert products[100]["marketPrice"] == 1.25
+    assert products[100]["subTypes"]["Foil"]["marketPrice"] == 4.75
+    assert products[100]["subTypes"]["Normal"]["marketPrice"] == 1.25
+
+
+def test_fold_hash_does_not_depend_on_row_order():
+    rows = [product_csv.type_row(list(row), list(row.values())) for row in FIXTURE_ROWS]
+    forward = product_csv.fold_rows(rows)
+    backward = product_csv.fold_rows(list(reversed(rows)))
+
+    assert {p["productId"]: p["rowHash"] for p in forward} == {p["productId"]: p["rowHash"] for p in backward}
+    assert next(p for p in backward if p["productId"] == 100)["marketPrice"] == 1.25
+
+
+def test_second_import_of_normal_and_foil_rows_writes_no_products(tmp_path):
+    from fakes import FakeCollection, RecordingThrottle
+
+    products = FakeCollection("products")
+    history = FakeCollection("price_history")
+    path = write_fixture(tmp_path)
+
+    for run in range(2):
+        throttle = RecordingThrottle()
+        stored_hashes = product_csv.load_row_hashes(products, {1})
+        write = product_stream.product_write_batch(products, history, throttle, stored_hashes)
+        write(1, 7, product_csv.parse_file(str(path))["records"])
+        product_writes = sum(count for name, count in throttle.written if name == "products")
+
+        if run == 0:
+            assert product_writes == 2
+        else:
+            assert product_writes == 0
+
+    assert len(products.documents) == 2
+    assert next(p for p in products.documents if p["productId"] == 100)["marketPrice"] == 1.25
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sys
+
+import scryfall_client
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "watchlist"))
+
+import mtg_mass_price_fetch  # noqa: E402
+
+
+class NullWriter:
+    def __init__(self, *args, **kwargs):
+        self.operations = []
+
+    def add(self, operation):
+        self.operations.append(operation)
+
+    def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    def report(self):
+        pass
+
+
+class FallbackOnlyScryfall:
+    """Every product goes through the per-id lookup; productId 3 fails, 4 is unknown"""
+
+    def __init__(self, failing):
+        self.failing = failing
+
+    def card_by_tcgplayer_id(self, tcgplayer_id):
+        if tcgplayer_id in self.failing:
+            raise scryfall_client.ScryfallError("GET /cards/tcgplayer failed after 5 attempts")
+        if tcgplayer_id == 4:
+            return None
+        return {"id": f"card-{tcgplayer_id}", "prices": {"usd": "1.00"}}
+
+
+def run_update(monkeypatch, failing):
+    monkeypatch.setattr(mtg_mass_price_fetch.bulk_writer, "AdaptiveBulkWriter", NullWriter)
+    updater = mtg_mass_price_fetch.ScryfallPriceUpdater(scryfall=FallbackOnlyScryfall(failing))
+    checkpoints = []
+    updater.load_checkpoint = lambda: None
+    updater.save_checkpoint = lambda last, counts, status="running": checkpoints.append((last, status))
+    updater.scryfall_ids = lambda product_ids: {}
+    updater.iter_product_batches = lambda after: iter([[{"_id": i, "productId": i}] for i in range(1, 6)])
+    counts = asyncio.run(updater._update_prices(workers=2, restart=False))
+    return counts, checkpoints
+
+
+def test_failed_per_id_lookup_holds_the_checkpoint(monkeypatch):
+    counts, checkpoints = run_update(monkeypatch, failing={3})
+
+    assert counts == {"products": 5, "updated": 3, "not_found": 1, "errors": 1}
+    assert checkpoints[-1] == (2, "running")
+
+
+def test_run_without_failures_completes(monkeypatch):
+    counts, checkpoints = run_update(monkeypatch, failing=set())
+
+    assert counts["errors"] == 0
+    assert checkpoints[-1] == (5, "complete")
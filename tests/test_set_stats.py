@@ -0,0 +1,26 @@
+from datetime import datetime
+
+import import_steps
+import price_matrix
+import set_stats
+
+ROWS = [
+    {"productId": 100, "name": "Lightning Bolt", "subTypeName": "Normal", "extRarity": "C", "extNumber": "161",
+     "marketPrice": 1.25},
+    {"productId": 101, "name": "Basic Land", "subTypeName": "Normal", "extNumber": "290", "marketPrice": 0.1},
+    {"productId": 900, "name": "Alpha Booster Box", "subTypeName": "Normal", "marketPrice": 25000.0},
+]
+
+
+def test_sealed_products_are_left_out_of_set_stats(tmp_path):
+    prices, metadata = {}, {}
+    for row in ROWS:
+        import_steps.add_matrix_row(prices, metadata, row, group_id=7)
+    matrix = price_matrix.PriceMatrix(str(tmp_path))
+    matrix.append_day(datetime(2026, 10, 1), prices)
+
+    stats = set_stats.compute_set_stats(matrix, metadata)[7]
+
+    assert stats["cardCount"] == 2
+    assert stats["totalValue"] == 1.35
+    assert [entry["productId"] for entry in stats["top"]] == [100, 101]
@@ -1,17 +1,39 @@
+import argparse
+import asyncio
 import os
+import sys
+from collections import deque
+from datetime import datetime
 
-import requests
-import time
+import pymongo
 from pymongo import MongoClient
 import logging
 
+# Shared modules (scryfall_client, ...) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_writer
+import crosswalk
+import scryfall_client
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Collection lookups in flight at once; the shared token bucket still paces them
+FETCH_WORKERS = 4
+
+# Progress of each run (per game and set), so an interrupted run resumes after the
+# last checkpointed productId
+CHECKPOINTS_COLLECTION = "scryfall_price_checkpoints"
+
+# Batches between checkpoints; every write before a checkpoint has been acknowledged
+CHECKPOINT_BATCHES = 20
+
 
 class ScryfallPriceUpdater:
-    def __init__(self, mongo_uri=os.getenv('MONGO_URI'), db_name="mtgdbmongo", mtg_game_id=1, set_code=None):
+    def __init__(self, mongo_uri=os.getenv('MONGO_URI'), db_name="mtgdbmongo", mtg_game_id=1, set_code=None,
+                 scryfall=None):
         """Initialize the ScryfallPriceUpdater with MongoDB connection parameters."""
         self.mongo_uri = mongo_uri
         self.db_name = db_name
@@ -20,6 +42,8 @@ class ScryfallPriceUpdater:
         self.client = None
         self.db = None
         self.products = None
+        # Shared client: pooled session, global rate limit, response cache and retries
+        self.scryfall = scryfall or scryfall_client.get_client()
 
     def connect(self):
         """Connect to MongoDB database."""
@@ -38,76 +62,117 @@ class ScryfallPriceUpdater:
             self.client.close()
             logger.info("Disconnected from MongoDB")
 
-    def get_products_without_scryfall_price(self):
-        """Get all products that have a TCGPlayer ID but no Scryfall USD price."""
-        try:
-            # Query for products with TCGPlayer IDs but no Scryfall USD price
-            query = {
-                "gameId": self.mtg_game_id,
-                "productId": {"$exists": True, "$ne": None} #,
-                # "$or": [
-                #     {"scryfall_usd_price": {"$exists": False}},
-                #     {"scryfall_usd_price": None}
-                # ]
-            }
-
-            # Add set filter if specified
-            if self.set_code:
-                query["setCode"] = self.set_code
-
-            products = list(self.products.find(query))
-
-            if self.set_code:
-                logger.info(f"Found {len(products)} products without Scryfall prices in set {self.set_code}")
-            else:
-                logger.info(f"Found {len(products)} products without Scryfall prices across all sets")
-
-            return products
-        except Exception as e:
-            logger.error(f"Error fetching products: {e}")
-            return []
+    def iter_product_batches(self, after=None, batch_size=scryfall_client.MAX_IDENTIFIERS_PER_CALL):
+        """
+        Stream products with a TCGPlayer ID in productId order, in batches of `batch_size`.
+
+        Args:
+            after: Only products with a productId greater than this (resuming a run)
+        """
+        query = {"gameId": self.mtg_game_id, "productId": {"$exists": True, "$ne": None}}
+        if after is not None:
+            query["productId"]["$gt"] = after
+
+        # Add set filter if specified
+        if self.set_code:
+            query["setCode"] = self.set_code
+
+        cursor = self.products.find(
+            query, {"_id": 1, "productId": 1, "name": 1}, batch_size=5000
+        ).sort("productId", pymongo.ASCENDING)
+
+        batch = []
+        for product in cursor:
+            batch.append(product)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def price_fields(self, card_data):
+        """Extract only the pricing we want from a Scryfall card"""
+        prices = card_data.get('prices') or {}
+        return {
+            "scryfall_id": card_data.get('id'),
+            "scryfall_uri": card_data.get('uri'),
+            "scryfall_usd_price": float(prices.get('usd')) if prices.get('usd') else None,
+            "scryfall_eur_price": float(prices.get('eur')) if prices.get('eur') else None
+        }
 
     def get_scryfall_price_by_tcgplayer_id(self, tcgplayer_id):
         """
         Get price data from Scryfall for a specific TCGPlayer ID.
         Scryfall API allows looking up cards by TCGPlayer ID using the format:
         https://api.scryfall.com/cards/tcgplayer/{id}
+
+        Returns None only when Scryfall has no such card (404); failed requests raise
+        scryfall_client.ScryfallError.
         """
-        url = f"https://api.scryfall.com/cards/tcgplayer/{tcgplayer_id}"
         logger.debug(f"Fetching Scryfall data for TCGPlayer ID: {tcgplayer_id}")
 
-        try:
-            response = requests.get(url)
-
-            # Respect rate limits
-            time.sleep(0.1)
-
-            if response.status_code == 200:
-                card_data = response.json()
-                prices = card_data.get('prices', {})
-
-                # Extract only the pricing we want
-                price_data = {
-                    "scryfall_id": card_data.get('id'),
-                    "scryfall_uri": card_data.get('uri'),
-                    "scryfall_usd_price": float(prices.get('usd')) if prices.get('usd') else None,
-                    "scryfall_eur_price": float(prices.get('eur')) if prices.get('eur') else None
-                }
-
-                logger.debug(
-                    f"Price data for {card_data.get('name')}: USD=${price_data['scryfall_usd_price']}, EUR€{price_data['scryfall_eur_price']}")
-                return price_data
-            elif response.status_code == 404:
-                logger.warning(f"TCGPlayer ID {tcgplayer_id} not found in Scryfall")
-                return None
-            else:
-                logger.error(
-                    f"Error fetching data for TCGPlayer ID {tcgplayer_id}: {response.status_code}, {response.text}")
-                return None
-        except Exception as e:
-            logger.error(f"Exception fetching TCGPlayer ID {tcgplayer_id}: {e}")
+        card_data = self.scryfall.card_by_tcgplayer_id(tcgplayer_id)
+
+        if card_data:
+            price_data = self.price_fields(card_data)
+
+            logger.debug(
+                f"Price data for {card_data.get('name')}: USD=${price_data['scryfall_usd_price']}, EUR€{price_data['scryfall_eur_price']}")
+            return price_data
+        else:
+            logger.warning(f"TCGPlayer ID {tcgplayer_id} not found in Scryfall")
             return None
 
+    def scryfall_ids(self, product_ids):
+        """
+        productId -> Scryfall card id, from crosswalk links made on the card's own
+        tcgplayer_id (name-based links can point a product at a different printing)
+        """
+        links = self.db[crosswalk.LINKS_COLLECTION].find(
+            {"productId": {"$in": product_ids}, "method": "tcgplayer_id"},
+            {"_id": 0, "productId": 1, "card_id": 1}
+        )
+        return {link["productId"]: link["card_id"] for link in links}
+
+    def fetch_batch_prices(self, products):
+        """
+        Prices for one batch of products.
+
+        The collection endpoint cannot look cards up by TCGPlayer ID, so products are
+        mapped to Scryfall ids through the crosswalk's tcgplayer_id links and sent as
+        one /cards/collection call. Every other product (and any that Scryfall did not
+        return) falls back to the cached per-id lookup.
+
+        Returns:
+            Tuple of (dictionary of productId -> price data, None when Scryfall has no
+            card; set of productIds whose per-id lookup failed)
+        """
+        product_ids = [product["productId"] for product in products]
+        card_ids = self.scryfall_ids(product_ids)
+
+        products_by_card = {}
+        for product_id in product_ids:
+            if product_id in card_ids:
+                products_by_card.setdefault(card_ids[product_id], []).append(product_id)
+
+        prices = {}
+        if products_by_card:
+            cards, _ = self.scryfall.cards_collection({"id": card_id} for card_id in products_by_card)
+            for card in cards:
+                for product_id in products_by_card.get(card.get("id"), []):
+                    prices[product_id] = self.price_fields(card)
+
+        failed = set()
+        for product_id in product_ids:
+            if product_id not in prices:
+                try:
+                    prices[product_id] = self.get_scryfall_price_by_tcgplayer_id(product_id)
+                except Exception as e:
+                    # Not a "not found": keep it out of the checkpoint like a failed batch
+                    logger.error(f"Exception fetching TCGPlayer ID {product_id}: {e}")
+                    failed.add(product_id)
+        return prices, failed
+
     def format_price(self, price, currency="USD"):
         """Format price as currency string or return 'N/A' if None."""
         if price is None:
@@ -118,74 +183,154 @@ class ScryfallPriceUpdater:
             return f"€{price:.2f}"
         return f"{price:.2f} {currency}"
 
-    def update_missing_prices(self):
-        """Update products that don't have Scryfall prices yet."""
-        products = self.get_products_without_scryfall_price()
-
-        if not products:
-            set_info = f" for set {self.set_code}" if self.set_code else ""
-            logger.warning(f"No products without Scryfall prices found in database{set_info}")
-            return 0
-
-        updated_count = 0
-        not_found_count = 0
-        error_count = 0
-
+    def checkpoint_id(self):
+        return f"{self.mtg_game_id}:{self.set_code or '*'}"
+
+    def load_checkpoint(self):
+        """Last checkpointed productId of an unfinished run, or None"""
+        checkpoint = self.db[CHECKPOINTS_COLLECTION].find_one({"_id": self.checkpoint_id()})
+        if checkpoint and checkpoint.get("status") == "running":
+            return checkpoint.get("last_product_id")
+        return None
+
+    def save_checkpoint(self, last_product_id, counts, status="running"):
+        self.db[CHECKPOINTS_COLLECTION].update_one(
+            {"_id": self.checkpoint_id()},
+            {"$set": {
+                "last_product_id": last_product_id,
+                "status": status,
+                "counts": dict(counts),
+                "updated_at": datetime.now()
+            }},
+            upsert=True
+        )
+
+    def _apply(self, writer, products, prices, counts):
+        """Queue the price updates of one fetched batch"""
         for product in products:
-            product_id = product.get('productId')
-            product_name = product.get('name', 'Unknown')
-
-            if not product_id:
-                logger.debug(f"Skipping product with no TCGPlayer ID: {product_name}")
+            counts["products"] += 1
+            price_data = prices.get(product["productId"])
+            # Only update fields that have values
+            update_fields = {k: v for k, v in (price_data or {}).items() if v is not None}
+            if not update_fields:
+                logger.debug(f"No price data found for: {product.get('name', 'Unknown')} "
+                             f"(TCGPlayer ID: {product['productId']})")
+                counts["not_found"] += 1
                 continue
+            writer.add(pymongo.UpdateOne({"_id": product["_id"]}, {"$set": update_fields}))
+            counts["updated"] += 1
 
-            price_data = self.get_scryfall_price_by_tcgplayer_id(product_id)
+    async def _update_prices(self, workers, restart):
+        """
+        Fetch and apply every batch. The checkpoint never moves past a batch whose
+        collection lookup (or any of its per-id lookups) failed; failed products are
+        retried once at the end of the run, and a run that still has failures stays
+        resumable from before the first of them.
+        """
+        after = None if restart else self.load_checkpoint()
+        if after is not None:
+            logger.info(f"Resuming after productId {after}")
+
+        counts = {"products": 0, "updated": 0, "not_found": 0, "errors": 0}
+        semaphore = asyncio.Semaphore(workers)
+
+        async def fetch(products):
+            """(prices, products whose lookup failed) for one batch"""
+            async with semaphore:
+                try:
+                    prices, failed_ids = await asyncio.to_thread(self.fetch_batch_prices, products)
+                except scryfall_client.ScryfallError as e:
+                    logger.error(f"Batch of {len(products)} products starting at productId "
+                                 f"{products[0]['productId']} failed: {e}")
+                    return {}, products
+                return prices, [product for product in products if product["productId"] in failed_ids]
+
+        def apply(products, result):
+            prices, failed_products = result
+            if failed_products:
+                failed.append(failed_products)
+                failed_ids = {product["productId"] for product in failed_products}
+                products = [product for product in products if product["productId"] not in failed_ids]
+            self._apply(writer, products, prices, counts)
+
+        writer = bulk_writer.AdaptiveBulkWriter(self.products, name="products scryfall prices")
+        pending = deque()
+        failed = []
+        batches_applied = 0
+        last_product_id = after
+        last_seen = after
+
+        async def apply_next():
+            nonlocal batches_applied, last_product_id, last_seen
+            products, task = pending.popleft()
+            apply(products, await task)
+            batches_applied += 1
+            last_seen = products[-1]["productId"]
+            if not failed:
+                last_product_id = products[-1]["productId"]
+            if batches_applied % CHECKPOINT_BATCHES == 0:
+                writer.drain()
+                self.save_checkpoint(last_product_id, counts)
+                logger.info(f"Checkpoint at productId {last_product_id}: {counts}")
 
-            if not price_data:
-                logger.warning(f"No price data found for: {product_name} (TCGPlayer ID: {product_id})")
-                not_found_count += 1
-                continue
+        try:
+            # Batches are applied in productId order, so a checkpoint covers every product before it
+            for products in self.iter_product_batches(after):
+                pending.append((products, asyncio.create_task(fetch(products))))
+                if len(pending) >= workers * 2:
+                    await apply_next()
+            while pending:
+                await apply_next()
+
+            retried = failed[:]
+            failed.clear()
+            if retried:
+                logger.info(f"Retrying {sum(len(products) for products in retried)} failed products")
+            for products in retried:
+                apply(products, await fetch(products))
+        finally:
+            writer.close()
+        writer.report()
+
+        counts["errors"] = sum(len(products) for products in failed)
+        counts["products"] += counts["errors"]
+        if failed:
+            # last_product_id stopped before the first failed batch
+            self.save_checkpoint(last_product_id, counts)
+            logger.warning(f"{counts['errors']} products still failed; the next run resumes after productId {last_product_id}")
+        else:
+            self.save_checkpoint(last_seen, counts, status="complete")
+        return counts
+
+    def update_missing_prices(self, workers=FETCH_WORKERS, restart=False):
+        """
+        Add Scryfall prices to every product with a TCGPlayer ID.
+
+        Products are streamed in productId order in batches of up to 75, each batch is
+        priced with one collection lookup (up to `workers` in flight under the shared
+        rate limit), and updates go out as unordered bulk writes. Progress is
+        checkpointed so an interrupted run resumes where it stopped unless `restart`.
 
-            try:
-                # Only update fields that have values
-                update_fields = {k: v for k, v in price_data.items() if v is not None}
-
-                if update_fields:
-                    self.products.update_one(
-                        {"_id": product["_id"]},
-                        {"$set": update_fields}
-                    )
-                    updated_count += 1
-
-                    # Format price updates for logging
-                    usd_price_str = self.format_price(price_data.get('scryfall_usd_price'), 'USD')
-                    eur_price_str = self.format_price(price_data.get('scryfall_eur_price'), 'EUR')
-
-                    # Include TCGPlayer ID in the "Updated prices for" message
-                    logger.info(
-                        f"Added prices for: {product_name} (TCGPlayer ID: {product_id}) (USD: {usd_price_str}, EUR: {eur_price_str})")
-                else:
-                    logger.warning(f"No valid price fields found for: {product_name} (TCGPlayer ID: {product_id})")
-                    not_found_count += 1
-            except Exception as e:
-                logger.error(f"Error updating product {product_name} (TCGPlayer ID: {product_id}): {e}")
-                error_count += 1
+        Returns:
+            Number of products updated
+        """
+        counts = asyncio.run(self._update_prices(workers, restart))
 
         set_info = f" for set {self.set_code}" if self.set_code else ""
-        logger.info(f"Added prices for {updated_count} products{set_info}")
-        logger.info(f"Could not find data for {not_found_count} products{set_info}")
-        logger.info(f"Encountered errors updating {error_count} products{set_info}")
+        logger.info(f"Added prices for {counts['updated']} products{set_info}")
+        logger.info(f"Could not find data for {counts['not_found']} products{set_info}")
+        logger.info(f"Encountered errors updating {counts['errors']} products{set_info}")
 
-        return updated_count
+        return counts["updated"]
 
-    def run(self):
+    def run(self, workers=FETCH_WORKERS, restart=False):
         """Run the Scryfall price update process for products without prices."""
         try:
             self.connect()
             set_info = f" for set {self.set_code}" if self.set_code else ""
             logger.info(f"Starting price population process{set_info} for products without Scryfall prices")
 
-            updated_count = self.update_missing_prices()
+            updated_count = self.update_missing_prices(workers, restart)
 
             logger.info(f"Successfully added Scryfall pricing data to {updated_count} products{set_info}")
         except Exception as e:
@@ -197,12 +342,18 @@ class ScryfallPriceUpdater:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add Scryfall prices to TCGplayer products")
+    parser.add_argument("--set-code", help="Only products of this set")
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS, help="Collection lookups in flight")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an unfinished run")
+    args = parser.parse_args()
+
     # Update all products without Scryfall prices
     # Can also target a specific set with set_code parameter
     updater = ScryfallPriceUpdater(
         mongo_uri="mongodb://localhost:27017/",
         db_name="tcgprime_db",
         mtg_game_id=1,
-        set_code=None  # Set to None to process all sets, or specify a set code
+        set_code=args.set_code  # None processes all sets
     )
-    updater.run()
\ No newline at end of file
+    updater.run(args.workers, args.restart)